@@ -1,14 +1,80 @@
 import os
-import tempfile
-import subprocess
+import sys
+import json
+import asyncio
+import base64
+import shutil
 import logging
-from fastapi import FastAPI, Form
+import tempfile
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'engines'))
+import rpc
+import tracing
 
 logging.basicConfig(level=logging.DEBUG)
 
-app = FastAPI()
+# Response headers carrying the durations reported by the engine
+TIMING_HEADERS = {
+    'compile_ms': 'X-Compile-Time-Ms',
+    'run_ms': 'X-Run-Time-Ms',
+}
+
+# Return each request's trace in a Server-Timing header, not only when the
+# client asks for it with an "X-Trace: 1" request header
+TRACE_HEADER = os.environ.get('CODE_RUNNER_TRACE_HEADER', '') == '1'
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), 'templates', 'solution')
+
+# Template contents by language, loaded during warm-up
+TEMPLATES = {}
+
+# Seconds a worker waits for the supervisor to take a finished trace
+TRACE_RPC_TIMEOUT = 1.0
+
+# Seconds between two attempts to reach the supervisor during warm-up
+WARMUP_RETRY_INTERVAL = 1.0
+
+
+async def warm_up(app):
+    """Prepare this worker so the first request does not pay for it.
+
+    Builds the OpenAPI schema, loads the solution templates and opens the
+    first connection to the supervisor, which warms up the sandboxes on
+    its own (see engines/warmup.py).
+    """
+    app.openapi()
+    for language, template_file in TEMPLATE_FILES.items():
+        try:
+            with open(os.path.join(TEMPLATES_DIR, template_file), encoding='utf-8') as f:
+                TEMPLATES[language] = f.read()
+        except OSError as e:
+            logging.warning(f"template for {language} not loaded: {e}")
+    while True:
+        try:
+            await run_in_threadpool(call_supervisor, 'status')
+            break
+        except rpc.RpcError:
+            await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+    app.state.warm = True
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Warm up in the background; GET /ready tells when everything is ready."""
+    app.state.warm = False
+    task = asyncio.create_task(warm_up(app))
+    try:
+        yield
+    finally:
+        task.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,6 +82,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=list(TIMING_HEADERS.values()) + ['X-Session-Rebuilt', 'X-Project-Id',
+                                                    'X-Trace-Id', 'Server-Timing'],
 )
 
 LANGUAGE_EXT = {
@@ -29,17 +97,6 @@ LANGUAGE_EXT = {
     'csharp': '.cs'
 }
 
-MAIN_FILE_NAMES = {
-    '.py': 'main.py',
-    '.js': 'main.js',
-    '.rb': 'main.rb',
-    '.php': 'main.php',
-    '.java': 'Main.java',
-    '.c': 'main.c',
-    '.cpp': 'main.cpp',
-    '.cs': 'Program.cs'
-}
-
 TEMPLATE_FILES = {
     'python': 'solution.py',
     'javascript': 'solution.js',
@@ -52,29 +109,97 @@ TEMPLATE_FILES = {
 }
 
 
-def run_code(lang, code, deps=''):
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Record a trace of every API request (see engines/tracing.py)."""
+    if request.url.path.startswith('/debug/') or request.url.path == '/ready':
+        return await call_next(request)
+    with tracing.start_trace(f"{request.method} {request.url.path}", buffer=None) as trace:
+        response = await call_next(request)
+    await run_in_threadpool(publish_trace, trace)
+    response.headers['X-Trace-Id'] = trace.id
+    if TRACE_HEADER or request.headers.get('X-Trace') == '1':
+        response.headers['Server-Timing'] = tracing.server_timing(trace)
+    return response
+
+
+def publish_trace(trace):
+    """Keep a finished trace in the supervisor, where every worker finds it."""
+    try:
+        rpc.call('trace_add', timeout=TRACE_RPC_TIMEOUT, trace=trace.to_dict())
+    except (OSError, rpc.RpcError):
+        # Only this worker can return it then
+        tracing.TRACES.add(trace)
+
+
+def timing_headers(timings):
+    return {TIMING_HEADERS[key]: str(value) for key, value in timings.items()
+            if key in TIMING_HEADERS}
+
+
+def call_supervisor(method, **params):
+    """Call the sandbox supervisor (engines/supervisor.py) over its unix socket."""
+    try:
+        return rpc.call(method, **params)
+    except OSError as e:
+        raise rpc.RpcError(f"Sandbox supervisor unavailable: {e}")
+
+
+def run_code(lang, code, deps='', profile=None, std=None, timings=None, benchmark=None,
+             profiling=None):
+    """Run ``code`` through the supervisor and return its output.
+
+    ``timings`` receives the compile/run durations. ``benchmark`` holds
+    ``runs`` and ``warmup`` for a benchmark run and receives its
+    statistics under ``results``. A ``profiling`` dict requests a profile
+    run and receives the profile summary under ``results``.
+    """
     ext = LANGUAGE_EXT.get(lang)
     if not ext:
         return f'Unsupported language: {lang}'
-    with tempfile.TemporaryDirectory() as tmpdir:
-        main_file = MAIN_FILE_NAMES.get(ext, 'prog' + ext)
-        path = os.path.join(tmpdir, main_file)
-        with open(path, 'w') as f:
-            f.write(code)
-        run_code_path = os.path.join(os.path.dirname(__file__), 'engines', 'run_code.py')
-        import sys
-        args = [sys.executable, run_code_path, path]
-        dep_list = deps.strip().split()
-        if dep_list:
-            args += ['--deps'] + dep_list
-        
-        logging.debug(f"args={args}")
-        logging.debug(f"code={code}")
-        result = subprocess.run(args, text=True, capture_output=True)
-        logging.debug(f"returncode={result.returncode}")
-        logging.debug(f"stdout={result.stdout}")
-        logging.debug(f"stderr={result.stderr}")
-        return result.stdout + result.stderr
+    dep_list = deps.strip().split()
+    
+    logging.debug(f"lang={lang} deps={dep_list}")
+    logging.debug(f"code={code}")
+    try:
+        params = {'benchmark': {k: benchmark[k] for k in ('runs', 'warmup')}} if benchmark else {}
+        if profiling is not None:
+            params['profiling'] = True
+        result = call_supervisor('run', ext=ext, code=code, deps=dep_list,
+                                 profile=profile, std=std, **params)
+    except rpc.RpcError as e:
+        return f"Error: {e}\n"
+    logging.debug(f"returncode={result['exit_code']}")
+    logging.debug(f"output={result['output']}")
+    if timings is not None:
+        timings.update(result['timings'])
+    if benchmark:
+        benchmark['results'] = result.get('benchmark')
+        benchmark['exit_code'] = result['exit_code']
+    if profiling is not None:
+        profiling['results'] = result.get('profile')
+        profiling['exit_code'] = result['exit_code']
+    return result['output']
+
+
+async def execute(language, code, deps, profile, std, runs, warmup, profiling):
+    """Run a submission; benchmark and profile runs answer with JSON."""
+    timings = {}
+    benchmark = {'runs': runs, 'warmup': warmup} if runs else None
+    profile_results = {} if profiling else None
+    output = await run_in_threadpool(
+        run_code, language, code, deps, profile or None, std or None, timings, benchmark,
+        profile_results
+    )
+    mode = benchmark if benchmark is not None else profile_results
+    if mode is None:
+        return PlainTextResponse(output, headers=timing_headers(timings))
+    body = {'output': output, 'exit_code': mode.get('exit_code'), 'timings': timings}
+    if benchmark is not None:
+        body['benchmark'] = benchmark.get('results')
+    if profile_results is not None:
+        body['profile'] = profile_results.get('results')
+    return JSONResponse(body, headers=timing_headers(timings))
 
 
 @app.get("/")
@@ -86,20 +211,237 @@ async def root():
 async def run_code_endpoint(
     language: str = Form(...),
     code: str = Form(...),
-    deps: str = Form(default="")
+    deps: str = Form(default=""),
+    profile: str = Form(default=""),
+    std: str = Form(default=""),
+    benchmark: int = Form(default=0),
+    warmup: int = Form(default=1),
+    profiling: bool = Form(default=False)
 ):
-    output = run_code(language, code, deps)
-    return PlainTextResponse(output)
+    return await execute(language, code, deps, profile, std, benchmark, warmup, profiling)
 
 
 @app.post("/run")
 async def run_code_endpoint_alt(
     language: str = Form(...),
     code: str = Form(...),
+    deps: str = Form(default=""),
+    profile: str = Form(default=""),
+    std: str = Form(default=""),
+    benchmark: int = Form(default=0),
+    warmup: int = Form(default=1),
+    profiling: bool = Form(default=False)
+):
+    return await execute(language, code, deps, profile, std, benchmark, warmup, profiling)
+
+
+def supervisor_error(e):
+    """Map an error reported by the supervisor to an HTTP response."""
+    if e.kind == 'SessionNotFound':
+        return PlainTextResponse(str(e), status_code=404)
+    if e.kind == 'ValueError':
+        return PlainTextResponse(str(e), status_code=400)
+    return PlainTextResponse(str(e), status_code=503)
+
+
+@app.post("/judge")
+async def judge(
+    language: str = Form(...),
+    code: str = Form(...),
+    expected: UploadFile = File(...),
+    mode: str = Form(default="token"),
+    tolerance: float = Form(default=None),
+    profile: str = Form(default=""),
+    std: str = Form(default="")
+):
+    """Run ``code`` and compare its output with the ``expected`` file as it streams.
+
+    ``mode`` is ``exact``, ``token`` or ``whitespace``; ``tolerance`` allows
+    numeric tokens to differ by that much. Returns the verdict as JSON.
+    """
+    ext = LANGUAGE_EXT.get(language)
+    if not ext:
+        return PlainTextResponse(f"Unsupported language: {language}", status_code=400)
+    # The supervisor runs on this machine and reads the expected output from disk
+    with tempfile.NamedTemporaryFile(prefix='code-runner-expected-', delete=False) as f:
+        await run_in_threadpool(shutil.copyfileobj, expected.file, f)
+    try:
+        result = await run_in_threadpool(
+            call_supervisor, 'judge', ext=ext, code=code, expected_path=f.name, mode=mode,
+            tolerance=tolerance, profile=profile or None, std=std or None
+        )
+    except rpc.RpcError as e:
+        return supervisor_error(e)
+    finally:
+        os.unlink(f.name)
+    return JSONResponse(result, headers=timing_headers(result['timings']))
+
+
+@app.post("/session")
+async def create_session(
+    language: str = Form(...),
     deps: str = Form(default="")
 ):
-    output = run_code(language, code, deps)
-    return PlainTextResponse(output)
+    """Allocate a sandbox that is kept alive between runs."""
+    ext = LANGUAGE_EXT.get(language)
+    if not ext:
+        return PlainTextResponse(f"Unsupported language: {language}", status_code=400)
+    try:
+        return await run_in_threadpool(
+            call_supervisor, 'session_create', ext=ext, deps=deps.strip().split()
+        )
+    except rpc.RpcError as e:
+        return supervisor_error(e)
+
+
+@app.post("/session/{session_id}/run")
+async def run_in_session(
+    session_id: str,
+    code: str = Form(default=None),
+    files: str = Form(default=""),
+    profile: str = Form(default=""),
+    std: str = Form(default="")
+):
+    """Run in a session.
+
+    ``code`` replaces the main file and ``files`` is a JSON map of other
+    changed files (null deletes a file). Unchanged files can be omitted.
+    """
+    try:
+        file_map = json.loads(files) if files else {}
+    except ValueError as e:
+        return PlainTextResponse(f"Invalid files: {e}", status_code=400)
+    if not isinstance(file_map, dict):
+        return PlainTextResponse("Invalid files: expected a JSON object", status_code=400)
+    try:
+        result = await run_in_threadpool(
+            call_supervisor, 'session_run', session_id=session_id, files=file_map,
+            code=code, profile=profile or None, std=std or None
+        )
+    except rpc.RpcError as e:
+        return supervisor_error(e)
+    headers = timing_headers(result['timings'])
+    headers['X-Session-Rebuilt'] = str(result['rebuilt']).lower()
+    return PlainTextResponse(result['output'], headers=headers)
+
+
+@app.delete("/session/{session_id}")
+async def close_session(session_id: str):
+    try:
+        await run_in_threadpool(call_supervisor, 'session_close', session_id=session_id)
+    except rpc.RpcError as e:
+        return supervisor_error(e)
+    return PlainTextResponse("Session closed")
+
+
+@app.post("/project/run")
+async def run_project(
+    language: str = Form(...),
+    project_id: str = Form(default=""),
+    files: str = Form(default=""),
+    archive: UploadFile = File(default=None),
+    entry: str = Form(default=""),
+    profile: str = Form(default=""),
+    std: str = Form(default="")
+):
+    """Build and run a multi-file project.
+
+    The tree is a JSON map in ``files`` and/or a tar or zip ``archive``.
+    Passing the ``project_id`` of an earlier run (returned in the
+    X-Project-Id header) rebuilds only what changed since then. Ids are
+    issued by the server; any other id starts a new project.
+    ``entry`` is the main file for interpreted languages or the main
+    class for Java.
+    """
+    ext = LANGUAGE_EXT.get(language)
+    if not ext:
+        return PlainTextResponse(f"Unsupported language: {language}", status_code=400)
+    try:
+        file_map = json.loads(files) if files else {}
+    except ValueError as e:
+        return PlainTextResponse(f"Invalid files: {e}", status_code=400)
+    if not isinstance(file_map, dict):
+        return PlainTextResponse("Invalid files: expected a JSON object", status_code=400)
+    params = {}
+    if archive is not None:
+        params['archive'] = base64.b64encode(await archive.read()).decode('ascii')
+        params['archive_name'] = archive.filename or ''
+    try:
+        result = await run_in_threadpool(
+            call_supervisor, 'project_run', ext=ext, project_id=project_id or None,
+            files=file_map, entry=entry or None, profile=profile or None,
+            std=std or None, **params
+        )
+    except rpc.RpcError as e:
+        return supervisor_error(e)
+    headers = timing_headers(result['timings'])
+    headers['X-Project-Id'] = result['project_id']
+    return PlainTextResponse(result['output'], headers=headers)
+
+
+@app.delete("/project/{project_id}")
+async def delete_project(project_id: str):
+    try:
+        await run_in_threadpool(call_supervisor, 'project_delete', project_id=project_id)
+    except rpc.RpcError as e:
+        return supervisor_error(e)
+    return PlainTextResponse("Project deleted")
+
+
+@app.get("/nodes")
+async def list_nodes():
+    """Capacity report of the executor nodes."""
+    try:
+        return await run_in_threadpool(call_supervisor, 'nodes')
+    except rpc.RpcError as e:
+        return PlainTextResponse(str(e), status_code=503)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Counters of the supervisor's background maintenance (engines/reaper.py)."""
+    try:
+        return await run_in_threadpool(call_supervisor, 'metrics')
+    except rpc.RpcError as e:
+        return PlainTextResponse(str(e), status_code=503)
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once this worker and the supervisor are warmed up."""
+    if not app.state.warm:
+        return JSONResponse({'ready': False, 'state': 'starting'}, status_code=503)
+    try:
+        report = await run_in_threadpool(call_supervisor, 'ready')
+    except rpc.RpcError as e:
+        return JSONResponse({'ready': False, 'state': 'unavailable', 'error': str(e)},
+                            status_code=503)
+    report.pop('trace', None)
+    return JSONResponse(report, status_code=200 if report['ready'] else 503)
+
+
+@app.get("/debug/traces")
+async def list_traces(limit: int = 50):
+    """Most recent request traces of all workers, newest first."""
+    try:
+        traces = await run_in_threadpool(call_supervisor, 'traces', limit=limit)
+    except rpc.RpcError:
+        traces = []
+    # Plus those this worker kept while the supervisor was unavailable
+    traces += tracing.TRACES.list(limit)
+    return sorted(traces, key=lambda trace: trace['start'], reverse=True)[:limit]
+
+
+@app.get("/debug/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    try:
+        trace = await run_in_threadpool(call_supervisor, 'trace_get', trace_id=trace_id)
+    except rpc.RpcError:
+        trace = None
+    trace = trace or tracing.TRACES.get(trace_id)
+    if trace is None:
+        return PlainTextResponse(f"Trace not found: {trace_id}", status_code=404)
+    return trace
 
 
 @app.get("/template/{language}")
@@ -107,8 +449,10 @@ async def get_template(language: str):
     template_file = TEMPLATE_FILES.get(language)
     if not template_file:
         return PlainTextResponse(f"Template not found for language: {language}", status_code=404)
+    if language in TEMPLATES:
+        return PlainTextResponse(TEMPLATES[language])
     
-    template_path = os.path.join(os.path.dirname(__file__), 'templates', 'solution', template_file)
+    template_path = os.path.join(TEMPLATES_DIR, template_file)
     
     try:
         with open(template_path, 'r', encoding='utf-8') as f:
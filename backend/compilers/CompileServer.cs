@@ -0,0 +1,61 @@
+using System;
+using System.IO;
+using System.Linq;
+using System.Threading;
+using Mono.CSharp;
+
+// Warm mcs service used by engines/compile_server.py.
+//
+// Watches a spool directory for job directories containing src/*.cs and an
+// empty "request" file. The assembly is written to out/Program.exe, compiler
+// messages to "diagnostics" and the exit status to "status" (created last).
+// The compiler stays loaded in this Mono runtime between jobs.
+class CompileServer
+{
+    static void Main(string[] args)
+    {
+        string spool = args[0];
+        File.WriteAllText(Path.Combine(spool, "ready"), "");
+
+        while (true)
+        {
+            bool idle = true;
+            foreach (string job in Directory.GetDirectories(spool))
+            {
+                if (File.Exists(Path.Combine(job, "request")) && !File.Exists(Path.Combine(job, "status")))
+                {
+                    Compile(job);
+                    idle = false;
+                }
+            }
+            if (idle)
+            {
+                Thread.Sleep(5);
+            }
+        }
+    }
+
+    static void Compile(string job)
+    {
+        var diagnostics = new StringWriter();
+        bool ok;
+        try
+        {
+            string output = Path.Combine(job, "out");
+            Directory.CreateDirectory(output);
+            string[] arguments = new[] { "-out:" + Path.Combine(output, "Program.exe") }
+                .Concat(Directory.GetFiles(Path.Combine(job, "src"), "*.cs"))
+                .ToArray();
+            ok = CompilerCallableEntryPoint.InvokeCompiler(arguments, diagnostics);
+        }
+        catch (Exception e)
+        {
+            diagnostics.WriteLine("Compile server error: " + e.Message);
+            ok = false;
+        }
+        File.WriteAllText(Path.Combine(job, "diagnostics"), diagnostics.ToString());
+        string tmp = Path.Combine(job, "status.tmp");
+        File.WriteAllText(tmp, ok ? "0" : "1");
+        File.Move(tmp, Path.Combine(job, "status"));
+    }
+}
@@ -0,0 +1,68 @@
+import javax.tools.JavaCompiler;
+import javax.tools.ToolProvider;
+import java.io.ByteArrayOutputStream;
+import java.io.IOException;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.DirectoryStream;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.nio.file.StandardCopyOption;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.stream.Collectors;
+import java.util.stream.Stream;
+
+/**
+ * Warm javac service used by engines/compile_server.py.
+ *
+ * Watches a spool directory for job directories containing src/*.java and an
+ * empty "request" file. Classes are written to out/, compiler messages to
+ * "diagnostics" and the exit status to "status" (created last). The compiler
+ * stays loaded in this JVM, so only the first job pays for JIT warm-up.
+ */
+public class CompileServer {
+    public static void main(String[] args) throws Exception {
+        Path spool = Paths.get(args[0]);
+        JavaCompiler compiler = ToolProvider.getSystemJavaCompiler();
+        Files.writeString(spool.resolve("ready"), "");
+
+        while (true) {
+            boolean idle = true;
+            try (DirectoryStream<Path> jobs = Files.newDirectoryStream(spool, Files::isDirectory)) {
+                for (Path job : jobs) {
+                    if (Files.exists(job.resolve("request")) && !Files.exists(job.resolve("status"))) {
+                        compile(compiler, job);
+                        idle = false;
+                    }
+                }
+            }
+            if (idle) {
+                Thread.sleep(5);
+            }
+        }
+    }
+
+    static void compile(JavaCompiler compiler, Path job) throws IOException {
+        ByteArrayOutputStream diagnostics = new ByteArrayOutputStream();
+        int status;
+        try {
+            Path out = job.resolve("out");
+            Files.createDirectories(out);
+            List<String> options = new ArrayList<>(List.of("-proc:none", "-d", out.toString()));
+            try (Stream<Path> sources = Files.list(job.resolve("src"))) {
+                options.addAll(sources.map(Path::toString)
+                        .filter(name -> name.endsWith(".java"))
+                        .collect(Collectors.toList()));
+            }
+            status = compiler.run(null, diagnostics, diagnostics, options.toArray(new String[0]));
+        } catch (Exception e) {
+            diagnostics.write(("Compile server error: " + e + "\n").getBytes(StandardCharsets.UTF_8));
+            status = 1;
+        }
+        Files.write(job.resolve("diagnostics"), diagnostics.toByteArray());
+        Path tmp = job.resolve("status.tmp");
+        Files.writeString(tmp, Integer.toString(status));
+        Files.move(tmp, job.resolve("status"), StandardCopyOption.ATOMIC_MOVE);
+    }
+}
@@ -1,3 +1,24 @@
 FROM gcc:latest
 
-WORKDIR /app
\ No newline at end of file
+WORKDIR /app
+
+# Precompiled common standard headers, one variant per compile profile and
+# -std= value (see COMPILE_PROFILES and DEFAULT_STANDARDS in engines/run_code.py).
+# gcc picks the matching variant from each <header>.gch directory and falls
+# back to the regular header for other flag combinations. gcc only loads a
+# precompiled header for the first #include of a file, before any other
+# code, so programs starting with e.g. #include <stdio.h> benefit; the
+# headers are not force-included (-include) because that would declare
+# their names, such as math.h's y1, in programs that never included them.
+RUN set -e; \
+    for header in stdio.h stdlib.h string.h math.h; do \
+      mkdir -p "/usr/local/include/pch/$header.gch"; \
+      for std in gnu17 c11 c17; do \
+        for opt in O0 O2; do \
+          echo "#include <$header>" > /tmp/pch.h; \
+          gcc -std=$std -$opt -x c-header /tmp/pch.h \
+            -o "/usr/local/include/pch/$header.gch/$std-$opt.gch"; \
+        done; \
+      done; \
+    done; \
+    rm /tmp/pch.h
@@ -1,3 +1,25 @@
 FROM gcc:latest
 
-WORKDIR /app
\ No newline at end of file
+WORKDIR /app
+
+# Precompiled common standard headers, one variant per compile profile and
+# -std= value (see COMPILE_PROFILES and DEFAULT_STANDARDS in engines/run_code.py).
+# gcc picks the matching variant from each <header>.gch directory and falls
+# back to the regular header for other flag combinations. bits/stdc++.h
+# variants are large, so only the default and C++20 standards are covered.
+# gcc only loads a precompiled header for the first #include of a file,
+# before any other code, so programs starting with #include <bits/stdc++.h>
+# or <iostream> benefit; the headers are not force-included (-include)
+# because that would change name lookup in programs that never included them.
+RUN set -e; \
+    for header in bits/stdc++.h iostream; do \
+      mkdir -p "/usr/local/include/pch/$header.gch"; \
+      for std in gnu++17 c++20; do \
+        for opt in O0 O2; do \
+          echo "#include <$header>" > /tmp/pch.h; \
+          g++ -std=$std -$opt -x c++-header /tmp/pch.h \
+            -o "/usr/local/include/pch/$header.gch/$std-$opt.gch"; \
+        done; \
+      done; \
+    done; \
+    rm /tmp/pch.h
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Demand-driven capacity controller for per-language sandboxes.
+
+Tracks arrival rate and service time for every language over a sliding
+window and turns them into two targets per language: how many runs may
+execute concurrently and how many warm (pre-started) sandboxes to keep.
+Targets are fitted into a global memory budget and idle languages are
+scaled down to zero warm sandboxes.
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from tracing import span
+
+logger = logging.getLogger('code-runner.autoscaler')
+
+# Memory reserved by one sandbox (matches SANDBOX_MEM_LIMIT in run_code.py)
+SANDBOX_MEMORY_MB = 128
+
+# Global memory available to sandboxes, running and warm combined
+DEFAULT_MEMORY_BUDGET_MB = int(os.environ.get('CODE_RUNNER_MEMORY_BUDGET_MB', '2048'))
+
+# Sliding window used for rate and service time estimates
+DEFAULT_WINDOW_SECONDS = 60.0
+
+# Languages without arrivals for this long get no warm capacity
+DEFAULT_IDLE_SECONDS = 300.0
+
+# Interval between two rebalance decisions
+DEFAULT_INTERVAL_SECONDS = 5.0
+
+# Upper bound for the concurrency limit of a single language
+MAX_CONCURRENCY_PER_LANGUAGE = 16
+
+# Extra concurrency over the expected number of busy sandboxes
+HEADROOM = 1.5
+
+# Concurrency every language keeps while idle, so the first burst after a
+# quiet period is not serialized until the next rebalance
+MIN_CONCURRENCY = int(os.environ.get('CODE_RUNNER_MIN_CONCURRENCY', '2'))
+
+
+class LanguageStats:
+    """Sliding-window arrival and service time statistics for one language."""
+
+    def __init__(self, window):
+        self.window = window
+        self.arrivals = deque()
+        self.services = deque()
+        self.last_arrival = None
+
+    def record_arrival(self, now):
+        self.arrivals.append(now)
+        self.last_arrival = now
+
+    def record_service(self, now, duration):
+        self.services.append((now, duration))
+
+    def expire(self, now):
+        cutoff = now - self.window
+        while self.arrivals and self.arrivals[0] < cutoff:
+            self.arrivals.popleft()
+        while self.services and self.services[0][0] < cutoff:
+            self.services.popleft()
+
+    def arrival_rate(self):
+        """Arrivals per second over the window."""
+        return len(self.arrivals) / self.window
+
+    def mean_service_time(self):
+        """Mean run duration in seconds over the window (0 when unknown)."""
+        if not self.services:
+            return 0.0
+        return sum(duration for _, duration in self.services) / len(self.services)
+
+
+class LanguageLimiter:
+    """Counting semaphore whose limit can be changed while in use."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def set_limit(self, limit):
+        with self.condition:
+            self.limit = limit
+            self.condition.notify_all()
+
+
+class Autoscaler:
+    """Resize per-language concurrency and warm capacity from observed demand."""
+
+    def __init__(self, languages, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                 window=DEFAULT_WINDOW_SECONDS, idle_timeout=DEFAULT_IDLE_SECONDS,
+                 sandbox_memory_mb=SANDBOX_MEMORY_MB, clock=time.monotonic):
+        self.memory_budget_mb = memory_budget_mb
+        self.sandbox_memory_mb = sandbox_memory_mb
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.stats = {lang: LanguageStats(window) for lang in languages}
+        self.floor = self.concurrency_floor()
+        self.limiters = {lang: LanguageLimiter(self.floor) for lang in languages}
+        self.current = {lang: {'concurrency': self.floor, 'warm': 0} for lang in languages}
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def slots(self):
+        """Number of sandboxes that fit into the memory budget."""
+        return self.memory_budget_mb // self.sandbox_memory_mb
+
+    def concurrency_floor(self):
+        """Per-language minimum concurrency, clamped to the memory budget."""
+        languages = max(1, len(self.stats))
+        floor = max(1, min(MIN_CONCURRENCY, self.slots // languages))
+        if floor * languages > self.slots:
+            # One slot per language is needed so requests never block forever
+            logger.warning("memory budget fits %d sandboxes but %d languages need "
+                           "one slot each; overcommitting", self.slots, languages)
+        elif floor < MIN_CONCURRENCY:
+            logger.warning("memory budget fits %d sandboxes; minimum concurrency "
+                           "clamped from %d to %d", self.slots, MIN_CONCURRENCY, floor)
+        return floor
+
+    def record_arrival(self, lang):
+        with self.lock:
+            self.stats[lang].record_arrival(self.clock())
+
+    def record_completion(self, lang, duration):
+        with self.lock:
+            self.stats[lang].record_service(self.clock(), duration)
+
+    @contextmanager
+    def admit(self, lang):
+        """Wait for a concurrency slot for ``lang`` and record the run."""
+        self.record_arrival(lang)
+        limiter = self.limiters[lang]
+        with span('admission', lang=lang):
+            limiter.acquire()
+        started = self.clock()
+        try:
+            yield
+        finally:
+            limiter.release()
+            self.record_completion(lang, self.clock() - started)
+
+    def demand(self, now=None):
+        """Expected number of busy sandboxes per language (Little's law)."""
+        now = self.clock() if now is None else now
+        demand = {}
+        with self.lock:
+            for lang, stats in self.stats.items():
+                stats.expire(now)
+                idle = (stats.last_arrival is None
+                        or now - stats.last_arrival > self.idle_timeout)
+                rate = stats.arrival_rate()
+                service = stats.mean_service_time()
+                demand[lang] = {
+                    'rate': rate,
+                    'service_time': service,
+                    'busy': 0.0 if idle else rate * service,
+                    'idle': idle,
+                }
+        return demand
+
+    def plan(self, demand):
+        """Turn demand into concurrency and warm targets within the budget."""
+        # Every language keeps the floor concurrency so requests never block
+        # forever and a first burst is not serialized; the remaining slots are
+        # shared between concurrency headroom and warm sandboxes of active
+        # languages.
+        floor = self.floor
+        wanted = {}
+        for lang, d in demand.items():
+            if d['idle']:
+                wanted[lang] = {'concurrency': floor, 'warm': 0}
+                continue
+            concurrency = min(MAX_CONCURRENCY_PER_LANGUAGE,
+                              max(floor, math.ceil(d['busy'] * HEADROOM)))
+            warm = min(concurrency, max(1, math.ceil(d['busy'])))
+            wanted[lang] = {'concurrency': concurrency, 'warm': warm}
+
+        available = max(0, self.slots - floor * len(wanted))
+        requested = sum(w['concurrency'] - floor + w['warm'] for w in wanted.values())
+        if requested <= available:
+            return wanted
+
+        # Over budget: scale every language's extra slots down proportionally
+        scale = available / requested
+        targets = {}
+        for lang, w in wanted.items():
+            extra_concurrency = math.floor((w['concurrency'] - floor) * scale)
+            warm = math.floor(w['warm'] * scale)
+            targets[lang] = {'concurrency': floor + extra_concurrency, 'warm': warm}
+        return targets
+
+    def rebalance(self, now=None):
+        """Recompute targets, apply concurrency limits and return the plan."""
+        demand = self.demand(now)
+        targets = self.plan(demand)
+        for lang, target in targets.items():
+            if target != self.current[lang]:
+                d = demand[lang]
+                logger.info(
+                    "scale %s: concurrency %d->%d warm %d->%d "
+                    "(rate=%.3f/s service=%.3fs busy=%.2f idle=%s)",
+                    lang, self.current[lang]['concurrency'], target['concurrency'],
+                    self.current[lang]['warm'], target['warm'],
+                    d['rate'], d['service_time'], d['busy'], d['idle'])
+                self.limiters[lang].set_limit(target['concurrency'])
+        self.current = targets
+        return targets
+
+    def start(self, apply=None, interval=DEFAULT_INTERVAL_SECONDS):
+        """Rebalance periodically in a daemon thread, passing targets to ``apply``."""
+        if self._thread is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    targets = self.rebalance()
+                    if apply is not None:
+                        apply(targets)
+                except Exception as e:
+                    logger.warning("rebalance failed: %s", e)
+
+        self._thread = threading.Thread(target=loop, name='autoscaler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
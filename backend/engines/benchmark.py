@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Benchmark mode: repeat a program inside one sandbox and report statistics.
+
+The run command is wrapped in a shell loop that first executes warm-up
+iterations, then the measured runs, recording for each run its wall time
+and CPU time (user + system of the child processes, from the shell's
+``times``). The sandbox's peak memory is read from its cgroup at the end.
+Only the output of the first measured run is kept. The sandbox is pinned
+to one CPU so repeated runs and comparisons between programs are stable.
+"""
+
+import os
+import re
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger('code-runner.benchmark')
+
+# File written by the benchmark loop next to the sources
+BENCHMARK_FILE = '.benchmark'
+
+MAX_RUNS = 100
+MAX_WARMUP = 20
+DEFAULT_WARMUP = 1
+
+# CPUs benchmarks may be pinned to, e.g. "2,3" or "2-5"; the node's usable
+# CPUs otherwise
+CPUS_ENV = 'CODE_RUNNER_BENCHMARK_CPUS'
+
+# CPUs the cgroup of this machine's processes may run on (cgroup v2)
+CPUSET_FILE = '/sys/fs/cgroup/cpuset.cpus.effective'
+
+_TIMES = re.compile(r'(\d+)m([\d.]+)s')
+
+
+def validate(runs, warmup=DEFAULT_WARMUP):
+    if not 1 <= runs <= MAX_RUNS:
+        raise ValueError(f"Benchmark runs must be between 1 and {MAX_RUNS}")
+    if not 0 <= warmup <= MAX_WARMUP:
+        raise ValueError(f"Benchmark warm-up must be between 0 and {MAX_WARMUP}")
+
+
+def benchmark_command(run_cmd, runs, warmup=DEFAULT_WARMUP):
+    """Shell steps running ``run_cmd`` ``warmup`` + ``runs`` times.
+
+    The result is meant to be passed to ``timed_command`` and contains no
+    single quotes. Its exit status is the first failing run's, if any.
+    """
+    validate(runs, warmup)
+    cpu = f'{BENCHMARK_FILE}.cpu'
+    quiet = f'{{ {run_cmd}; }} >/dev/null 2>&1'
+    return '; '.join([
+        'i=0',
+        f'while [ $i -lt {warmup} ]; do {quiet}; i=$((i + 1)); done',
+        f'times > {cpu}',
+        f'echo "start $(tail -n 1 {cpu})" > {BENCHMARK_FILE}',
+        'rc=0',
+        'i=0',
+        f'while [ $i -lt {runs} ]; do '
+        'b0=$(date +%s%N); '
+        f'if [ $i -eq 0 ]; then {run_cmd}; else {quiet}; fi; '
+        'rc=$?; '
+        'b1=$(date +%s%N); '
+        f'times > {cpu}; '
+        f'echo "run $((b1 - b0)) $rc $(tail -n 1 {cpu})" >> {BENCHMARK_FILE}; '
+        'if [ $rc -ne 0 ]; then break; fi; '
+        'i=$((i + 1)); '
+        'done',
+        'peak=$(cat /sys/fs/cgroup/memory.peak 2>/dev/null '
+        '|| cat /sys/fs/cgroup/memory/memory.max_usage_in_bytes 2>/dev/null)',
+        f'echo "peak $peak" >> {BENCHMARK_FILE}',
+        f'rm -f {cpu}',
+        '(exit $rc)',
+    ])
+
+
+def parse_cpuset(text):
+    """CPU numbers of a cpuset list such as ``0-3,6``."""
+    cpus = []
+    for part in text.strip().split(','):
+        if part.strip():
+            first, _, last = part.partition('-')
+            cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def local_cpus():
+    """CPUs usable on this machine, without offline or cpuset-excluded ones."""
+    try:
+        with open(CPUSET_FILE) as f:
+            cpus = parse_cpuset(f.read())
+        if cpus:
+            return cpus
+    except (OSError, ValueError):
+        pass
+    return sorted(os.sched_getaffinity(0))
+
+
+def _cpu_seconds(fields):
+    """User + system seconds from a ``times`` line such as ``0m0.01s 0m0.00s``."""
+    return sum(int(m) * 60 + float(s) for m, s in _TIMES.findall(' '.join(fields)))
+
+
+def _summary(values):
+    # Only benchmark runs need it; kept out of the supervisor's startup
+    import statistics
+    return {
+        'min': round(min(values), 3),
+        'median': round(statistics.median(values), 3),
+        'stddev': round(statistics.stdev(values), 3) if len(values) > 1 else 0.0,
+    }
+
+
+def parse_results(text):
+    """Statistics from the contents of a benchmark file, or None if it has no runs."""
+    wall = []
+    cpu = []
+    previous = None
+    peak = None
+    for line in text.splitlines():
+        kind, _, rest = line.partition(' ')
+        fields = rest.split()
+        if kind == 'start':
+            previous = _cpu_seconds(fields)
+        elif kind == 'run' and len(fields) >= 2:
+            wall.append(int(fields[0]) / 1e6)
+            total = _cpu_seconds(fields[2:])
+            if previous is not None:
+                cpu.append((total - previous) * 1000)
+            previous = total
+        elif kind == 'peak' and fields and fields[0].isdigit():
+            peak = int(fields[0]) // 1024
+    if not wall:
+        return None
+    return {
+        'runs': len(wall),
+        'wall_ms': _summary(wall),
+        'cpu_ms': _summary(cpu) if cpu else None,
+        'peak_memory_kb': peak,
+    }
+
+
+def read_results(directory):
+    try:
+        with open(os.path.join(directory, BENCHMARK_FILE)) as f:
+            return parse_results(f.read())
+    except FileNotFoundError:
+        return None
+
+
+class CpuPinner:
+    """Hand each benchmark the CPU of its node running the fewest benchmarks."""
+
+    def __init__(self, cpus=None):
+        if cpus is None:
+            cpus = parse_cpuset(os.environ.get(CPUS_ENV, ''))
+        self.cpus = cpus
+        self.lock = threading.Lock()
+        self.active = {}
+
+    @contextmanager
+    def pin(self, node, cpus=(0,)):
+        """Yield a ``cpuset_cpus`` value for a benchmark on ``node``.
+
+        ``cpus`` are the CPU numbers usable on the node.
+        """
+        candidates = self.cpus or list(cpus) or [0]
+        with self.lock:
+            cpu = min(candidates, key=lambda c: self.active.get((node, c), 0))
+            self.active[(node, cpu)] = self.active.get((node, cpu), 0) + 1
+        try:
+            yield str(cpu)
+        finally:
+            with self.lock:
+                self.active[(node, cpu)] -= 1
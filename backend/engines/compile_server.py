@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Warm compiler daemons for Java and C#.
+
+Starting a fresh JVM or Mono runtime for every ``javac``/``mcs`` call costs
+more than compiling a small program. Each daemon is a long-lived, network
+isolated container of the language's base image running a compile service
+(see ``backend/compilers``) that takes jobs from a spool directory shared
+with the host. Each language has a small pool of daemons, each compiling
+one job at a time; a job arriving while all of them are busy or still
+starting compiles in the sandbox instead of waiting. Daemons start in the
+background, are recycled after a number of jobs or an age limit, and are
+replaced when a job times out.
+"""
+
+import os
+import time
+import uuid
+import shutil
+import logging
+import tempfile
+import threading
+from pathlib import Path
+
+from pool import TEMP_PREFIX, labels
+
+logger = logging.getLogger('code-runner.compile-server')
+
+COMPILERS_DIR = Path(__file__).parent.parent / 'compilers'
+
+# Compile services per extension: server source, daemon command and the
+# command that runs the compiled artifacts in the sandbox
+COMPILE_SERVERS = {
+    '.java': {
+        'server_source': 'CompileServer.java',
+        'command': "java /daemon/server/CompileServer.java /daemon/jobs",
+        'run_command': "java Solution",
+    },
+    '.cs': {
+        'server_source': 'CompileServer.cs',
+        'command': ("sh -c 'mcs -r:Mono.CSharp.dll -out:/tmp/CompileServer.exe "
+                    "/daemon/server/CompileServer.cs && mono /tmp/CompileServer.exe /daemon/jobs'"),
+        'run_command': "mono Program.exe",
+    },
+}
+
+DAEMON_MEM_LIMIT = "512m"
+READY_TIMEOUT = 60.0
+COMPILE_TIMEOUT = 30.0
+MAX_JOBS = int(os.environ.get('CODE_RUNNER_COMPILE_SERVER_MAX_JOBS', '500'))
+MAX_AGE_SECONDS = float(os.environ.get('CODE_RUNNER_COMPILE_SERVER_MAX_AGE', '1800'))
+POLL_INTERVAL = 0.005
+# Daemons per language
+POOL_SIZE = int(os.environ.get('CODE_RUNNER_COMPILE_SERVERS', '2'))
+# After a daemon fails to start, compile in the sandbox for this long
+RETRY_AFTER_SECONDS = 300.0
+
+
+class CompileDaemon:
+    """A single compile service container and its spool directory."""
+
+    def __init__(self, client, ext, base_image):
+        self.client = client
+        self.ext = ext
+        self.base_image = base_image
+        self.spec = COMPILE_SERVERS[ext]
+        self.root = None
+        self.container = None
+        self.started = None
+        self.jobs = 0
+
+    @property
+    def jobs_dir(self):
+        return os.path.join(self.root, 'jobs')
+
+    def start(self):
+        # The spool lives under the temp directory so that its path is the same
+        # for this process and the Docker host (see docker-compose.yml)
+        self.root = tempfile.mkdtemp(prefix=f'{TEMP_PREFIX}compiler-')
+        os.makedirs(self.jobs_dir)
+        os.makedirs(os.path.join(self.root, 'server'))
+        shutil.copy2(COMPILERS_DIR / self.spec['server_source'],
+                     os.path.join(self.root, 'server', self.spec['server_source']))
+        self.container = self.client.containers.run(
+            self.base_image,
+            self.spec['command'],
+            detach=True,
+            volumes={self.root: {'bind': '/daemon', 'mode': 'rw'}},
+            working_dir='/daemon',
+            mem_limit=DAEMON_MEM_LIMIT,
+            network_disabled=True,
+            labels=labels('compiler')
+        )
+        self.started = time.monotonic()
+        self.jobs = 0
+        deadline = self.started + READY_TIMEOUT
+        while not os.path.exists(os.path.join(self.jobs_dir, 'ready')):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"compile server for {self.ext} did not become ready")
+            self.container.reload()
+            if self.container.status == 'exited':
+                logs = self.container.logs().decode('utf-8', errors='replace')
+                raise RuntimeError(f"compile server for {self.ext} exited: {logs.strip()}")
+            time.sleep(0.05)
+        logger.info("compile server for %s ready in %.2fs",
+                    self.ext, time.monotonic() - self.started)
+
+    def expired(self):
+        return (self.jobs >= MAX_JOBS
+                or time.monotonic() - self.started >= MAX_AGE_SECONDS)
+
+    def compile(self, sources, dest_dir):
+        """Compile ``sources`` and copy the artifacts into ``dest_dir``.
+
+        Returns ``(status, diagnostics)``.
+        """
+        job = os.path.join(self.jobs_dir, uuid.uuid4().hex)
+        os.makedirs(os.path.join(job, 'src'))
+        try:
+            for source in sources:
+                shutil.copy2(source, os.path.join(job, 'src', os.path.basename(source)))
+            # The request marker is written last so the service never sees a partial job
+            open(os.path.join(job, 'request'), 'w').close()
+            self.jobs += 1
+
+            status_path = os.path.join(job, 'status')
+            deadline = time.monotonic() + COMPILE_TIMEOUT
+            while not os.path.exists(status_path):
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"compile server for {self.ext} timed out")
+                time.sleep(POLL_INTERVAL)
+
+            with open(status_path) as f:
+                status = int(f.read().strip() or 1)
+            with open(os.path.join(job, 'diagnostics'), encoding='utf-8', errors='replace') as f:
+                diagnostics = f.read()
+            out_dir = os.path.join(job, 'out')
+            if status == 0:
+                for name in os.listdir(out_dir):
+                    shutil.copy2(os.path.join(out_dir, name), os.path.join(dest_dir, name))
+            return status, diagnostics
+        finally:
+            shutil.rmtree(job, ignore_errors=True)
+
+    def stop(self):
+        if self.container is not None:
+            try:
+                self.container.remove(force=True)
+            except Exception as e:
+                logger.warning("failed to remove compile server for %s: %s", self.ext, e)
+            self.container = None
+        if self.root is not None:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
+
+
+class CompileServers:
+    """Up to ``size`` warm compile daemons per supported language, started on use."""
+
+    def __init__(self, client, configs, size=POOL_SIZE):
+        self.client = client
+        self.configs = configs
+        self.size = size
+        self.lock = threading.Lock()
+        # Every daemon of a language, and those not compiling a job
+        self.daemons = {ext: [] for ext in COMPILE_SERVERS}
+        self.idle = {ext: [] for ext in COMPILE_SERVERS}
+        # Languages with a daemon starting in the background
+        self.starting = set()
+        self.retry_at = {}
+
+    def supports(self, ext):
+        return ext in COMPILE_SERVERS
+
+    def run_command(self, ext):
+        return COMPILE_SERVERS[ext]['run_command']
+
+    def all(self):
+        """Every daemon, idle, compiling or starting."""
+        with self.lock:
+            return [daemon for daemons in self.daemons.values() for daemon in daemons]
+
+    def checkout(self, ext):
+        """Take an idle daemon, starting a new one in the background while the pool has room.
+
+        Returns None when none of the language's daemons is ready and free.
+        """
+        expired = []
+        launch = None
+        with self.lock:
+            if time.monotonic() < self.retry_at.get(ext, 0.0):
+                return None
+            daemon = None
+            while self.idle[ext] and daemon is None:
+                daemon = self.idle[ext].pop()
+                if daemon.expired():
+                    self.daemons[ext].remove(daemon)
+                    expired.append(daemon)
+                    daemon = None
+            if (daemon is None and ext not in self.starting
+                    and len(self.daemons[ext]) < self.size):
+                launch = CompileDaemon(self.client, ext, self.configs[ext]['base_image'])
+                self.daemons[ext].append(launch)
+                self.starting.add(ext)
+        for old in expired:
+            logger.info("recycling compile server for %s after %d jobs", ext, old.jobs)
+            old.stop()
+        if launch is not None:
+            threading.Thread(target=self.launch, args=(launch,),
+                             name=f'compile-server{ext}', daemon=True).start()
+        return daemon
+
+    def launch(self, daemon):
+        """Start ``daemon`` and make it available, or back off on failure."""
+        ext = daemon.ext
+        try:
+            daemon.start()
+        except Exception as e:
+            logger.warning("compile server for %s unavailable: %s", ext, e)
+            with self.lock:
+                self.starting.discard(ext)
+                self.retry_at[ext] = time.monotonic() + RETRY_AFTER_SECONDS
+            self.discard(daemon)
+            return
+        with self.lock:
+            self.starting.discard(ext)
+            closed = daemon not in self.daemons[ext]
+            if not closed:
+                self.idle[ext].append(daemon)
+        if closed:
+            daemon.stop()
+
+    def discard(self, daemon):
+        with self.lock:
+            if daemon in self.daemons[daemon.ext]:
+                self.daemons[daemon.ext].remove(daemon)
+        daemon.stop()
+
+    def compile(self, ext, sources, dest_dir):
+        """Compile through a warm daemon for ``ext``.
+
+        Returns ``(status, diagnostics)``, or None when no daemon is ready
+        and free so the caller can fall back to compiling inside the sandbox.
+        """
+        if ext not in COMPILE_SERVERS:
+            return None
+        daemon = self.checkout(ext)
+        if daemon is None:
+            return None
+        try:
+            result = daemon.compile(sources, dest_dir)
+        except Exception as e:
+            # Only this daemon is replaced; the next job starts a fresh one
+            logger.warning("compile server for %s failed a job: %s", ext, e)
+            self.discard(daemon)
+            return None
+        with self.lock:
+            if daemon in self.daemons[ext]:
+                self.idle[ext].append(daemon)
+        return result
+
+    def close(self):
+        with self.lock:
+            daemons = [daemon for daemons in self.daemons.values() for daemon in daemons]
+            for ext in self.daemons:
+                self.daemons[ext] = []
+                self.idle[ext] = []
+        for daemon in daemons:
+            daemon.stop()
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Streaming judge: compare a program's stdout with an expected output.
+
+The sandbox's stdout is compared chunk by chunk while the program runs,
+against an expected-output file that is also read incrementally, so memory
+stays constant however large the outputs are. On the first mismatch the
+sandbox is killed and the run fails with ``wrong_answer``. Compiled
+languages are compiled in a separate step first, whose failure is reported
+as ``compile_error``, and each step is killed with ``time_limit_exceeded``
+once it runs longer than the time limit.
+
+Comparison modes:
+
+- ``exact``: byte for byte.
+- ``token``: whitespace separated tokens; any amount or kind of whitespace
+  between tokens is equivalent.
+- ``whitespace``: line by line, with runs of spaces collapsed and trailing
+  whitespace and trailing blank lines ignored.
+
+With a float ``tolerance`` two numeric tokens match when their absolute or
+relative difference is within it (``token`` and ``whitespace`` modes).
+"""
+
+import os
+import math
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from pool import TEMP_PREFIX, discard_sandbox, make_archive, start_sandbox
+from run_code import (LANGUAGE_CONFIGS, LANGUAGE_STANDARDS, SANDBOX_MEM_LIMIT,
+                      command_steps, compiler_flags, ensure_base_image_exists)
+from tracing import span
+
+logger = logging.getLogger('code-runner.judge')
+
+EXACT = 'exact'
+TOKEN = 'token'
+WHITESPACE = 'whitespace'
+MODES = (EXACT, TOKEN, WHITESPACE)
+
+ACCEPTED = 'accepted'
+WRONG_ANSWER = 'wrong_answer'
+RUNTIME_ERROR = 'runtime_error'
+COMPILE_ERROR = 'compile_error'
+TIME_LIMIT_EXCEEDED = 'time_limit_exceeded'
+
+# Wall-clock limit in seconds for each step, compile and run
+TIME_LIMIT = float(os.environ.get('CODE_RUNNER_JUDGE_TIME_LIMIT', '10'))
+
+READ_SIZE = 64 * 1024
+
+# Longest token or line held while waiting for its end
+MAX_TOKEN = 1024 * 1024
+
+# Output kept for the response
+MAX_OUTPUT_HEAD = 4 * 1024
+MAX_STDERR = 64 * 1024
+
+# Characters of each side shown for a mismatch
+SNIPPET = 100
+
+
+def _snippet(data):
+    if data is None:
+        return None
+    return data[:SNIPPET].decode('utf-8', errors='replace')
+
+
+def tokens_match(actual, expected, tolerance=None):
+    if actual == expected:
+        return True
+    if tolerance is None:
+        return False
+    try:
+        a, b = float(actual), float(expected)
+    except ValueError:
+        return False
+    if math.isnan(a) or math.isnan(b):
+        return False
+    return abs(a - b) <= tolerance or abs(a - b) <= tolerance * abs(b)
+
+
+class _Splitter:
+    """Split a byte stream into complete tokens or lines as data arrives."""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.partial = b''
+
+    def feed(self, data):
+        data = self.partial + data
+        if self.lines:
+            parts = data.split(b'\n')
+            self.partial = parts.pop()
+        else:
+            parts = data.split()
+            # The last token may continue in the next chunk
+            self.partial = parts.pop() if parts and not data[-1:].isspace() else b''
+        if len(self.partial) > MAX_TOKEN:
+            raise ValueError(f"{'Line' if self.lines else 'Token'} longer than {MAX_TOKEN} bytes")
+        return parts
+
+    def finish(self):
+        rest, self.partial = self.partial, b''
+        return [rest] if rest else []
+
+
+class _ExpectedReader:
+    """Tokens or lines of the expected output, read from a file on demand."""
+
+    def __init__(self, expected, lines):
+        self.file = expected
+        self.splitter = _Splitter(lines)
+        self.pending = []
+        self.eof = False
+
+    def next(self):
+        """The next token or line, or None at the end of the file."""
+        while not self.pending and not self.eof:
+            data = self.file.read(READ_SIZE)
+            if data:
+                self.pending = self.splitter.feed(data)
+            else:
+                self.pending = self.splitter.finish()
+                self.eof = True
+            self.pending.reverse()
+        return self.pending.pop() if self.pending else None
+
+
+class Comparator:
+    """Incremental comparison of program output with an expected output.
+
+    ``feed`` returns False on the first mismatch, which is described by
+    ``mismatch``; ``finish`` checks what is left once the output ended.
+    """
+
+    unit = 'byte'
+
+    def __init__(self, expected, tolerance=None):
+        self.expected = expected
+        self.tolerance = tolerance
+        self.position = 0
+        self.mismatch = None
+
+    def fail(self, actual, expected):
+        self.mismatch = {
+            'unit': self.unit,
+            'position': self.position,
+            'expected': _snippet(expected),
+            'actual': _snippet(actual),
+        }
+        return False
+
+    def feed(self, data):
+        expected = self.expected.read(len(data))
+        if expected != data:
+            index = next((i for i, (a, b) in enumerate(zip(data, expected)) if a != b),
+                         len(expected))
+            self.position += index
+            return self.fail(data[index:], expected[index:] or None)
+        self.position += len(data)
+        return True
+
+    def finish(self):
+        rest = self.expected.read(SNIPPET)
+        if rest:
+            return self.fail(None, rest)
+        return True
+
+
+class TokenComparator(Comparator):
+    unit = 'token'
+
+    def __init__(self, expected, tolerance=None):
+        super().__init__(expected, tolerance)
+        self.reader = _ExpectedReader(expected, lines=False)
+        self.splitter = _Splitter(lines=False)
+
+    def compare(self, tokens):
+        for token in tokens:
+            expected = self.reader.next()
+            if expected is None or not tokens_match(token, expected, self.tolerance):
+                return self.fail(token, expected)
+            self.position += 1
+        return True
+
+    def feed(self, data):
+        try:
+            return self.compare(self.splitter.feed(data))
+        except ValueError:
+            return self.fail(self.splitter.partial, None)
+
+    def finish(self):
+        if not self.compare(self.splitter.finish()):
+            return False
+        expected = self.reader.next()
+        if expected is not None:
+            return self.fail(None, expected)
+        return True
+
+
+class WhitespaceComparator(Comparator):
+    unit = 'line'
+
+    def __init__(self, expected, tolerance=None):
+        super().__init__(expected, tolerance)
+        self.reader = _ExpectedReader(expected, lines=True)
+        self.splitter = _Splitter(lines=True)
+        # Blank output lines not compared yet: they only matter when
+        # followed by a non-blank line
+        self.blank = 0
+
+    def next_expected(self):
+        """The next non-blank expected line and the blank lines before it."""
+        blank = 0
+        while True:
+            line = self.reader.next()
+            if line is None:
+                return None, blank
+            words = line.split()
+            if words:
+                return words, blank
+            blank += 1
+
+    def lines_match(self, actual, expected):
+        return (len(actual) == len(expected)
+                and all(tokens_match(a, e, self.tolerance) for a, e in zip(actual, expected)))
+
+    def compare(self, lines):
+        for line in lines:
+            words = line.split()
+            if not words:
+                self.blank += 1
+                continue
+            expected, blank = self.next_expected()
+            if blank != self.blank:
+                self.position += min(blank, self.blank)
+                if self.blank < blank:
+                    # A line where a blank line was expected
+                    return self.fail(b' '.join(words), b'')
+                return self.fail(b'', None if expected is None else b' '.join(expected))
+            self.position += blank
+            if expected is None or not self.lines_match(words, expected):
+                return self.fail(b' '.join(words), None if expected is None else b' '.join(expected))
+            self.position += 1
+            self.blank = 0
+        return True
+
+    def feed(self, data):
+        try:
+            return self.compare(self.splitter.feed(data))
+        except ValueError:
+            return self.fail(self.splitter.partial, None)
+
+    def finish(self):
+        if not self.compare(self.splitter.finish()):
+            return False
+        expected, _ = self.next_expected()
+        if expected is not None:
+            return self.fail(None, b' '.join(expected))
+        return True
+
+
+COMPARATORS = {
+    EXACT: Comparator,
+    TOKEN: TokenComparator,
+    WHITESPACE: WhitespaceComparator,
+}
+
+
+def make_comparator(mode, expected, tolerance=None):
+    """Comparator for ``mode`` reading the expected output from a binary file."""
+    if mode not in COMPARATORS:
+        raise ValueError(f"Unknown judge mode: {mode}")
+    if tolerance is not None and (tolerance < 0 or mode == EXACT):
+        raise ValueError("Float tolerance must be positive and needs token or whitespace mode")
+    return COMPARATORS[mode](expected, tolerance)
+
+
+def stream_exec(container, cmd):
+    """Run ``cmd`` in ``container``; yield ``(stdout, stderr)`` chunks.
+
+    Returns the exec id so the exit code can be inspected afterwards.
+    """
+    api = container.client.api
+    exec_id = api.exec_create(container.id, cmd, workdir='/app')['Id']
+    return exec_id, api.exec_start(exec_id, stream=True, demux=True)
+
+
+@contextmanager
+def watchdog(container, seconds, expired):
+    """Kill ``container`` and set ``expired`` if the block outlasts ``seconds``.
+
+    Errors raised by the block because the container was killed are ignored.
+    """
+    def expire():
+        expired.set()
+        discard_sandbox(container)
+
+    timer = threading.Timer(seconds, expire)
+    timer.daemon = True
+    timer.start()
+    try:
+        yield
+    except Exception:
+        if not expired.is_set():
+            raise
+    finally:
+        timer.cancel()
+
+
+def _elapsed_ms(started):
+    return int((time.monotonic() - started) * 1000)
+
+
+def run_judged(source_path, expected_path, client, pool=None, mode=TOKEN, tolerance=None,
+               profile=None, std=None, time_limit=TIME_LIMIT):
+    """Run ``source_path`` and judge its stdout against ``expected_path``.
+
+    Returns the ``verdict``, the ``exit_code`` (None when the sandbox was
+    killed), the ``mismatch``, the beginning of the output, the stderr
+    output or compiler diagnostics (both capped), the number of stdout
+    bytes read and the timings.
+    """
+    ext = os.path.splitext(source_path)[1]
+    if ext not in LANGUAGE_CONFIGS:
+        raise ValueError(f"Unsupported file extension: {ext}")
+    if ext in LANGUAGE_STANDARDS:
+        compiler_flags(ext, profile, std)
+    config = LANGUAGE_CONFIGS[ext]
+    with span('ensure_image', image=config['base_image']):
+        image_ready = ensure_base_image_exists(client, ext)
+    if not image_ready:
+        raise RuntimeError(f"Failed to ensure base image for {ext}")
+
+    head = bytearray()
+    stderr = bytearray()
+    read = 0
+    exit_code = None
+    verdict = None
+    timings = {}
+    expired = threading.Event()
+    with tempfile.TemporaryDirectory(prefix=TEMP_PREFIX) as temp_dir, open(expected_path, 'rb') as expected:
+        comparator = make_comparator(mode, expected, tolerance)
+        shutil.copy2(source_path, os.path.join(temp_dir, config['main_file']))
+        compile_cmd, run_cmd = command_steps(ext, config['main_file'], profile, std)
+
+        with span('acquire_sandbox') as attrs:
+            container = pool.acquire(ext) if pool is not None else None
+            attrs['warm'] = container is not None
+            if container is None:
+                container = start_sandbox(client, config['base_image'], SANDBOX_MEM_LIMIT)
+        try:
+            container.put_archive('/app', make_archive(temp_dir))
+            if compile_cmd is not None:
+                # Diagnostics must not reach the comparison, so compile first
+                with span('compile'), watchdog(container, time_limit, expired):
+                    started = time.monotonic()
+                    exit_code, (out, err) = container.exec_run(compile_cmd, workdir='/app',
+                                                               demux=True)
+                    timings['compile_ms'] = _elapsed_ms(started)
+                if expired.is_set():
+                    verdict = TIME_LIMIT_EXCEEDED
+                elif exit_code != 0:
+                    verdict = COMPILE_ERROR
+                    stderr.extend(((out or b'') + (err or b''))[:MAX_STDERR])
+            if verdict is None:
+                exit_code = None
+                matched = True
+                with span('judge', mode=mode) as attrs, watchdog(container, time_limit, expired):
+                    started = time.monotonic()
+                    exec_id, stream = stream_exec(container, run_cmd)
+                    for out, err in stream:
+                        if err and len(stderr) < MAX_STDERR:
+                            stderr.extend(err[:MAX_STDERR - len(stderr)])
+                        if out:
+                            read += len(out)
+                            if len(head) < MAX_OUTPUT_HEAD:
+                                head.extend(out[:MAX_OUTPUT_HEAD - len(head)])
+                            if not comparator.feed(out):
+                                matched = False
+                                break
+                    attrs['bytes'] = read
+                    if matched:
+                        timings['run_ms'] = _elapsed_ms(started)
+                        exit_code = container.client.api.exec_inspect(exec_id)['ExitCode']
+                if expired.is_set():
+                    verdict = TIME_LIMIT_EXCEEDED
+                    exit_code = None
+                elif not matched:
+                    verdict = WRONG_ANSWER
+        finally:
+            # Also kills a program still running after a mismatch
+            if not expired.is_set():
+                discard_sandbox(container)
+            if pool is not None:
+                pool.release(container)
+
+        if verdict is None:
+            if exit_code != 0:
+                verdict = RUNTIME_ERROR
+            elif comparator.finish():
+                verdict = ACCEPTED
+            else:
+                verdict = WRONG_ANSWER
+    return {
+        'verdict': verdict,
+        'exit_code': exit_code,
+        'mismatch': comparator.mismatch,
+        'output': head.decode('utf-8', errors='replace'),
+        'stderr': stderr.decode('utf-8', errors='replace'),
+        'bytes': read,
+        'timings': timings,
+    }
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Executor nodes: dispatch sandboxes across several Docker hosts.
+
+Each node is a Docker endpoint (``unix://`` or ``tcp://``) with its own
+client, warm pool and, for nodes on this machine, compile servers. Nodes
+are health checked periodically and report their capacity; runs are placed
+on the least loaded node, preferring nodes that already hold the language's
+base image or warm sandboxes. Nodes failing consecutive health checks are
+drained until they recover.
+
+Configure the endpoints with CODE_RUNNER_NODES, a comma separated list of
+Docker URLs. Without it the single daemon from ``docker.from_env()`` is used.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import docker
+import requests
+
+from pool import WarmPool
+from benchmark import local_cpus
+from compile_server import CompileServers
+from tracing import span
+
+logger = logging.getLogger('code-runner.nodes')
+
+NODES_ENV = 'CODE_RUNNER_NODES'
+
+# Placement strategies
+LEAST_LOADED = 'least-loaded'
+AFFINITY = 'affinity'
+DEFAULT_STRATEGY = os.environ.get('CODE_RUNNER_PLACEMENT', AFFINITY)
+
+# Consecutive failed health checks before a node is drained
+MAX_FAILURES = 3
+
+# Seconds between two health checks
+CHECK_INTERVAL = 10.0
+
+# Above this many active runs per CPU a node loses its affinity preference
+OVERLOAD = 1.0
+
+
+def is_node_failure(error):
+    """Whether ``error`` means the Docker endpoint itself is unusable."""
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return True
+    return isinstance(error, docker.errors.APIError) and error.is_server_error()
+
+
+class ExecutorNode:
+    """A Docker endpoint that can run sandboxes."""
+
+    def __init__(self, url, configs, mem_limit, client=None):
+        self.url = url
+        self.configs = configs
+        self.mem_limit = mem_limit
+        # Bind mounts and compile server spools need this machine's filesystem
+        self.local = url is None or url.startswith('unix://')
+        self.client = None
+        self.pool = None
+        self.compilers = None
+        self.lock = threading.Lock()
+        self.connect_lock = threading.Lock()
+        self.active = 0
+        self.failures = 0
+        self.drained = False
+        try:
+            self.connect(client)
+        except Exception as e:
+            self.record_failure(e)
+            self.drained = True
+        self.cpus = 1
+        self.cpuset = [0]
+        self.memory = 0
+        self.running = 0
+        self.images = set()
+        self.last_check = None
+
+    def connect(self, client=None):
+        """Create the client, warm pool and compile servers for this node."""
+        if client is None:
+            client = docker.from_env() if self.url is None else docker.DockerClient(base_url=self.url)
+        self.client = client
+        self.pool = WarmPool(client, self.configs, self.mem_limit)
+        self.compilers = CompileServers(client, self.configs) if self.local else None
+
+    @property
+    def name(self):
+        return self.url or 'default'
+
+    def load(self):
+        """Active runs per CPU."""
+        return self.active / max(1, self.cpus)
+
+    def check(self):
+        """Ping the node and refresh its capacity report."""
+        try:
+            # Checked from both the health and the warm-up thread
+            with self.connect_lock:
+                if self.client is None:
+                    self.connect()
+            self.client.ping()
+            info = self.client.info()
+            images = set()
+            for config in self.configs.values():
+                if self.client.images.list(name=config['base_image']):
+                    images.add(config['base_image'])
+        except Exception as e:
+            self.record_failure(e)
+            return False
+        self.cpus = info.get('NCPU', 1)
+        # Docker does not report its cpuset; remote nodes with a restricted
+        # one need CODE_RUNNER_BENCHMARK_CPUS
+        self.cpuset = local_cpus() if self.local else list(range(max(1, self.cpus)))
+        self.memory = info.get('MemTotal', 0)
+        self.running = info.get('ContainersRunning', 0)
+        self.images = images
+        self.last_check = time.time()
+        self.failures = 0
+        if self.drained:
+            logger.info("node %s recovered, accepting runs again", self.name)
+            self.drained = False
+        return True
+
+    def record_failure(self, error):
+        self.failures += 1
+        logger.warning("node %s failed (%d/%d): %s",
+                       self.name, self.failures, MAX_FAILURES, error)
+        if self.failures >= MAX_FAILURES and not self.drained:
+            logger.warning("draining node %s", self.name)
+            self.drained = True
+            if self.pool is not None:
+                self.pool.close()
+
+    def affinity(self, ext):
+        """2 when warm sandboxes are ready for ``ext``, 1 when its image is present."""
+        if self.pool is not None and self.pool.count(ext):
+            return 2
+        if self.configs[ext]['base_image'] in self.images:
+            return 1
+        return 0
+
+    def report(self):
+        return {
+            'url': self.name,
+            'local': self.local,
+            'drained': self.drained,
+            'failures': self.failures,
+            'active': self.active,
+            'cpus': self.cpus,
+            'cpuset': self.cpuset,
+            'memory': self.memory,
+            'running_containers': self.running,
+            'images': sorted(self.images),
+            'warm': {ext: self.pool.count(ext) for ext in self.configs} if self.pool else {},
+            'last_check': self.last_check,
+        }
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+        if self.compilers is not None:
+            self.compilers.close()
+
+
+class NodePool:
+    """Place runs on a set of executor nodes."""
+
+    def __init__(self, nodes, strategy=DEFAULT_STRATEGY):
+        if strategy not in (LEAST_LOADED, AFFINITY):
+            raise ValueError(f"Unknown placement strategy: {strategy}")
+        self.nodes = nodes
+        self.strategy = strategy
+        self._thread = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_env(cls, configs, mem_limit):
+        urls = [url.strip() for url in os.environ.get(NODES_ENV, '').split(',') if url.strip()]
+        nodes = [ExecutorNode(url, configs, mem_limit) for url in urls or [None]]
+        return cls(nodes)
+
+    def check_all(self):
+        for node in self.nodes:
+            node.check()
+
+    def place(self, ext, local=False):
+        """Pick a node for ``ext``; ``local`` restricts to nodes on this machine."""
+        candidates = [n for n in self.nodes if not n.drained and (n.local or not local)]
+        if not candidates:
+            raise RuntimeError("No healthy executor node available")
+        if self.strategy == LEAST_LOADED:
+            return min(candidates, key=lambda n: n.load())
+        return min(candidates, key=lambda n: (n.load() >= OVERLOAD, -n.affinity(ext), n.load()))
+
+    @contextmanager
+    def lease(self, ext, local=False):
+        """Place a run and count it against the node while it executes."""
+        with span('place') as attrs:
+            node = self.place(ext, local)
+            attrs['node'] = node.name
+        with node.lock:
+            node.active += 1
+        try:
+            yield node
+        except Exception as e:
+            if is_node_failure(e):
+                node.record_failure(e)
+            raise
+        finally:
+            with node.lock:
+                node.active -= 1
+
+    def apply(self, targets):
+        """Spread the warm targets of an autoscaler plan over healthy nodes."""
+        healthy = [n for n in self.nodes if not n.drained]
+        for ext, target in targets.items():
+            share, extra = divmod(target['warm'], max(1, len(healthy)))
+            for i, node in enumerate(healthy):
+                node.pool.resize(ext, share + (1 if i < extra else 0))
+
+    def report(self):
+        return [node.report() for node in self.nodes]
+
+    def start(self, interval=CHECK_INTERVAL):
+        """Health check all nodes periodically in a daemon thread."""
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                self.check_all()
+                if self._stop.wait(interval):
+                    break
+
+        self._thread = threading.Thread(target=loop, name='node-health', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        for node in self.nodes:
+            node.close()
+
+
+def main():
+    """Print the capacity report of the configured nodes."""
+    from run_code import LANGUAGE_CONFIGS, SANDBOX_MEM_LIMIT
+    nodes = NodePool.from_env(LANGUAGE_CONFIGS, SANDBOX_MEM_LIMIT)
+    nodes.check_all()
+    json.dump(nodes.report(), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Pool of warm (pre-started) sandbox containers per language.
+
+A warm sandbox is an idle container of the language's base image created
+with the same isolation settings as a regular run. A run takes one out of
+the pool, copies its files in and executes its command; the container is
+discarded afterwards so no state is shared between submissions.
+"""
+
+import io
+import os
+import logging
+import tarfile
+import tempfile
+import threading
+
+logger = logging.getLogger('code-runner.pool')
+
+# Keeps the container alive without doing any work
+IDLE_COMMAND = "tail -f /dev/null"
+
+# Set on every container, volume and base image the runner creates, with the
+# kind of object as value, so leaked ones can be found (see reaper.py)
+LABEL = 'code-runner.kind'
+
+# Prefix of the runner's temporary files and directories
+TEMP_PREFIX = 'code-runner-'
+
+# Host directory holding the cached projects (see projects.py); it lives
+# under the temp directory so bind mounts resolve on the Docker host (see
+# docker-compose.yml)
+CACHE_ROOT = os.environ.get(
+    'CODE_RUNNER_PROJECT_CACHE', os.path.join(tempfile.gettempdir(), TEMP_PREFIX + 'projects'))
+
+
+def labels(kind):
+    return {LABEL: kind}
+
+
+def make_archive(directory):
+    """Pack the contents of ``directory`` into an in-memory tar archive."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for name in os.listdir(directory):
+            tar.add(os.path.join(directory, name), arcname=name)
+    return buffer.getvalue()
+
+
+def copy_from_container(container, path, directory):
+    """Copy a single file out of a container into ``directory`` if it exists."""
+    try:
+        chunks, _ = container.get_archive(path)
+    except Exception:
+        return False
+    with tarfile.open(fileobj=io.BytesIO(b''.join(chunks))) as tar:
+        for member in tar.getmembers():
+            if member.isfile():
+                with open(os.path.join(directory, os.path.basename(member.name)), 'wb') as f:
+                    f.write(tar.extractfile(member).read())
+    return True
+
+
+def start_sandbox(client, image, mem_limit):
+    """Start an idle, network isolated sandbox container of ``image``."""
+    return client.containers.run(
+        image,
+        IDLE_COMMAND,
+        detach=True,
+        working_dir='/app',
+        mem_limit=mem_limit,
+        network_disabled=True,
+        labels=labels('sandbox')
+    )
+
+
+def discard_sandbox(container):
+    try:
+        container.remove(force=True)
+    except Exception as e:
+        logger.warning("failed to remove sandbox %s: %s", container.id[:12], e)
+
+
+def run_in_sandbox(container, directory, cmd, collect=(), pool=None):
+    """Copy ``directory`` into a started sandbox, run ``cmd`` and discard it.
+
+    This does not need a filesystem shared with the Docker host. Files named
+    in ``collect`` are copied back from /app into ``directory`` when the
+    command created them. A sandbox taken from ``pool`` is released to it
+    once discarded. Returns ``(exit_code, output)`` with stdout and stderr
+    combined.
+    """
+    try:
+        container.put_archive('/app', make_archive(directory))
+        exit_code, output = container.exec_run(cmd, workdir='/app')
+        for name in collect:
+            copy_from_container(container, f'/app/{name}', directory)
+        return exit_code, output
+    finally:
+        discard_sandbox(container)
+        if pool is not None:
+            pool.release(container)
+
+
+class WarmPool:
+    """Keep a resizable number of idle sandboxes per language."""
+
+    def __init__(self, client, configs, mem_limit):
+        self.client = client
+        self.configs = configs
+        self.mem_limit = mem_limit
+        self.lock = threading.Lock()
+        self.idle = {ext: [] for ext in configs}
+        # Ids of sandboxes handed out by acquire() and not yet released
+        self.in_use = set()
+        self.targets = {ext: 0 for ext in configs}
+
+    def _start(self, ext):
+        return start_sandbox(self.client, self.configs[ext]['base_image'], self.mem_limit)
+
+    def resize(self, ext, target):
+        """Start or stop idle sandboxes until ``ext`` has ``target`` of them."""
+        with self.lock:
+            self.targets[ext] = target
+            surplus = self.idle[ext][target:]
+            del self.idle[ext][target:]
+            missing = target - len(self.idle[ext])
+        for container in surplus:
+            discard_sandbox(container)
+        for _ in range(max(0, missing)):
+            try:
+                container = self._start(ext)
+            except Exception as e:
+                logger.warning("failed to start warm sandbox for %s: %s", ext, e)
+                break
+            with self.lock:
+                if len(self.idle[ext]) < self.targets[ext]:
+                    self.idle[ext].append(container)
+                    continue
+            discard_sandbox(container)
+
+    def apply(self, targets):
+        """Resize every language to the ``warm`` value of an autoscaler plan."""
+        for ext, target in targets.items():
+            if ext in self.idle:
+                self.resize(ext, target['warm'])
+
+    def acquire(self, ext):
+        """Take an idle sandbox for ``ext`` or return None when none is warm."""
+        with self.lock:
+            if not self.idle.get(ext):
+                return None
+            container = self.idle[ext].pop()
+            self.in_use.add(container.id)
+            return container
+
+    def release(self, container):
+        """Forget a sandbox from ``acquire`` once the run discarded it."""
+        with self.lock:
+            self.in_use.discard(container.id)
+
+    def container_ids(self):
+        """Ids of the idle and leased sandboxes of every language."""
+        with self.lock:
+            idle = {container.id for idle in self.idle.values() for container in idle}
+            return idle | self.in_use
+
+    def count(self, ext):
+        """Number of idle sandboxes currently warm for ``ext``."""
+        with self.lock:
+            return len(self.idle.get(ext, ()))
+
+    def close(self):
+        with self.lock:
+            containers = [c for idle in self.idle.values() for c in idle]
+            for ext in self.idle:
+                self.idle[ext] = []
+                self.targets[ext] = 0
+        for container in containers:
+            discard_sandbox(container)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Profile mode: run a submission under its language's profiler.
+
+The sandbox command is rewritten so the program writes a raw profile next
+to the sources, which is summarized here into the functions with the most
+self time and folded stacks (``frame;frame;frame weight`` lines, the input
+format of flamegraph tools). Both are capped in size.
+
+- Python: ``cProfile``; stacks are rebuilt from the caller graph, splitting
+  each function's time over its callers.
+- JavaScript: ``node --cpu-prof`` sampling profile.
+- C/C++: ``gprof`` flat profile of a ``-pg`` build (no call stacks; the
+  folded output has one frame per function).
+- Java: JFR execution samples, printed with the JDK's ``jfr`` tool.
+
+The raw profile is written by the submission, which can replace it with
+anything, so it is summarized in a child process with CPU, memory and time
+limits (``pstats`` unmarshals its input), and stack reconstruction visits a
+bounded number of call graph nodes.
+"""
+
+import os
+import re
+import sys
+import json
+import stat
+import logging
+import subprocess
+from collections import Counter, defaultdict
+
+logger = logging.getLogger('code-runner.profiler')
+
+# Raw profile written by the sandbox, per language
+PROFILE_FILES = {
+    '.py': '.profile.pstats',
+    '.js': '.profile.cpuprofile',
+    '.c': '.profile.gprof',
+    '.cpp': '.profile.gprof',
+    '.java': '.profile.jfr.json',
+}
+
+TOOLS = {
+    '.py': 'cProfile',
+    '.js': 'cpu-prof',
+    '.c': 'gprof',
+    '.cpp': 'gprof',
+    '.java': 'jfr',
+}
+
+MAX_TOP = 20
+MAX_FOLDED_BYTES = 64 * 1024
+MAX_RAW_BYTES = 32 * 1024 * 1024
+
+# Deepest call stack rebuilt from a cProfile caller graph
+MAX_DEPTH = 64
+
+# Call graph nodes visited in total when rebuilding cProfile stacks; the
+# number of call paths grows exponentially with the graph's density
+MAX_STACK_NODES = 20000
+
+# Limits of the child process summarizing a raw profile
+SUMMARY_TIMEOUT = 20
+SUMMARY_MEMORY = 512 * 1024 * 1024
+
+# Sampling period of jdk.ExecutionSample in JFR's "profile" settings
+JFR_PERIOD_MS = 10
+
+JFR_FLAGS = ('-XX:StartFlightRecording=filename=.profile.jfr,settings=profile '
+             '-Xlog:jfr+startup=error')
+
+_GPROF_LINE = re.compile(r'^\s*((?:[\d.]+\s+){3,6})(\S.*)$')
+
+
+def supports(ext):
+    return ext in PROFILE_FILES
+
+
+def profile_command(ext, compile_cmd, run_cmd):
+    """Return ``(compile_cmd, run_cmd)`` rewritten to record a profile.
+
+    Commands keep the exit status of the program and contain no single
+    quotes, so they can be passed to ``timed_command``.
+    """
+    if not supports(ext):
+        raise ValueError(f"Profiling is not supported for {ext}")
+    raw = PROFILE_FILES[ext]
+    if ext == '.py':
+        return compile_cmd, run_cmd.replace('python ', f'python -m cProfile -o {raw} ', 1)
+    if ext == '.js':
+        return compile_cmd, run_cmd.replace(
+            'node ', f'node --cpu-prof --cpu-prof-dir=. --cpu-prof-name={raw} ', 1)
+    if ext in ('.c', '.cpp'):
+        compile_cmd = compile_cmd.replace(' -o ', ' -pg -o ', 1)
+        binary = run_cmd.split()[0]
+        return compile_cmd, (f'{run_cmd}; rc=$?; '
+                             f'gprof -b -p {binary} gmon.out > {raw} 2>/dev/null; (exit $rc)')
+    return compile_cmd, (f'{run_cmd.replace("java ", f"java {JFR_FLAGS} ", 1)}; rc=$?; '
+                         f'jfr print --json --events jdk.ExecutionSample .profile.jfr '
+                         f'> {raw} 2>/dev/null; (exit $rc)')
+
+
+def _label(text):
+    # Semicolons separate frames in folded stacks
+    return text.replace(';', ',')
+
+
+def _folded(stacks):
+    """Folded stack lines, heaviest first, capped at MAX_FOLDED_BYTES."""
+    lines = []
+    size = 0
+    truncated = False
+    for stack, weight in sorted(stacks.items(), key=lambda item: -item[1]):
+        if weight <= 0:
+            continue
+        line = f"{stack} {weight}"
+        if size + len(line) + 1 > MAX_FOLDED_BYTES:
+            truncated = True
+            break
+        lines.append(line)
+        size += len(line) + 1
+    return '\n'.join(lines), truncated
+
+
+def summarize_pstats(path):
+    import pstats
+    stats = pstats.Stats(path).stats
+
+    def label(func):
+        filename, line, name = func
+        if filename == '~':
+            return _label(name)
+        return _label(f"{name} ({os.path.basename(filename)}:{line})")
+
+    callees = defaultdict(dict)
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge
+    stacks = Counter()
+    budget = MAX_STACK_NODES
+
+    def walk(func, path, seen, fraction):
+        nonlocal budget
+        if budget <= 0:
+            return
+        budget -= 1
+        tt, ct = stats[func][2], stats[func][3]
+        path = path + [label(func)]
+        stacks[';'.join(path)] += int(tt * fraction * 1e6)
+        if len(path) >= MAX_DEPTH:
+            return
+        for callee, edge in callees[func].items():
+            callee_ct = stats[callee][3]
+            share = fraction * edge[3] / callee_ct if callee_ct > 0 else 0
+            # Skip recursion and branches below a microsecond
+            if callee not in seen and share * callee_ct >= 1e-6:
+                walk(callee, path, seen | {callee}, share)
+
+    for func, value in stats.items():
+        if not value[4]:
+            walk(func, [], {func}, 1.0)
+
+    top = sorted(stats.items(), key=lambda item: -item[1][2])[:MAX_TOP]
+    return {
+        'top': [{'function': label(func), 'calls': nc, 'self_ms': round(tt * 1000, 3),
+                 'total_ms': round(ct * 1000, 3)}
+                for func, (cc, nc, tt, ct, callers) in top],
+        'stacks': stacks,
+        'truncated': budget <= 0,
+    }
+
+
+def summarize_cpuprofile(path):
+    with open(path) as f:
+        profile = json.load(f)
+    nodes = {node['id']: node for node in profile.get('nodes', [])}
+    parents = {child: node['id'] for node in nodes.values() for child in node.get('children', [])}
+    self_us = Counter()
+    for node_id, delta in zip(profile.get('samples', []), profile.get('timeDeltas', [])):
+        self_us[node_id] += max(0, delta)
+
+    def label(node):
+        frame = node['callFrame']
+        name = frame.get('functionName') or '(anonymous)'
+        if frame.get('url'):
+            name += f" ({os.path.basename(frame['url'])}:{frame.get('lineNumber', 0) + 1})"
+        return _label(name)
+
+    stacks = Counter()
+    functions = Counter()
+    for node_id, weight in self_us.items():
+        frames = []
+        current = node_id
+        while current in nodes:
+            if nodes[current]['callFrame'].get('functionName') != '(root)':
+                frames.append(label(nodes[current]))
+            current = parents.get(current)
+        if frames:
+            stacks[';'.join(reversed(frames))] += weight
+            functions[frames[0]] += weight
+    return {
+        'top': [{'function': name, 'self_ms': round(us / 1000, 3)}
+                for name, us in functions.most_common(MAX_TOP)],
+        'stacks': stacks,
+    }
+
+
+def summarize_gprof(path):
+    top = []
+    stacks = Counter()
+    with open(path) as f:
+        for line in f:
+            match = _GPROF_LINE.match(line)
+            if not match:
+                continue
+            numbers = match.group(1).split()
+            name = _label(match.group(2).strip())
+            self_s = float(numbers[2])
+            entry = {'function': name, 'self_ms': round(self_s * 1000, 3)}
+            if len(numbers) >= 4:
+                entry['calls'] = int(float(numbers[3]))
+            top.append(entry)
+            stacks[name] += int(self_s * 1e6)
+    top.sort(key=lambda entry: -entry['self_ms'])
+    return {'top': top[:MAX_TOP], 'stacks': stacks}
+
+
+def summarize_jfr(path):
+    with open(path) as f:
+        recording = json.load(f)
+    stacks = Counter()
+    functions = Counter()
+    for event in recording.get('recording', {}).get('events', []):
+        frames = (event.get('values', {}).get('stackTrace') or {}).get('frames', [])
+        names = [_label(f"{frame['method']['type']['name']}.{frame['method']['name']}")
+                 for frame in frames]
+        if names:
+            # JFR lists the innermost frame first
+            stacks[';'.join(reversed(names))] += JFR_PERIOD_MS * 1000
+            functions[names[0]] += 1
+    return {
+        'top': [{'function': name, 'samples': count, 'self_ms': count * JFR_PERIOD_MS}
+                for name, count in functions.most_common(MAX_TOP)],
+        'stacks': stacks,
+    }
+
+
+SUMMARIZERS = {
+    '.py': summarize_pstats,
+    '.js': summarize_cpuprofile,
+    '.c': summarize_gprof,
+    '.cpp': summarize_gprof,
+    '.java': summarize_jfr,
+}
+
+
+def summarize(ext, path):
+    """Top functions and capped folded stacks of the raw profile at ``path``."""
+    summary = SUMMARIZERS[ext](path)
+    folded, truncated = _folded(summary['stacks'])
+    return {'top': summary['top'], 'folded': folded,
+            'truncated': truncated or summary.get('truncated', False)}
+
+
+def summarize_isolated(ext, path):
+    """Run ``summarize`` in a child process with CPU, memory and time limits."""
+    try:
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), ext, path],
+                               capture_output=True, timeout=SUMMARY_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"took longer than {SUMMARY_TIMEOUT}s")
+    if child.returncode != 0:
+        lines = child.stderr.decode('utf-8', errors='replace').strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else f"exit status {child.returncode}")
+    return json.loads(child.stdout)
+
+
+def read_profile(ext, directory):
+    """Summarize the raw profile in ``directory``, or None if none was written.
+
+    Returns ``tool``, ``top`` (functions by self time), ``folded`` stacks
+    weighted in microseconds and whether the stacks were ``truncated``.
+    """
+    path = os.path.join(directory, PROFILE_FILES[ext])
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(info.st_mode):
+        # A symlink would make us read a file of the host
+        return {'tool': TOOLS[ext], 'error': "Profile is not a regular file"}
+    if info.st_size == 0:
+        return None
+    if info.st_size > MAX_RAW_BYTES:
+        return {'tool': TOOLS[ext], 'error': f"Profile too large ({info.st_size} bytes)"}
+    try:
+        summary = summarize_isolated(ext, path)
+    except Exception as e:
+        logger.warning("failed to read %s profile: %s", TOOLS[ext], e)
+        return {'tool': TOOLS[ext], 'error': f"Unreadable profile: {e}"}
+    return {'tool': TOOLS[ext], **summary}
+
+
+def main():
+    """Child process entry point: ``profiler.py EXT PATH`` prints the summary as JSON."""
+    import resource
+    resource.setrlimit(resource.RLIMIT_CPU, (SUMMARY_TIMEOUT, SUMMARY_TIMEOUT))
+    resource.setrlimit(resource.RLIMIT_AS, (SUMMARY_MEMORY, SUMMARY_MEMORY))
+    ext, path = sys.argv[1:3]
+    json.dump(summarize(ext, path), sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,566 @@
+#!/usr/bin/env python3
+"""
+Multi-file project submissions with incremental rebuilds.
+
+A project is a file tree submitted as a JSON map or a tar/zip archive and
+identified by a random project id issued on its first run, which the client
+passes back as a handle to its build cache. Its sources and build outputs are cached on the
+host between submissions, and every file is content hashed so only what
+changed is rebuilt:
+
+- C/C++: a translation unit is recompiled when its source, a project header
+  it includes (tracked with ``-MMD``) or the compile flags changed; the
+  program is relinked from the cached object files.
+- Java: changed classes are recompiled together with the sources that
+  reference them; removing a source file triggers a full rebuild.
+- Other languages are copied and run as they are.
+
+Building and running use separate sandboxes. The build sandbox, which
+runs only the compiler, gets the sources read-only and the build outputs
+read-write; the program then runs with both read-only, so it cannot plant
+outputs that a later build would reuse. The manifest and build script stay
+out of reach of both. Files in the cache are opened without following symlinks,
+as older caches and the outputs directory may hold links planted by a
+submission.
+"""
+
+import io
+import os
+import re
+import json
+import stat
+import shlex
+import shutil
+import hashlib
+import logging
+import tarfile
+import time
+import uuid
+import threading
+import zipfile
+from contextlib import contextmanager
+
+import docker
+
+from pool import CACHE_ROOT, labels
+from run_code import (LANGUAGE_CONFIGS, SANDBOX_MEM_LIMIT, TIMINGS_FILE,
+                      compiler_flags, ensure_base_image_exists, parse_timings)
+from sessions import validate_name
+from tracing import span
+
+logger = logging.getLogger('code-runner.projects')
+
+MAX_PROJECT_FILES = 2000
+MAX_PROJECT_BYTES = 32 * 1024 * 1024
+
+# Archive members of any kind, directories included
+MAX_ARCHIVE_ENTRIES = 2 * MAX_PROJECT_FILES
+
+MANIFEST = 'manifest.json'
+BUILD_SCRIPT = 'build.sh'
+
+# Largest dependency or timings file read back from the outputs directory
+MAX_OUTPUT_FILE = 1024 * 1024
+
+TRANSLATION_UNITS = {
+    '.c': ('.c',),
+    '.cpp': ('.cpp', '.cc', '.cxx'),
+}
+
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _read_limited(stream, budget):
+    """Read ``stream`` but fail once it holds more than ``budget`` bytes."""
+    data = stream.read(budget + 1)
+    if len(data) > budget:
+        raise ValueError(f"Project larger than {MAX_PROJECT_BYTES} bytes")
+    return data
+
+
+def load_archive(data, name=''):
+    """Read a tar or zip archive into ``{path: bytes}``.
+
+    File count and total size are checked against the project limits from
+    the archive's headers before anything is decompressed, and again while
+    reading, so an archive cannot expand beyond them in memory.
+    """
+    files = {}
+    total = 0
+    entries = 0
+
+    def admit(size):
+        nonlocal total
+        if len(files) >= MAX_PROJECT_FILES:
+            raise ValueError(f"Too many files (max {MAX_PROJECT_FILES})")
+        total += size
+        if total > MAX_PROJECT_BYTES:
+            raise ValueError(f"Project larger than {MAX_PROJECT_BYTES} bytes")
+
+    if name.endswith('.zip') or zipfile.is_zipfile(io.BytesIO(data)):
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            if len(archive.infolist()) > MAX_ARCHIVE_ENTRIES:
+                raise ValueError(f"Too many archive entries (max {MAX_ARCHIVE_ENTRIES})")
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                admit(info.file_size)
+                # The declared size may lie; never read past the budget
+                with archive.open(info) as f:
+                    files[info.filename] = _read_limited(
+                        f, MAX_PROJECT_BYTES - total + info.file_size)
+    else:
+        with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+            # Iterating decompresses headers one at a time, unlike getmembers()
+            for member in archive:
+                entries += 1
+                if entries > MAX_ARCHIVE_ENTRIES:
+                    raise ValueError(f"Too many archive entries (max {MAX_ARCHIVE_ENTRIES})")
+                if not member.isfile():
+                    continue
+                admit(member.size)
+                files[member.name] = _read_limited(archive.extractfile(member),
+                                                   MAX_PROJECT_BYTES - total + member.size)
+    return files
+
+
+def normalize_tree(files):
+    """Validate names and sizes; text values are encoded as UTF-8."""
+    if len(files) > MAX_PROJECT_FILES:
+        raise ValueError(f"Too many files: {len(files)} (max {MAX_PROJECT_FILES})")
+    tree = {}
+    for name, content in files.items():
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        tree[validate_name(name)] = content
+    if sum(len(content) for content in tree.values()) > MAX_PROJECT_BYTES:
+        raise ValueError(f"Project larger than {MAX_PROJECT_BYTES} bytes")
+    return tree
+
+
+def object_path(unit):
+    return os.path.splitext(unit)[0] + '.o'
+
+
+def parse_depfile(text, known):
+    """Project files listed in a gcc ``-MMD`` dependency file."""
+    body = text.replace('\\\n', ' ').partition(':')[2]
+    return sorted({os.path.normpath(dep) for dep in body.split()} & set(known))
+
+
+def plan_c_build(ext, hashes, manifest, flags):
+    """Return ``(compile, remove, link)`` for a C/C++ project."""
+    units = [name for name in hashes if name.endswith(TRANSLATION_UNITS[ext])]
+    previous = manifest.get('units', {}) if manifest.get('flags') == flags else {}
+    compile_units = []
+    for unit in sorted(units):
+        deps = previous.get(unit)
+        if deps is None or any(hashes.get(dep) != h for dep, h in deps.items()):
+            compile_units.append(unit)
+    remove = sorted(set(manifest.get('units', {})) - set(units))
+    link = bool(compile_units or remove or not manifest.get('linked'))
+    return compile_units, remove, link
+
+
+def plan_java_build(hashes, manifest, sources):
+    """Return ``(compile, full)`` for a Java project.
+
+    ``sources`` maps each .java file to its text, used to find the files
+    referencing a changed class.
+    """
+    java = {name for name in hashes if name.endswith('.java')}
+    previous = manifest.get('files', {})
+    old_java = {name for name in previous if name.endswith('.java')}
+    if not manifest.get('ok') or old_java - java:
+        return sorted(java), True
+    changed = {name for name in java if previous.get(name) != hashes[name]}
+    if not changed:
+        return [], False
+    names = [re.escape(os.path.splitext(os.path.basename(name))[0]) for name in changed]
+    pattern = re.compile(r'\b(' + '|'.join(names) + r')\b')
+    dependents = {name for name in java - changed if pattern.search(sources[name])}
+    return sorted(changed | dependents), False
+
+
+def _parent_fd(root, name, create=False):
+    """Open the directory holding ``name`` below ``root``.
+
+    No component may be a symlink; with ``create`` missing ones are made.
+    """
+    fd = os.open(root, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        for part in name.split('/')[:-1]:
+            if create:
+                try:
+                    os.mkdir(part, dir_fd=fd)
+                except FileExistsError:
+                    pass
+            child = os.open(part, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=fd)
+            os.close(fd)
+            fd = child
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def write_file(root, name, data):
+    """Write ``data`` to ``root/name`` without following symlinks."""
+    parent = _parent_fd(root, name, create=True)
+    try:
+        base = os.path.basename(name)
+        try:
+            # Replace whatever is there, a symlink included
+            if not stat.S_ISDIR(os.lstat(base, dir_fd=parent).st_mode):
+                os.unlink(base, dir_fd=parent)
+        except FileNotFoundError:
+            pass
+        fd = os.open(base, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o644,
+                     dir_fd=parent)
+    finally:
+        os.close(parent)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+
+
+def remove_file(root, name):
+    """Delete ``root/name`` if it exists, without following symlinks."""
+    try:
+        parent = _parent_fd(root, name)
+    except OSError:
+        return
+    try:
+        os.unlink(os.path.basename(name), dir_fd=parent)
+    except (FileNotFoundError, IsADirectoryError, PermissionError):
+        pass
+    finally:
+        os.close(parent)
+
+
+def read_file(root, name, limit=MAX_OUTPUT_FILE):
+    """Read a regular file below ``root``, or None if there is none.
+
+    Symlinks, FIFOs and devices are refused; at most ``limit`` bytes are read.
+    """
+    try:
+        parent = _parent_fd(root, name)
+    except OSError:
+        return None
+    try:
+        fd = os.open(os.path.basename(name), os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK,
+                     dir_fd=parent)
+    except OSError:
+        return None
+    finally:
+        os.close(parent)
+    with os.fdopen(fd, 'rb') as f:
+        if not stat.S_ISREG(os.fstat(fd).st_mode):
+            return None
+        return f.read(limit)
+
+
+def tree_size(path):
+    """Bytes used by the files below ``path``."""
+    size = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(directory, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+class Project:
+    """A cached project tree and its build outputs on the host."""
+
+    def __init__(self, project_id, root=CACHE_ROOT):
+        if not re.fullmatch(r'[A-Za-z0-9_.-]{1,64}', project_id) or project_id in ('.', '..'):
+            raise ValueError(f"Invalid project id: {project_id}")
+        self.id = project_id
+        self.dir = os.path.join(root, project_id)
+        self.src = os.path.join(self.dir, 'src')
+        self.obj = os.path.join(self.dir, 'obj')
+        self.lock = threading.Lock()
+
+    def load_manifest(self):
+        data = read_file(self.dir, MANIFEST, MAX_PROJECT_BYTES)
+        try:
+            return json.loads(data) if data else {}
+        except ValueError:
+            return {}
+
+    def save_manifest(self, manifest):
+        write_file(self.dir, MANIFEST + '.tmp', json.dumps(manifest).encode('utf-8'))
+        os.replace(os.path.join(self.dir, MANIFEST + '.tmp'), os.path.join(self.dir, MANIFEST))
+
+    def sync(self, tree, manifest):
+        """Write changed files and delete removed ones; return their names."""
+        os.makedirs(self.src, exist_ok=True)
+        os.makedirs(self.obj, exist_ok=True)
+        previous = manifest.get('files', {})
+        hashes = {name: file_hash(content) for name, content in tree.items()}
+        changed = sorted(name for name in tree if previous.get(name) != hashes[name])
+        removed = sorted(set(previous) - set(tree))
+        for name in changed:
+            write_file(self.src, name, tree[name])
+        for name in removed:
+            remove_file(self.src, name)
+        return hashes, changed, removed
+
+
+def build_script(steps):
+    """Shell script that runs the build steps and records their duration."""
+    lines = [
+        'cd /app/src',
+        't0=$(date +%s%N)',
+        '(',
+        '  set -e',
+    ]
+    lines += [f'  {step}' for step in steps]
+    lines += [
+        ')',
+        'rc=$?',
+        't1=$(date +%s%N)',
+        f'echo compile_ms=$(( (t1 - t0) / 1000000 )) > /app/obj/{TIMINGS_FILE}',
+        'exit $rc',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def run_sandbox(client, ext, command, volumes, output):
+    """Run ``command`` in a sandbox, write its output and return its exit code."""
+    try:
+        logs = client.containers.run(
+            LANGUAGE_CONFIGS[ext]['base_image'],
+            command,
+            volumes=volumes,
+            working_dir='/app/src',
+            remove=True,
+            stdout=True,
+            stderr=True,
+            mem_limit=SANDBOX_MEM_LIMIT,
+            network_disabled=True,
+            labels=labels('project')
+        )
+    except docker.errors.ContainerError as e:
+        output.write(e.stderr.decode('utf-8', errors='replace') if e.stderr else '')
+        return e.exit_status
+    output.write(logs.decode('utf-8', errors='replace'))
+    return 0
+
+
+def plan_steps(ext, tree, hashes, manifest, entry, profile, std):
+    """Build steps, run command and the manifest to save after a good build."""
+    q = shlex.quote
+    new_manifest = {'files': hashes}
+    if ext in TRANSLATION_UNITS:
+        flags = compiler_flags(ext, profile, std)
+        compile_units, remove, link = plan_c_build(ext, hashes, manifest, flags)
+        compiler = 'gcc' if ext == '.c' else 'g++'
+        steps = [f'rm -f {q("/app/obj/" + object_path(unit))}' for unit in remove]
+        for unit in compile_units:
+            obj = '/app/obj/' + object_path(unit)
+            steps.append(f'mkdir -p {q(os.path.dirname(obj))}')
+            steps.append(f'{compiler} {flags} -MMD -MF {q(obj[:-2] + ".d")} '
+                         f'-c {q(unit)} -o {q(obj)}')
+        units = sorted(name for name in hashes if name.endswith(TRANSLATION_UNITS[ext]))
+        if link:
+            objects = ' '.join(q('/app/obj/' + object_path(unit)) for unit in units)
+            libs = ' -lm' if ext == '.c' else ''
+            steps.append(f'{compiler} {objects} -o /app/obj/main{libs}')
+        new_manifest.update(flags=flags, compiled=compile_units, linked=True,
+                            units={u: manifest.get('units', {}).get(u) for u in units})
+        return steps, '/app/obj/main', new_manifest, {'compiled': compile_units, 'linked': link}
+
+    if ext == '.java':
+        sources = {name: tree[name].decode('utf-8', errors='replace')
+                   for name in hashes if name.endswith('.java')}
+        compile_files, full = plan_java_build(hashes, manifest, sources)
+        steps = []
+        if full:
+            # /app/obj is a mount point and cannot be removed itself
+            steps.append('find /app/obj -mindepth 1 -delete')
+        if compile_files:
+            steps.append('javac -d /app/obj -cp /app/obj '
+                         + ' '.join(q(name) for name in compile_files))
+        new_manifest['ok'] = True
+        main_class = entry or 'Solution'
+        return (steps, f'java -cp /app/obj {q(main_class)}', new_manifest,
+                {'compiled': compile_files, 'full': full})
+
+    if ext == '.cs':
+        sources = ' '.join(q(name) for name in sorted(hashes) if name.endswith('.cs'))
+        steps = [f'mcs -out:/app/obj/Program.exe {sources}']
+        return steps, 'mono /app/obj/Program.exe', new_manifest, {'compiled': ['*.cs']}
+
+    main_file = entry or LANGUAGE_CONFIGS[ext]['main_file']
+    run = {
+        '.py': 'python', '.js': 'node', '.rb': 'ruby', '.php': 'php',
+    }[ext]
+    return [], f'{run} {q(main_file)}', new_manifest, {'compiled': []}
+
+
+def record_dependencies(project, manifest, hashes):
+    """Store the project files each compiled unit depends on, with their hashes."""
+    units = manifest.get('units', {})
+    for unit in manifest.pop('compiled', []):
+        # Written by the sandbox: read without following symlinks
+        depfile = read_file(project.obj, object_path(unit)[:-2] + '.d')
+        if depfile is None:
+            deps = [unit]
+        else:
+            deps = parse_depfile(depfile.decode('utf-8', errors='replace'), hashes)
+        units[unit] = {dep: hashes[dep] for dep in set(deps) | {unit}}
+    manifest['units'] = {unit: deps for unit, deps in units.items() if deps is not None}
+
+
+def run_project(project, ext, files, client, output, entry=None, profile=None, std=None,
+                timings=None):
+    """Sync ``files`` into ``project``, rebuild what changed and run it.
+
+    Returns ``(exit_code, build)`` where ``build`` describes what was rebuilt.
+    """
+    if ext not in LANGUAGE_CONFIGS:
+        raise ValueError(f"Unsupported file extension: {ext}")
+    tree = normalize_tree(files)
+    if not ensure_base_image_exists(client, ext):
+        raise RuntimeError(f"Failed to ensure base image for {ext}")
+
+    with project.lock:
+        manifest = project.load_manifest()
+        if not (os.path.isdir(project.src) and os.path.isdir(project.obj)):
+            # Evicted or never built: start from scratch
+            manifest = {}
+        with span('sync_files'):
+            hashes, changed, removed = project.sync(tree, manifest)
+        steps, run_cmd, new_manifest, build = plan_steps(
+            ext, tree, hashes, manifest, entry, profile, std)
+        build.update(changed=changed, removed=removed)
+        project_timings = {}
+        exit_code = 0
+        if steps:
+            write_file(project.dir, BUILD_SCRIPT, build_script(steps).encode('utf-8'))
+            remove_file(project.obj, TIMINGS_FILE)
+            with span('container_build', compiled=len(build['compiled'])):
+                # Only the build outputs are writable; the supervisor never
+                # writes into them
+                exit_code = run_sandbox(client, ext, ['sh', f'/app/{BUILD_SCRIPT}'], {
+                    project.src: {'bind': '/app/src', 'mode': 'ro'},
+                    project.obj: {'bind': '/app/obj', 'mode': 'rw'},
+                    os.path.join(project.dir, BUILD_SCRIPT):
+                        {'bind': f'/app/{BUILD_SCRIPT}', 'mode': 'ro'},
+                }, output)
+            project_timings = parse_timings(read_file(project.obj, TIMINGS_FILE) or b'')
+        # Only a successful build has usable outputs; after a failed one the
+        # units it tried to compile are rebuilt next time
+        if exit_code == 0:
+            if 'units' in new_manifest:
+                record_dependencies(project, new_manifest, hashes)
+        else:
+            new_manifest.update(ok=False, linked=False)
+            for unit in new_manifest.pop('compiled', []):
+                new_manifest['units'].pop(unit, None)
+        project.save_manifest(new_manifest)
+
+        if exit_code == 0:
+            # Timed here as the program cannot write anything read back
+            started = time.monotonic()
+            with span('container_run'):
+                exit_code = run_sandbox(client, ext, ['sh', '-c', run_cmd], {
+                    project.src: {'bind': '/app/src', 'mode': 'ro'},
+                    project.obj: {'bind': '/app/obj', 'mode': 'ro'},
+                }, output)
+            project_timings['run_ms'] = int((time.monotonic() - started) * 1000)
+        if timings is not None:
+            timings.update(project_timings)
+        return exit_code, build
+
+
+class ProjectStore:
+    """Projects in use by id, so concurrent submissions of one project serialize.
+
+    Only projects with a run or a deletion in progress are held; ``lock``
+    covers looking them up, evicting and deleting, so a project is never
+    deleted from under a run.
+    """
+
+    def __init__(self, root=CACHE_ROOT):
+        self.root = root
+        self.lock = threading.Lock()
+        self.projects = {}
+        self.users = {}
+
+    def issued(self, project_id):
+        """Whether ``project_id`` names a project created by ``new_id``."""
+        return (re.fullmatch(r'[0-9a-f]{32}', project_id or '') is not None
+                and os.path.isdir(os.path.join(self.root, project_id)))
+
+    def new_id(self):
+        return uuid.uuid4().hex
+
+    @contextmanager
+    def open(self, project_id):
+        """Hold the project ``project_id`` while the block uses it."""
+        with self.lock:
+            project = self.projects.get(project_id)
+            if project is None:
+                project = Project(project_id, self.root)
+                self.projects[project_id] = project
+            self.users[project_id] = self.users.get(project_id, 0) + 1
+        try:
+            yield project
+        finally:
+            with self.lock:
+                self.users[project_id] -= 1
+                if not self.users[project_id]:
+                    del self.users[project_id]
+                    del self.projects[project_id]
+
+    def remove(self, project_id):
+        with self.open(project_id) as project, project.lock:
+            shutil.rmtree(project.dir, ignore_errors=True)
+
+    def least_recently_used(self):
+        """Ids of the cached projects, least recently run first."""
+        entries = []
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        for name in names:
+            path = os.path.join(self.root, name)
+            if os.path.islink(path) or not os.path.isdir(path):
+                continue
+            try:
+                # The manifest is rewritten after every run
+                used = os.path.getmtime(os.path.join(path, MANIFEST))
+            except OSError:
+                try:
+                    used = os.path.getmtime(path)
+                except OSError:
+                    continue
+            entries.append((used, name))
+        return [name for _, name in sorted(entries)]
+
+    def evict(self):
+        """Delete the least recently run project that is not in use.
+
+        Returns the number of bytes freed, or None when nothing is left to evict.
+        """
+        with self.lock:
+            for project_id in self.least_recently_used():
+                if project_id in self.projects:
+                    continue
+                path = os.path.join(self.root, project_id)
+                size = tree_size(path)
+                try:
+                    shutil.rmtree(path)
+                except OSError as e:
+                    logger.warning("failed to evict project %s: %s", project_id, e)
+                    continue
+                logger.info("evicted project %s (%d bytes)", project_id, size)
+                return size
+        return None
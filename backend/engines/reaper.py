@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Background maintenance: reap leaked sandboxes and keep disk usage in check.
+
+Runs normally clean up after themselves (``remove=True``, temporary
+directories), but crashed or killed runs leave containers, volumes and
+temporary directories behind, and rebuilt base images leave dangling
+layers. Every container, volume and base image the runner creates carries
+the ``code-runner.kind`` label (see ``pool.py``) and its temporary files
+start with ``code-runner-``. Every CODE_RUNNER_REAP_INTERVAL seconds the
+reaper
+
+- removes labelled containers and volumes on every healthy node that the
+  supervisor does not hold (warm pools, sessions, compile servers) and
+  that are older than CODE_RUNNER_REAP_AFTER seconds;
+- deletes the runner's temporary files and directories not modified for
+  as long;
+- prunes dangling base image layers;
+- when the disk holding the temporary directory is fuller than
+  CODE_RUNNER_DISK_HIGH_WATER (a fraction, default 0.85), evicts the least
+  recently used project build caches and prunes the Docker build cache of
+  local nodes until it is back under the mark.
+
+What it did is counted in ``metrics`` (see ``GET /metrics``).
+"""
+
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from datetime import datetime
+
+from pool import LABEL, TEMP_PREFIX
+
+logger = logging.getLogger('code-runner.reaper')
+
+INTERVAL = float(os.environ.get('CODE_RUNNER_REAP_INTERVAL', '300'))
+
+# Age after which an object nobody holds is considered leaked; no run or
+# dependency install takes this long
+MAX_AGE = float(os.environ.get('CODE_RUNNER_REAP_AFTER', '3600'))
+
+HIGH_WATER = float(os.environ.get('CODE_RUNNER_DISK_HIGH_WATER', '0.85'))
+
+# Caches are evicted down to this much below the high-water mark
+HEADROOM = 0.05
+
+COUNTERS = (
+    'passes', 'containers_reaped', 'volumes_reaped', 'temp_reaped', 'images_pruned',
+    'image_bytes_reclaimed', 'caches_evicted', 'cache_bytes_evicted',
+    'build_cache_bytes_reclaimed', 'disk_pressure_passes', 'errors',
+)
+
+
+def _created(value):
+    """Unix time of a Docker ``Created``/``CreatedAt`` value."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class Reaper:
+    """Periodically clean up after the runner.
+
+    ``live`` returns what the supervisor still holds, as a dict of sets:
+    ``containers`` (ids), ``volumes`` (names) and ``paths``. ``evict``
+    deletes the least recently used cache entry and returns the bytes
+    freed, or None when there is nothing left to evict.
+    """
+
+    def __init__(self, nodes, live, evict=None, temp_dir=None, max_age=MAX_AGE,
+                 high_water=HIGH_WATER, clock=time.time):
+        self.nodes = nodes
+        self.live = live
+        self.evict = evict
+        self.temp_dir = temp_dir or tempfile.gettempdir()
+        self.max_age = max_age
+        self.high_water = high_water
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.metrics = dict.fromkeys(COUNTERS, 0)
+        self.last_pass = None
+        self.last_duration_ms = None
+        self.disk_usage = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.metrics[key] += value
+
+    def reap(self):
+        """Run one maintenance pass."""
+        started = time.perf_counter()
+        live = self.live()
+        deadline = self.clock() - self.max_age
+        for node in self.nodes.nodes:
+            if node.drained or node.client is None:
+                continue
+            for step in (self.reap_containers, self.reap_volumes):
+                try:
+                    step(node, live, deadline)
+                except Exception as e:
+                    self.count('errors')
+                    logger.warning("%s on %s failed: %s", step.__name__, node.name, e)
+            self.prune_images(node)
+        self.reap_temp(live, deadline)
+        self.relieve_disk_pressure()
+        with self.lock:
+            self.metrics['passes'] += 1
+            self.last_pass = self.clock()
+            self.last_duration_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    def reap_containers(self, node, live, deadline):
+        containers = node.client.containers.list(all=True, sparse=True,
+                                                 filters={'label': LABEL})
+        for container in containers:
+            created = _created(container.attrs.get('Created'))
+            if container.id in live['containers'] or created is None or created > deadline:
+                continue
+            try:
+                container.remove(force=True)
+            except Exception as e:
+                self.count('errors')
+                logger.warning("failed to reap container %s: %s", container.id[:12], e)
+                continue
+            self.count('containers_reaped')
+            logger.info("reaped %s container %s on %s",
+                        (container.attrs.get('Labels') or {}).get(LABEL), container.id[:12],
+                        node.name)
+
+    def reap_volumes(self, node, live, deadline):
+        for volume in node.client.volumes.list(filters={'label': LABEL}):
+            created = _created(volume.attrs.get('CreatedAt'))
+            if volume.name in live['volumes'] or created is None or created > deadline:
+                continue
+            try:
+                volume.remove(force=True)
+            except Exception as e:
+                # Still mounted by a container reaped in a later pass
+                logger.debug("volume %s not reaped: %s", volume.name, e)
+                continue
+            self.count('volumes_reaped')
+            logger.info("reaped volume %s on %s", volume.name, node.name)
+
+    def prune_images(self, node):
+        try:
+            pruned = node.client.images.prune(filters={'dangling': True, 'label': LABEL})
+        except Exception as e:
+            self.count('errors')
+            logger.warning("image prune on %s failed: %s", node.name, e)
+            return
+        deleted = pruned.get('ImagesDeleted') or []
+        if deleted:
+            self.count('images_pruned', len(deleted))
+            self.count('image_bytes_reclaimed', pruned.get('SpaceReclaimed') or 0)
+            logger.info("pruned %d dangling image layers on %s", len(deleted), node.name)
+
+    def reap_temp(self, live, deadline):
+        try:
+            names = os.listdir(self.temp_dir)
+        except OSError as e:
+            self.count('errors')
+            logger.warning("cannot list %s: %s", self.temp_dir, e)
+            return
+        for name in names:
+            path = os.path.join(self.temp_dir, name)
+            if not name.startswith(TEMP_PREFIX) or path in live['paths']:
+                continue
+            try:
+                if os.path.islink(path) or os.lstat(path).st_mtime > deadline:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.isfile(path):
+                    os.unlink(path)
+                else:
+                    # Sockets such as the supervisor's
+                    continue
+            except OSError as e:
+                self.count('errors')
+                logger.warning("failed to reap %s: %s", path, e)
+                continue
+            self.count('temp_reaped')
+            logger.info("reaped %s", path)
+
+    def usage(self):
+        """Fraction of the temporary directory's disk in use."""
+        usage = shutil.disk_usage(self.temp_dir)
+        self.disk_usage = round(usage.used / usage.total, 4) if usage.total else 0.0
+        return self.disk_usage
+
+    def relieve_disk_pressure(self):
+        if self.usage() <= self.high_water:
+            return
+        self.count('disk_pressure_passes')
+        target = round(self.high_water - HEADROOM, 4)
+        logger.warning("disk %.0f%% full (high-water mark %.0f%%), evicting caches",
+                       self.disk_usage * 100, self.high_water * 100)
+        while self.evict is not None and self.usage() > target:
+            freed = self.evict()
+            if freed is None:
+                break
+            self.count('caches_evicted')
+            self.count('cache_bytes_evicted', freed)
+        for node in self.nodes.nodes:
+            if self.usage() <= target:
+                return
+            if not node.local or node.drained or node.client is None:
+                continue
+            try:
+                pruned = node.client.api.prune_builds()
+            except Exception as e:
+                self.count('errors')
+                logger.warning("build cache prune on %s failed: %s", node.name, e)
+                continue
+            self.count('build_cache_bytes_reclaimed', pruned.get('SpaceReclaimed') or 0)
+
+    def report(self):
+        with self.lock:
+            return {
+                **self.metrics,
+                'last_pass': self.last_pass,
+                'last_duration_ms': self.last_duration_ms,
+                'disk_usage': self.disk_usage,
+                'disk_high_water': self.high_water,
+            }
+
+    def start(self, interval=INTERVAL):
+        """Reap now and then periodically in a daemon thread."""
+        if self._thread is not None:
+            return
+
+        def loop():
+            # The first pass cleans up after a previous, crashed supervisor
+            while True:
+                try:
+                    self.reap()
+                except Exception as e:
+                    self.count('errors')
+                    logger.warning("reaper pass failed: %s", e)
+                if self._stop.wait(interval):
+                    break
+
+        self._thread = threading.Thread(target=loop, name='reaper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Compact local RPC between the API workers and the sandbox supervisor.
+
+Messages are JSON objects framed by a 4-byte big-endian length over a unix
+socket. A request is ``{"method": ..., "params": {...}}`` and the reply is
+either ``{"result": ...}`` or ``{"error": "...", "kind": "..."}``. A connection may carry
+any number of requests. When the caller is tracing a request it sets
+``"trace": true`` and the reply carries the handler's spans under
+``"trace"``, which are merged into the caller's trace. This module only uses the standard library so the
+API workers can import it without the engine's dependencies.
+"""
+
+import os
+import json
+import socket
+import struct
+import logging
+import tempfile
+import socketserver
+
+import tracing
+
+logger = logging.getLogger('code-runner.rpc')
+
+SOCKET_ENV = 'CODE_RUNNER_SUPERVISOR_SOCKET'
+DEFAULT_SOCKET = os.environ.get(
+    SOCKET_ENV, os.path.join(tempfile.gettempdir(), 'code-runner-supervisor.sock'))
+
+HEADER = struct.Struct('>I')
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+
+class RpcError(Exception):
+    """Raised for protocol errors and errors reported by the remote side.
+
+    ``kind`` is the exception class name raised by the remote handler.
+    """
+
+    def __init__(self, message, kind=None):
+        super().__init__(message)
+        self.kind = kind
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            if data:
+                raise RpcError("Connection closed mid-message")
+            return None
+        data.extend(chunk)
+    return bytes(data)
+
+
+def send_message(sock, message):
+    data = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    if len(data) > MAX_MESSAGE_SIZE:
+        raise RpcError(f"Message too large: {len(data)} bytes")
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    """Read one message, or return None when the peer closed the connection."""
+    header = _recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > MAX_MESSAGE_SIZE:
+        raise RpcError(f"Message too large: {length} bytes")
+    body = _recv_exact(sock, length)
+    if body is None:
+        raise RpcError("Connection closed mid-message")
+    return json.loads(body)
+
+
+def call(method, socket_path=None, timeout=None, **params):
+    """Call ``method`` on the supervisor and return its result."""
+    trace = tracing.current()
+    request = {'method': method, 'params': params}
+    if trace is not None:
+        request['trace'] = True
+    with tracing.span(f'rpc.{method}'):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path or DEFAULT_SOCKET)
+            send_message(sock, request)
+            reply = recv_message(sock)
+        if reply is not None and trace is not None and 'trace' in reply:
+            trace.merge(reply['trace'])
+    if reply is None:
+        raise RpcError("Supervisor closed the connection")
+    if 'error' in reply:
+        raise RpcError(reply['error'], reply.get('kind'))
+    return reply.get('result')
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        handlers = self.server.handlers
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (OSError, RpcError, ValueError) as e:
+                logger.warning("dropping connection: %s", e)
+                return
+            if request is None:
+                return
+            method = request.get('method')
+            with tracing.start_trace(method, buffer=None) as trace:
+                try:
+                    if method not in handlers:
+                        raise RpcError(f"Unknown method: {method}")
+                    reply = {'result': handlers[method](**request.get('params', {}))}
+                except Exception as e:
+                    logger.exception("%s failed", method)
+                    reply = {'error': str(e), 'kind': type(e).__name__}
+            if request.get('trace'):
+                reply['trace'] = trace.to_dict()
+            try:
+                send_message(self.request, reply)
+            except OSError:
+                return
+
+
+class RpcServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve ``handlers`` (method name -> callable) on a unix socket."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, handlers):
+        self.socket_path = socket_path
+        self.handlers = handlers
+        if os.path.exists(socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                # Left behind by a previous (crashed) supervisor
+                os.unlink(socket_path)
+            else:
+                raise RuntimeError(f"Another supervisor is listening on {socket_path}")
+            finally:
+                probe.close()
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o660)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
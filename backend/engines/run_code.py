@@ -1,10 +1,19 @@
 import os
 import sys
+import json
+import time
 import tempfile
 import argparse
 import shutil
 import docker
+import requests
 from pathlib import Path
+from pool import TEMP_PREFIX, discard_sandbox, labels, start_sandbox, run_in_sandbox
+from nodes import is_node_failure
+from benchmark import BENCHMARK_FILE, benchmark_command, read_results
+from benchmark import validate as validate_benchmark
+import profiler
+from tracing import span
 
 # Language configurations with base image tags
 LANGUAGE_CONFIGS = {
@@ -50,6 +59,38 @@ LANGUAGE_CONFIGS = {
     }
 }
 
+# Memory limit applied to every sandbox container
+SANDBOX_MEM_LIMIT = "128m"
+
+# Seconds a dependency installation may take before it is killed
+INSTALL_TIMEOUT = float(os.environ.get('CODE_RUNNER_INSTALL_TIMEOUT', '120'))
+
+# Optimization profiles for C and C++, selectable per request
+COMPILE_PROFILES = {
+    'fast-compile': ['-O0'],
+    'fast-run': ['-O2'],
+}
+DEFAULT_PROFILE = 'fast-compile'
+
+# Accepted -std= values and the default per language. The base images ship
+# precompiled headers for the defaults and a few common combinations (see
+# dockerfiles/Dockerfile.c and dockerfiles/Dockerfile.cpp)
+LANGUAGE_STANDARDS = {
+    '.c': ['c99', 'c11', 'c17', 'gnu99', 'gnu11', 'gnu17'],
+    '.cpp': ['c++11', 'c++14', 'c++17', 'c++20', 'gnu++14', 'gnu++17', 'gnu++20'],
+}
+DEFAULT_STANDARDS = {
+    '.c': 'gnu17',
+    '.cpp': 'gnu++17',
+}
+
+# Directory in the C/C++ base images holding the precompiled headers; gcc
+# only uses one for the first #include of the program
+PCH_DIR = '/usr/local/include/pch'
+
+# File written by compiled-language commands with compile and run durations
+TIMINGS_FILE = '.timings'
+
 
 def ensure_base_image_exists(client, ext):
     """Ensure the base image for the language exists, build if necessary."""
@@ -76,7 +117,8 @@ def ensure_base_image_exists(client, ext):
                 dockerfile=config['dockerfile'],
                 tag=base_image,
                 rm=True,
-                forcerm=True
+                forcerm=True,
+                labels=labels('image')
             )
             return True
         except Exception as e:
@@ -84,31 +126,197 @@ def ensure_base_image_exists(client, ext):
             return False
 
 
-def run_code_in_docker(source_path, deps=None):
-    """Run code in Docker container using pre-built base images."""
+def compiler_flags(ext, profile=None, std=None):
+    """Return the gcc/g++ flags for a compile profile and -std= value."""
+    profile = profile or DEFAULT_PROFILE
+    std = std or DEFAULT_STANDARDS[ext]
+    if profile not in COMPILE_PROFILES:
+        raise ValueError(f"Unknown compile profile: {profile}")
+    if std not in LANGUAGE_STANDARDS[ext]:
+        raise ValueError(f"Unsupported standard for {ext}: {std}")
+    return ' '.join(COMPILE_PROFILES[profile] + [f'-std={std}', f'-I{PCH_DIR}'])
+
+
+def timed_command(run_cmd, compile_cmd=None):
+    """Wrap compile and run steps in a shell that records their durations."""
+    steps = ['t0=$(date +%s%N)']
+    if compile_cmd:
+        steps += [
+            compile_cmd,
+            'rc=$?',
+            't1=$(date +%s%N)',
+            f'echo compile_ms=$(( (t1 - t0) / 1000000 )) > {TIMINGS_FILE}',
+            'if [ $rc -ne 0 ]; then exit $rc; fi',
+            't0=$t1',
+        ]
+    redirect = '>>' if compile_cmd else '>'
+    steps += [
+        run_cmd,
+        'rc=$?',
+        't1=$(date +%s%N)',
+        f'echo run_ms=$(( (t1 - t0) / 1000000 )) {redirect} {TIMINGS_FILE}',
+        'exit $rc',
+    ]
+    return "sh -c '" + '; '.join(steps) + "'"
+
+
+def parse_timings(data):
+    """Durations in the contents of a timings file, in milliseconds."""
+    timings = {}
+    for line in data.decode('utf-8', errors='replace').splitlines():
+        key, _, value = line.strip().partition('=')
+        if value.isdigit():
+            timings[key] = int(value)
+    return timings
+
+
+def read_timings(directory):
+    """Read the durations written by a timed command, in milliseconds."""
+    try:
+        with open(os.path.join(directory, TIMINGS_FILE), 'rb') as f:
+            return parse_timings(f.read())
+    except FileNotFoundError:
+        return {}
+
+
+def command_steps(ext, main_file, profile=None, std=None):
+    """Return ``(compile_cmd, run_cmd)`` for main_file; compile_cmd is None if not compiled."""
+    if ext == '.py':
+        return None, f"python {main_file}"
+    elif ext == '.js':
+        return None, f"node {main_file}"
+    elif ext == '.rb':
+        return None, f"ruby {main_file}"
+    elif ext == '.java':
+        return f"javac {main_file}", "java Solution"
+    elif ext == '.c':
+        flags = compiler_flags(ext, profile, std)
+        return f"gcc {flags} -o main {main_file} -lm", "./main"
+    elif ext == '.cpp':
+        flags = compiler_flags(ext, profile, std)
+        return f"g++ {flags} -o main {main_file}", "./main"
+    elif ext == '.php':
+        return None, f"php {main_file}"
+    elif ext == '.cs':
+        return f"mcs {main_file} -out:Program.exe", "mono Program.exe"
+    return None, f"echo 'Unsupported language: {ext}'"
+
+
+def build_command(ext, main_file, profile=None, std=None, benchmark=None, profiling=False,
+                  timed=False):
+    """Return the container command that compiles (if needed) and runs main_file.
+
+    With ``benchmark`` options (``runs``, ``warmup``) the run step is repeated;
+    with ``profiling`` the program runs under its language's profiler.
+    Compiled programs are always timed, interpreted ones with ``timed``.
+    """
+    compile_cmd, run_cmd = command_steps(ext, main_file, profile, std)
+    if profiling:
+        compile_cmd, run_cmd = profiler.profile_command(ext, compile_cmd, run_cmd)
+        return timed_command(run_cmd, compile_cmd)
+    if benchmark:
+        return timed_command(
+            benchmark_command(run_cmd, benchmark['runs'], benchmark.get('warmup', 1)),
+            compile_cmd)
+    if compile_cmd is None and not timed:
+        return run_cmd
+    return timed_command(run_cmd, compile_cmd)
+
+
+def install_dependencies(client, image, command, volumes, timeout=INSTALL_TIMEOUT):
+    """Run a package manager ``command`` in a short-lived container.
+
+    The container has network access but the sandbox memory limit, and is
+    killed after ``timeout`` seconds. Raises on timeout or failure.
+    """
+    container = client.containers.run(
+        image,
+        command,
+        detach=True,
+        volumes=volumes,
+        working_dir='/app',
+        mem_limit=SANDBOX_MEM_LIMIT,
+        labels=labels('install')
+    )
+    try:
+        try:
+            status = container.wait(timeout=timeout)['StatusCode']
+        except requests.exceptions.RequestException:
+            # Raises instead if the Docker host itself is gone
+            container.kill()
+            raise TimeoutError(f"Dependency installation timed out after {timeout:g}s")
+        if status != 0:
+            logs = container.logs().decode('utf-8', errors='replace').strip()
+            raise RuntimeError(f"Dependency installation failed ({status}): {logs[-1000:]}")
+    finally:
+        discard_sandbox(container)
+
+
+def run_code_in_docker(source_path, deps=None, client=None, pool=None, output=None,
+                       compilers=None, profile=None, std=None, timings=None,
+                       copy_files=False, benchmark=None, profiling=None, time_runs=False):
+    """Run code in Docker container using pre-built base images.
+
+    ``client`` reuses an existing Docker client, ``pool`` is an optional
+    WarmPool to take a pre-started sandbox from, ``compilers`` optional
+    CompileServers to compile Java/C# in a warm daemon and ``output`` a
+    file-like object receiving program output and messages (stdout/stderr
+    otherwise). ``profile`` and ``std`` select the C/C++ compile profile and
+    standard. If ``timings`` is a dict it receives ``compile_ms`` and
+    ``run_ms`` for compiled languages, and for interpreted ones ``run_ms``
+    with ``time_runs``; as the timings file is then written where the program
+    can write too, only ask for it for trusted code such as the shipped
+    templates. ``copy_files`` copies the files into
+    the sandbox instead of bind mounting them, for Docker hosts that do not
+    share this machine's filesystem (dependencies are not installed then).
+    ``benchmark`` is a dict of benchmark options: ``runs`` measured runs
+    after ``warmup`` iterations in the same sandbox, pinned to ``cpus``;
+    the statistics are stored in it under ``results``. If ``profiling`` is a
+    dict the program runs under a profiler and the profile summary is
+    stored in it under ``results``.
+    """
     deps = deps or []
+    out = output or sys.stdout
+    err = output or sys.stderr
     ext = os.path.splitext(source_path)[1]
     
     if ext not in LANGUAGE_CONFIGS:
         raise ValueError(f"Unsupported file extension: {ext}")
     
-    client = docker.from_env()
+    if ext in LANGUAGE_STANDARDS:
+        # Validate profile and standard before touching Docker
+        compiler_flags(ext, profile, std)
+    if benchmark:
+        validate_benchmark(benchmark['runs'], benchmark.get('warmup', 1))
+    if profiling is not None:
+        if benchmark:
+            raise ValueError("Benchmark and profile modes cannot be combined")
+        if not profiler.supports(ext):
+            raise ValueError(f"Profiling is not supported for {ext}")
+    
+    with span('docker_client'):
+        client = client or docker.from_env()
     config = LANGUAGE_CONFIGS[ext]
     
     # Ensure base image exists
-    if not ensure_base_image_exists(client, ext):
+    with span('ensure_image', image=config['base_image']):
+        image_ready = ensure_base_image_exists(client, ext)
+    if not image_ready:
         raise RuntimeError(f"Failed to ensure base image for {ext}")
     
     # Create temporary directory for code execution
-    with tempfile.TemporaryDirectory() as temp_dir:
+    with tempfile.TemporaryDirectory(prefix=TEMP_PREFIX) as temp_dir:
         # Copy source file to temp directory with expected name
         main_file = config['main_file']
         temp_code_path = os.path.join(temp_dir, main_file)
-        shutil.copy2(source_path, temp_code_path)
+        with span('copy_files'):
+            shutil.copy2(source_path, temp_code_path)
         
         
         # Handle dependencies if provided
-        if deps and ext == '.py':
+        if deps and copy_files:
+            print("Warning: Dependencies can only be installed on local Docker hosts", file=out)
+        elif deps and ext == '.py':
             # Create requirements.txt for Python dependencies
             requirements_path = os.path.join(temp_dir, 'requirements.txt')
             with open(requirements_path, 'w') as f:
@@ -120,15 +328,17 @@ def run_code_in_docker(source_path, deps=None):
             if os.path.getsize(requirements_path) > 0:
                 try:
                     # Run pip install in temporary container
-                    client.containers.run(
-                        config['base_image'],
-                        f"pip install -r /app/requirements.txt",
-                        volumes={temp_dir: {'bind': '/app', 'mode': 'rw'}},
-                        working_dir='/app',
-                        remove=True
-                    )
+                    with span('install_deps', manager='pip'):
+                        install_dependencies(
+                            client,
+                            config['base_image'],
+                            "pip install -r /app/requirements.txt",
+                            {temp_dir: {'bind': '/app', 'mode': 'rw'}}
+                        )
                 except Exception as e:
-                    print(f"Warning: Failed to install dependencies: {e}")
+                    if is_node_failure(e):
+                        raise
+                    print(f"Warning: Failed to install dependencies: {e}", file=out)
         
         elif deps and ext == '.js':
             # Handle Node.js dependencies
@@ -142,83 +352,142 @@ def run_code_in_docker(source_path, deps=None):
                     package_json["dependencies"][dep] = "latest"
             
             if package_json["dependencies"]:
-                import json
                 package_path = os.path.join(temp_dir, 'package.json')
                 with open(package_path, 'w') as f:
                     json.dump(package_json, f, indent=2)
                 
                 try:
                     # Run npm install in temporary container
-                    client.containers.run(
-                        config['base_image'],
-                        "npm install",
-                        volumes={temp_dir: {'bind': '/app', 'mode': 'rw'}},
-                        working_dir='/app',
-                        remove=True
-                    )
+                    with span('install_deps', manager='npm'):
+                        install_dependencies(
+                            client,
+                            config['base_image'],
+                            "npm install",
+                            {temp_dir: {'bind': '/app', 'mode': 'rw'}}
+                        )
                 except Exception as e:
-                    print(f"Warning: Failed to install dependencies: {e}")
+                    if is_node_failure(e):
+                        raise
+                    print(f"Warning: Failed to install dependencies: {e}", file=out)
         
+        # Whether the command writes a timings file (see build_command)
+        timed = (ext in ['.java', '.c', '.cpp', '.cs'] or bool(benchmark)
+                 or profiling is not None or time_runs)
         try:
-            # Determine the command to run based on language
-            if ext == '.py':
-                cmd = f"python {main_file}"
-            elif ext == '.js':
-                cmd = f"node {main_file}"
-            elif ext == '.rb':
-                cmd = f"ruby {main_file}"
-            elif ext == '.java':
-                cmd = f"sh -c 'javac {main_file} && java Solution'"
-            elif ext == '.c':
-                cmd = f"sh -c 'gcc -o main {main_file} -lm && ./main'"
-            elif ext == '.cpp':
-                cmd = f"sh -c 'g++ -o main {main_file} && ./main'"
-            elif ext == '.php':
-                cmd = f"php {main_file}"
-            elif ext == '.cs':
-                cmd = f"sh -c 'mcs {main_file} -out:Program.exe && mono Program.exe'"
-            else:
-                cmd = f"echo 'Unsupported language: {ext}'"
+            cmd = build_command(ext, main_file, profile, std, benchmark,
+                                profiling is not None, timed=time_runs)
+            
+            # Compile in a warm compiler daemon and only run in the sandbox
+            if compilers is not None and compilers.supports(ext):
+                compile_started = time.monotonic()
+                with span('compile', daemon=True):
+                    compiled = compilers.compile(ext, [temp_code_path], temp_dir)
+                if compiled is not None:
+                    compile_ms = int((time.monotonic() - compile_started) * 1000)
+                    if timings is not None:
+                        timings['compile_ms'] = compile_ms
+                    status, diagnostics = compiled
+                    print(diagnostics, end='', file=err)
+                    if status != 0:
+                        return status
+                    run_cmd = compilers.run_command(ext)
+                    if profiling is not None:
+                        run_cmd = profiler.profile_command(ext, None, run_cmd)[1]
+                    if benchmark:
+                        run_cmd = benchmark_command(run_cmd, benchmark['runs'],
+                                                    benchmark.get('warmup', 1))
+                    cmd = timed_command(run_cmd)
+            
+            # Prefer a warm sandbox when available (not for runs with deps,
+            # which need the files installed into the mounted directory)
+            with span('acquire_sandbox') as attrs:
+                container = pool.acquire(ext) if pool is not None and not deps else None
+                attrs['warm'] = container is not None
+                if container is None and copy_files:
+                    container = start_sandbox(client, config['base_image'], SANDBOX_MEM_LIMIT)
+            if container is not None:
+                if benchmark and benchmark.get('cpus'):
+                    container.update(cpuset_cpus=benchmark['cpus'])
+                # Only what the command writes: the program could leave any
+                # other of these files behind to fake its results
+                collect = [TIMINGS_FILE] if timed else []
+                if benchmark:
+                    collect.append(BENCHMARK_FILE)
+                if profiling is not None:
+                    collect.append(profiler.PROFILE_FILES[ext])
+                with span('sandbox_exec'):
+                    exit_code, logs = run_in_sandbox(container, temp_dir, cmd, collect=collect,
+                                                     pool=pool)
+                with span('decode_output'):
+                    print(logs.decode('utf-8'), end='', file=out)
+                return exit_code
             
             # Run container with volume mount
-            # Use read-write for compiled languages, read-only for interpreted
-            volume_mode = 'rw' if ext in ['.java', '.c', '.cpp', '.cs'] else 'ro'
-            container = client.containers.run(
-                config['base_image'],
-                cmd,
-                volumes={temp_dir: {'bind': '/app', 'mode': volume_mode}},
-                working_dir='/app',
-                remove=True,
-                stdout=True,
-                stderr=True,
-                mem_limit="128m",
-                network_disabled=True
-            )
+            # Use read-write for compiled languages, benchmarks, profiles and
+            # timed runs, which write their results next to the sources;
+            # read-only otherwise
+            volume_mode = 'rw' if timed else 'ro'
+            with span('container_run'):
+                container = client.containers.run(
+                    config['base_image'],
+                    cmd,
+                    volumes={temp_dir: {'bind': '/app', 'mode': volume_mode}},
+                    working_dir='/app',
+                    remove=True,
+                    stdout=True,
+                    stderr=True,
+                    mem_limit=SANDBOX_MEM_LIMIT,
+                    network_disabled=True,
+                    cpuset_cpus=benchmark.get('cpus') if benchmark else None,
+                    labels=labels('run')
+                )
             
             # Print output
-            output = container.decode('utf-8')
-            print(output, end='')
+            with span('decode_output'):
+                print(container.decode('utf-8'), end='', file=out)
             
             return 0
             
         except docker.errors.ContainerError as e:
-            print(f"Container error: {e.stderr.decode('utf-8')}", file=sys.stderr)
+            print(f"Container error: {e.stderr.decode('utf-8')}", file=err)
             return e.exit_status
         except docker.errors.ImageNotFound:
-            print("Docker image not found", file=sys.stderr)
-            return 1
-        except docker.errors.APIError as e:
-            print(f"Docker API error: {e}", file=sys.stderr)
+            print("Docker image not found", file=err)
             return 1
         except Exception as e:
-            print(f"Unexpected error: {e}", file=sys.stderr)
+            if is_node_failure(e):
+                # The caller drains the node (see nodes.py)
+                raise
+            if isinstance(e, docker.errors.APIError):
+                print(f"Docker API error: {e}", file=err)
+            else:
+                print(f"Unexpected error: {e}", file=err)
             return 1
+        finally:
+            if timings is not None and timed:
+                timings.update(read_timings(temp_dir))
+            if benchmark:
+                benchmark['results'] = read_results(temp_dir)
+            if profiling is not None:
+                profiling['results'] = profiler.read_profile(ext, temp_dir)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Run code in Docker containers")
     parser.add_argument('source', help='Source file to execute')
     parser.add_argument('--deps', nargs='*', default=[], help='Dependencies to install')
+    parser.add_argument('--profile', choices=sorted(COMPILE_PROFILES),
+                        help=f'C/C++ compile profile (default: {DEFAULT_PROFILE})')
+    parser.add_argument('--std', help='C/C++ language standard, e.g. c11 or c++20')
+    parser.add_argument('--timings', action='store_true',
+                        help='Report compile and run time on stderr')
+    parser.add_argument('--benchmark', type=int, metavar='RUNS',
+                        help='Repeat the run and report statistics on stderr')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='Warm-up runs before a benchmark (default: 1)')
+    parser.add_argument('--cpus', help='CPUs to pin a benchmark to, e.g. 0 or 2,3')
+    parser.add_argument('--profiling', action='store_true',
+                        help='Run under a profiler and report the summary on stderr')
     args = parser.parse_args()
     
     if not os.path.exists(args.source):
@@ -226,7 +495,21 @@ def main():
         sys.exit(1)
     
     try:
-        rc = run_code_in_docker(args.source, args.deps)
+        timings = {} if args.timings else None
+        benchmark = None
+        if args.benchmark:
+            benchmark = {'runs': args.benchmark, 'warmup': args.warmup, 'cpus': args.cpus}
+        profiling = {} if args.profiling else None
+        rc = run_code_in_docker(args.source, args.deps, profile=args.profile,
+                                std=args.std, timings=timings, benchmark=benchmark,
+                                profiling=profiling)
+        if timings is not None:
+            for key, value in timings.items():
+                print(f"{key}: {value}", file=sys.stderr)
+        if benchmark is not None:
+            print(json.dumps(benchmark['results'], indent=2), file=sys.stderr)
+        if profiling is not None:
+            print(json.dumps(profiling.get('results'), indent=2), file=sys.stderr)
         sys.exit(rc)
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Persistent interactive sessions.
+
+A session keeps one sandbox alive between runs for a single user and
+language. Its workspace is a Docker volume mounted at /app, so installed
+dependencies and build outputs survive between runs. Each run only sends
+the files whose content changed, and compiled languages are rebuilt only
+when their sources or compile options changed. Sessions expire after an
+idle timeout and are capped per executor node, evicting the least recently
+used session when a node is full.
+"""
+
+import io
+import os
+import time
+import uuid
+import hashlib
+import logging
+import tarfile
+import tempfile
+import threading
+from collections import OrderedDict
+
+from pool import IDLE_COMMAND, TEMP_PREFIX, copy_from_container, labels
+from run_code import (LANGUAGE_CONFIGS, SANDBOX_MEM_LIMIT, TIMINGS_FILE,
+                      command_steps, compiler_flags, ensure_base_image_exists,
+                      install_dependencies, read_timings, timed_command)
+from tracing import span
+
+logger = logging.getLogger('code-runner.sessions')
+
+MAX_SESSIONS_PER_NODE = int(os.environ.get('CODE_RUNNER_MAX_SESSIONS', '16'))
+IDLE_TIMEOUT = float(os.environ.get('CODE_RUNNER_SESSION_IDLE_TIMEOUT', '900'))
+REAP_INTERVAL = 30.0
+
+# Where dependencies are installed inside the session workspace
+PYTHON_DEPS_DIR = '/app/.deps'
+
+
+class SessionNotFound(LookupError):
+    """Raised for unknown, closed or reclaimed sessions."""
+
+
+def validate_name(name):
+    """Reject file names that would escape the workspace."""
+    normalized = os.path.normpath(name)
+    if (not name or os.path.isabs(name) or normalized.startswith('..')
+            or normalized == '.' or normalized == TIMINGS_FILE):
+        raise ValueError(f"Invalid file name: {name}")
+    return normalized
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def make_files_archive(files):
+    """Pack ``{name: content}`` into an in-memory tar archive."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for name, content in files.items():
+            data = content.encode('utf-8')
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def install_command(ext, deps):
+    """Command installing ``deps`` into the workspace, or None if unsupported."""
+    # Options are not accepted as dependency names
+    deps = [dep for dep in deps if not dep.startswith('-')]
+    if not deps:
+        return None
+    if ext == '.py':
+        return ['pip', 'install', '--quiet', '--target', PYTHON_DEPS_DIR] + deps
+    if ext == '.js':
+        return ['npm', 'install', '--no-audit', '--no-fund'] + deps
+    return None
+
+
+class Session:
+    """A sandbox kept alive between runs."""
+
+    def __init__(self, ext, node, deps=None):
+        self.id = uuid.uuid4().hex
+        self.ext = ext
+        self.node = node
+        self.deps = deps or []
+        self.config = LANGUAGE_CONFIGS[ext]
+        self.lock = threading.Lock()
+        self.hashes = {}
+        self.build_key = None
+        self.volume = None
+        self.container = None
+        self.runs = 0
+        self.created = time.time()
+        self.last_used = time.monotonic()
+
+    def start(self):
+        client = self.node.client
+        if not ensure_base_image_exists(client, self.ext):
+            raise RuntimeError(f"Failed to ensure base image for {self.ext}")
+        self.volume = client.volumes.create(name=f'code-runner-session-{self.id}',
+                                            labels=labels('session'))
+        mounts = {self.volume.name: {'bind': '/app', 'mode': 'rw'}}
+
+        # Dependencies are installed once, by a container with network access
+        # sharing the workspace volume
+        install = install_command(self.ext, self.deps)
+        if install:
+            with span('install_deps'):
+                install_dependencies(client, self.config['base_image'], install, mounts)
+
+        environment = {'PYTHONPATH': PYTHON_DEPS_DIR} if self.ext == '.py' else {}
+        self.container = client.containers.run(
+            self.config['base_image'],
+            IDLE_COMMAND,
+            detach=True,
+            volumes=mounts,
+            working_dir='/app',
+            environment=environment,
+            mem_limit=SANDBOX_MEM_LIMIT,
+            network_disabled=True,
+            labels=labels('session')
+        )
+
+    def sync(self, files):
+        """Send changed files to the sandbox; ``None`` content deletes a file.
+
+        Returns the names of the files that changed.
+        """
+        files = {validate_name(name): content for name, content in files.items()}
+        changed = {name: content for name, content in files.items()
+                   if content is not None and self.hashes.get(name) != content_hash(content)}
+        deleted = [name for name, content in files.items()
+                   if content is None and name in self.hashes]
+        if changed:
+            self.container.put_archive('/app', make_files_archive(changed))
+            for name, content in changed.items():
+                self.hashes[name] = content_hash(content)
+        if deleted:
+            self.container.exec_run(['rm', '-f', '--'] + deleted, workdir='/app')
+            for name in deleted:
+                del self.hashes[name]
+        return sorted(changed) + sorted(deleted)
+
+    def run(self, files, profile=None, std=None):
+        """Sync ``files`` and run the main file, rebuilding only if needed."""
+        if self.ext in ('.c', '.cpp'):
+            compiler_flags(self.ext, profile, std)
+        self.last_used = time.monotonic()
+        with span('sync_files'):
+            changed = self.sync(files)
+
+        main_file = self.config['main_file']
+        if main_file not in self.hashes:
+            raise ValueError(f"Session has no {main_file}; send it as code first")
+
+        compile_cmd, run_cmd = command_steps(self.ext, main_file, profile, std)
+        rebuilt = False
+        build_key = None
+        if compile_cmd is None:
+            cmd = run_cmd
+        else:
+            build_key = (tuple(sorted(self.hashes.items())), profile, std)
+            rebuilt = build_key != self.build_key
+            cmd = timed_command(run_cmd, compile_cmd if rebuilt else None)
+
+        with span('sandbox_exec', rebuilt=rebuilt):
+            exit_code, output = self.container.exec_run(cmd, workdir='/app')
+        timings = {}
+        if compile_cmd is not None:
+            with tempfile.TemporaryDirectory(prefix=TEMP_PREFIX) as temp_dir:
+                if copy_from_container(self.container, f'/app/{TIMINGS_FILE}', temp_dir):
+                    timings = read_timings(temp_dir)
+            # A failed compile leaves no usable build output
+            if not rebuilt or 'run_ms' in timings:
+                self.build_key = build_key
+            else:
+                self.build_key = None
+        self.runs += 1
+        self.last_used = time.monotonic()
+        return {
+            'output': output.decode('utf-8', errors='replace'),
+            'exit_code': exit_code,
+            'timings': timings,
+            'changed': changed,
+            'rebuilt': rebuilt,
+        }
+
+    def close(self):
+        for resource in (self.container, self.volume):
+            if resource is None:
+                continue
+            try:
+                resource.remove(force=True)
+            except Exception as e:
+                logger.warning("failed to remove %s of session %s: %s",
+                               type(resource).__name__.lower(), self.id, e)
+        self.container = None
+        self.volume = None
+
+    def report(self):
+        return {
+            'id': self.id,
+            'ext': self.ext,
+            'node': self.node.name,
+            'deps': self.deps,
+            'files': sorted(self.hashes),
+            'runs': self.runs,
+            'created': self.created,
+            'idle': time.monotonic() - self.last_used,
+        }
+
+
+class SessionManager:
+    """Create, look up and reclaim sessions (LRU per node, idle expiry)."""
+
+    def __init__(self, nodes, max_per_node=MAX_SESSIONS_PER_NODE, idle_timeout=IDLE_TIMEOUT):
+        self.nodes = nodes
+        self.max_per_node = max_per_node
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def create(self, ext, deps=None):
+        if ext not in LANGUAGE_CONFIGS:
+            raise ValueError(f"Unsupported file extension: {ext}")
+        node = self.nodes.place(ext)
+        with self.lock:
+            on_node = [s for s in self.sessions.values() if s.node is node]
+            evicted = on_node[:max(0, len(on_node) - self.max_per_node + 1)]
+            for session in evicted:
+                del self.sessions[session.id]
+        for session in evicted:
+            logger.info("evicting least recently used session %s", session.id)
+            self._close(session)
+
+        session = Session(ext, node, deps)
+        try:
+            session.start()
+        except Exception:
+            session.close()
+            raise
+        with self.lock:
+            self.sessions[session.id] = session
+        logger.info("created session %s for %s on node %s", session.id, ext, node.name)
+        return session.report()
+
+    def get(self, session_id):
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                raise SessionNotFound(f"Unknown session: {session_id}")
+            self.sessions.move_to_end(session_id)
+            return session
+
+    def run(self, session_id, files, profile=None, std=None):
+        session = self.get(session_id)
+        with session.lock:
+            if session.container is None:
+                raise SessionNotFound(f"Unknown session: {session_id}")
+            return session.run(files, profile, std)
+
+    def close(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            raise SessionNotFound(f"Unknown session: {session_id}")
+        self._close(session)
+
+    def _close(self, session):
+        with session.lock:
+            session.close()
+
+    def reap(self):
+        """Close sessions idle for longer than the idle timeout."""
+        now = time.monotonic()
+        with self.lock:
+            expired = [s for s in self.sessions.values()
+                       if not s.lock.locked() and now - s.last_used > self.idle_timeout]
+            for session in expired:
+                del self.sessions[session.id]
+        for session in expired:
+            logger.info("session %s expired", session.id)
+            self._close(session)
+        return len(expired)
+
+    def report(self):
+        with self.lock:
+            return [session.report() for session in self.sessions.values()]
+
+    def start(self, interval=REAP_INTERVAL):
+        if self._thread is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.reap()
+                except Exception as e:
+                    logger.warning("session reaping failed: %s", e)
+
+        self._thread = threading.Thread(target=loop, name='session-reaper', daemon=True)
+        self._thread.start()
+
+    def close_all(self):
+        self._stop.set()
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            self._close(session)
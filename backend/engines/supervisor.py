@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Sandbox supervisor daemon.
+
+Owns everything that has to be global for a host: the executor nodes with
+their Docker clients, warm pools and compile servers, and the autoscaler.
+The FastAPI workers in ``backend/app.py`` are stateless and submit jobs
+over the local RPC in ``rpc.py``, so they can be scaled across cores while
+sandbox state and limits stay shared.
+
+Usage:
+    python engines/supervisor.py [--socket PATH]
+"""
+
+import io
+import os
+import time
+import base64
+import signal
+import logging
+import argparse
+import tempfile
+from contextlib import contextmanager
+
+import run_code as engine
+from rpc import RpcServer, DEFAULT_SOCKET
+from pool import CACHE_ROOT, TEMP_PREFIX
+from nodes import NodePool
+from autoscaler import Autoscaler
+from sessions import SessionManager
+from benchmark import CpuPinner
+from warmup import Warmup
+from reaper import Reaper
+from tracing import TraceBuffer
+
+logger = logging.getLogger('code-runner.supervisor')
+
+
+class Supervisor:
+    """Execute jobs submitted by the API workers."""
+
+    def __init__(self):
+        self.nodes = NodePool.from_env(engine.LANGUAGE_CONFIGS, engine.SANDBOX_MEM_LIMIT)
+        self.autoscaler = Autoscaler(engine.LANGUAGE_CONFIGS)
+        self.sessions = SessionManager(self.nodes)
+        self.pinner = CpuPinner()
+        self.warmup = Warmup(self.nodes, self.autoscaler, self.run, engine.LANGUAGE_CONFIGS)
+        self.reaper = Reaper(self.nodes, self.live_objects, self.evict_cache)
+        # Request traces of all the API workers (see GET /debug/traces)
+        self.traces = TraceBuffer()
+        self._projects = None
+        self.started = time.time()
+
+    def start(self):
+        self.nodes.start()
+        self.autoscaler.start(apply=self.nodes.apply)
+        self.sessions.start()
+        self.warmup.start()
+        self.reaper.start()
+
+    @property
+    def projects(self):
+        # Imported on first use, like the judge, to keep startup short
+        if self._projects is None:
+            from projects import ProjectStore
+            self._projects = ProjectStore()
+        return self._projects
+
+    def run(self, ext, code, deps=None, profile=None, std=None, benchmark=None,
+            profiling=False):
+        """Run ``code`` for the language with extension ``ext``.
+
+        Returns the combined output, the exit code and the reported timings.
+        ``benchmark`` (``runs``, ``warmup``) repeats the run on a pinned CPU and
+        adds its statistics to the result; ``profiling`` adds a profile summary.
+        """
+        if ext not in engine.LANGUAGE_CONFIGS:
+            raise ValueError(f"Unsupported file extension: {ext}")
+        deps = deps or []
+        output = io.StringIO()
+        timings = {}
+        profile_results = {} if profiling else None
+        with tempfile.TemporaryDirectory(prefix=TEMP_PREFIX) as tmpdir:
+            path = os.path.join(tmpdir, engine.LANGUAGE_CONFIGS[ext]['main_file'])
+            with open(path, 'w') as f:
+                f.write(code)
+            try:
+                with self.autoscaler.admit(ext), \
+                        self.nodes.lease(ext, local=bool(deps)) as node:
+                    logger.debug("running %s on node %s", ext, node.name)
+                    with self.pin(node, benchmark):
+                        exit_code = engine.run_code_in_docker(
+                            path, deps,
+                            client=node.client,
+                            pool=node.pool,
+                            output=output,
+                            compilers=node.compilers,
+                            profile=profile,
+                            std=std,
+                            timings=timings,
+                            copy_files=not node.local,
+                            benchmark=benchmark,
+                            profiling=profile_results
+                        )
+            except Exception as e:
+                exit_code = 1
+                output.write(f"Error: {e}\n")
+        result = {'output': output.getvalue(), 'exit_code': exit_code, 'timings': timings}
+        if benchmark is not None:
+            result['benchmark'] = benchmark.get('results')
+        if profile_results is not None:
+            result['profile'] = profile_results.get('results')
+        return result
+
+    @contextmanager
+    def pin(self, node, benchmark):
+        """Pin a benchmark to the least used CPU of ``node``."""
+        if benchmark is None:
+            yield
+            return
+        with self.pinner.pin(node.name, node.cpuset) as cpus:
+            benchmark['cpus'] = cpus
+            yield
+
+    def judge(self, ext, code, expected_path, mode='token', tolerance=None, profile=None,
+              std=None):
+        """Run ``code`` and judge its output against the file ``expected_path``."""
+        from judge import run_judged
+        if ext not in engine.LANGUAGE_CONFIGS:
+            raise ValueError(f"Unsupported file extension: {ext}")
+        with tempfile.TemporaryDirectory(prefix=TEMP_PREFIX) as tmpdir:
+            path = os.path.join(tmpdir, engine.LANGUAGE_CONFIGS[ext]['main_file'])
+            with open(path, 'w') as f:
+                f.write(code)
+            with self.autoscaler.admit(ext), self.nodes.lease(ext) as node:
+                return run_judged(path, expected_path, node.client, pool=node.pool, mode=mode,
+                                  tolerance=tolerance, profile=profile, std=std)
+
+    def session_run(self, session_id, files=None, code=None, profile=None, std=None):
+        session = self.sessions.get(session_id)
+        files = dict(files or {})
+        if code is not None:
+            files[session.config['main_file']] = code
+        with self.autoscaler.admit(session.ext):
+            return self.sessions.run(session_id, files, profile, std)
+
+    def session_close(self, session_id):
+        self.sessions.close(session_id)
+
+    def project_run(self, ext, project_id=None, files=None, archive=None, archive_name='',
+                    entry=None, profile=None, std=None):
+        """Build and run a multi-file project, reusing its previous build outputs.
+
+        ``files`` is a ``{path: content}`` map and ``archive`` a base64 encoded
+        tar or zip file. Ids are issued here: a new project, with a new id,
+        is started when ``project_id`` is not one of an existing project.
+        """
+        from projects import load_archive, run_project
+        tree = dict(files or {})
+        if archive:
+            tree.update(load_archive(base64.b64decode(archive), archive_name))
+        if not tree:
+            raise ValueError("Project has no files")
+        if not self.projects.issued(project_id):
+            project_id = self.projects.new_id()
+        output = io.StringIO()
+        timings = {}
+        # The build cache is bind mounted, so projects run on local nodes
+        with self.projects.open(project_id) as project, self.autoscaler.admit(ext), \
+                self.nodes.lease(ext, local=True) as node:
+            exit_code, build = run_project(project, ext, tree, node.client, output,
+                                           entry=entry, profile=profile, std=std,
+                                           timings=timings)
+        return {
+            'project_id': project.id,
+            'output': output.getvalue(),
+            'exit_code': exit_code,
+            'timings': timings,
+            'build': build,
+        }
+
+    def project_delete(self, project_id):
+        self.projects.remove(project_id)
+
+    def live_objects(self):
+        """Containers, volumes and paths in use, which the reaper must keep."""
+        live = {'containers': set(), 'volumes': set(), 'paths': {CACHE_ROOT}}
+        for node in self.nodes.nodes:
+            if node.pool is not None:
+                live['containers'].update(node.pool.container_ids())
+            if node.compilers is not None:
+                for daemon in node.compilers.all():
+                    if daemon.container is not None:
+                        live['containers'].add(daemon.container.id)
+                    if daemon.root is not None:
+                        live['paths'].add(daemon.root)
+        with self.sessions.lock:
+            sessions = list(self.sessions.sessions.values())
+        for session in sessions:
+            if session.container is not None:
+                live['containers'].add(session.container.id)
+            if session.volume is not None:
+                live['volumes'].add(session.volume.name)
+        return live
+
+    def evict_cache(self):
+        return self.projects.evict()
+
+    def metrics(self):
+        return {'reaper': self.reaper.report()}
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'uptime': time.time() - self.started,
+            'targets': self.autoscaler.current,
+            'sessions': len(self.sessions.sessions),
+            'ready': self.warmup.ready,
+        }
+
+    def handlers(self):
+        return {
+            'run': self.run,
+            'judge': self.judge,
+            'nodes': self.nodes.report,
+            'status': self.status,
+            'ready': self.warmup.report,
+            'metrics': self.metrics,
+            'trace_add': self.traces.add,
+            'traces': self.traces.list,
+            'trace_get': self.traces.get,
+            'session_create': self.sessions.create,
+            'session_run': self.session_run,
+            'session_close': self.session_close,
+            'sessions': self.sessions.report,
+            'project_run': self.project_run,
+            'project_delete': self.project_delete,
+        }
+
+    def close(self):
+        self.warmup.stop()
+        self.reaper.stop()
+        self.autoscaler.stop()
+        self.sessions.close_all()
+        self.nodes.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sandbox supervisor for the code runner API")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket to listen on')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    supervisor = Supervisor()
+    server = RpcServer(args.socket, supervisor.handlers())
+
+    def shutdown(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    try:
+        supervisor.start()
+        logger.info("supervisor listening on %s", args.socket)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        supervisor.close()
+
+
+if __name__ == '__main__':
+    main()
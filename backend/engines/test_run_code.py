@@ -276,6 +276,1446 @@ class TestErrorHandling(unittest.TestCase):
         self.assertIn('SyntaxError', result.stderr)
 
 
+class FakeCompileService:
+    """コンパイルデーモンの代わりにスプールのジョブに応答するスレッド"""
+    
+    def __init__(self, ready=True, answer=True):
+        import threading
+        self.ready = ready
+        self.answer = answer
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = 0
+    
+    def run(self, image, command, volumes, **kwargs):
+        import threading
+        jobs = os.path.join(next(iter(volumes)), 'jobs')
+        stopped = threading.Event()
+        container = Mock(status='running')
+        container.id = f'compiler-{self.started}'
+        container.remove.side_effect = lambda force: stopped.set()
+        self.started += 1
+        threading.Thread(target=self.serve, args=(jobs, stopped), daemon=True).start()
+        return container
+    
+    def serve(self, jobs, stopped):
+        if not self.ready:
+            return
+        open(os.path.join(jobs, 'ready'), 'w').close()
+        handled = set()
+        while not stopped.wait(0.005):
+            try:
+                for name in os.listdir(jobs):
+                    job = os.path.join(jobs, name)
+                    if name in handled or not os.path.exists(os.path.join(job, 'request')):
+                        continue
+                    handled.add(name)
+                    if not self.answer:
+                        continue
+                    self.gate.wait()
+                    os.makedirs(os.path.join(job, 'out'))
+                    with open(os.path.join(job, 'out', 'Solution.class'), 'wb') as f:
+                        f.write(b'\xca\xfe\xba\xbe')
+                    with open(os.path.join(job, 'diagnostics'), 'w') as f:
+                        f.write('Note: compiled\n')
+                    with open(os.path.join(job, 'status.tmp'), 'w') as f:
+                        f.write('0')
+                    os.replace(os.path.join(job, 'status.tmp'), os.path.join(job, 'status'))
+            except OSError:
+                # The job or the spool was removed meanwhile
+                pass
+
+
+class TestCompileServer(unittest.TestCase):
+    """ウォームコンパイルデーモンのテスト"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.temp_dir.name, 'Solution.java')
+        with open(self.source, 'w') as f:
+            f.write('public class Solution {}\n')
+        self.dest = os.path.join(self.temp_dir.name, 'dest')
+        os.makedirs(self.dest)
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def make_servers(self, service, size=2):
+        from compile_server import CompileServers
+        client = Mock()
+        client.containers.run.side_effect = service.run
+        servers = CompileServers(client, {'.java': {'base_image': 'code-runner-java-base'}},
+                                 size=size)
+        self.addCleanup(servers.close)
+        return servers, client
+    
+    def wait_until(self, condition, timeout=5.0):
+        """バックグラウンドのデーモン起動を待つ"""
+        import time
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+    
+    def warm_up(self, servers):
+        """最初の要求はデーモンの起動を待たずにサンドボックスへ戻す"""
+        self.assertIsNone(servers.compile('.java', [self.source], self.dest))
+        self.wait_until(lambda: servers.idle['.java'])
+    
+    def test_compile_through_daemon(self):
+        """デーモンでコンパイルし成果物をコピーする"""
+        servers, client = self.make_servers(FakeCompileService())
+        self.warm_up(servers)
+        self.assertEqual(servers.compile('.java', [self.source], self.dest),
+                         (0, 'Note: compiled\n'))
+        self.assertTrue(os.path.exists(os.path.join(self.dest, 'Solution.class')))
+        # 二回目は同じデーモンを使う
+        self.assertEqual(servers.compile('.java', [self.source], self.dest)[0], 0)
+        self.assertEqual(client.containers.run.call_count, 1)
+        self.assertIsNone(servers.compile('.cpp', [self.source], self.dest))
+    
+    def test_first_request_does_not_wait_for_start(self):
+        """起動中のデーモンを待たずにすぐ戻る"""
+        import time
+        servers, client = self.make_servers(FakeCompileService(ready=False))
+        with patch('compile_server.READY_TIMEOUT', 0.5):
+            started = time.monotonic()
+            self.assertIsNone(servers.compile('.java', [self.source], self.dest))
+            self.assertIsNone(servers.compile('.java', [self.source], self.dest))
+            self.assertLess(time.monotonic() - started, 0.5)
+            # 起動中は二つ目のデーモンを起動しない
+            self.wait_until(lambda: client.containers.run.called)
+            self.assertEqual(len(servers.all()), 1)
+            self.wait_until(lambda: not servers.all())
+    
+    def test_expired_daemon_is_recycled(self):
+        """ジョブ数の上限に達したデーモンは作り直す"""
+        servers, client = self.make_servers(FakeCompileService())
+        self.warm_up(servers)
+        with patch('compile_server.MAX_JOBS', 1):
+            servers.compile('.java', [self.source], self.dest)
+            first = servers.all()[0]
+            container = first.container
+            self.warm_up(servers)
+            self.assertEqual(servers.compile('.java', [self.source], self.dest)[0], 0)
+        self.assertEqual(client.containers.run.call_count, 2)
+        container.remove.assert_called_once_with(force=True)
+        self.assertNotIn(first, servers.all())
+    
+    def test_timeout_replaces_only_that_daemon(self):
+        """ジョブのタイムアウトはサンドボックスに戻すがデーモンを止めたままにしない"""
+        service = FakeCompileService(answer=False)
+        servers, client = self.make_servers(service)
+        self.warm_up(servers)
+        with patch('compile_server.COMPILE_TIMEOUT', 0.1):
+            self.assertIsNone(servers.compile('.java', [self.source], self.dest))
+        self.assertEqual(servers.retry_at, {})
+        self.assertEqual(servers.all(), [])
+        service.answer = True
+        self.warm_up(servers)
+        self.assertEqual(servers.compile('.java', [self.source], self.dest)[0], 0)
+        self.assertEqual(client.containers.run.call_count, 2)
+    
+    def test_start_failure_falls_back_for_a_while(self):
+        """起動に失敗したらしばらくサンドボックスでコンパイルする"""
+        servers, client = self.make_servers(FakeCompileService(ready=False))
+        with patch('compile_server.READY_TIMEOUT', 0.1):
+            self.assertIsNone(servers.compile('.java', [self.source], self.dest))
+            self.wait_until(lambda: '.java' in servers.retry_at and not servers.all())
+        self.assertIsNone(servers.compile('.java', [self.source], self.dest))
+        self.assertEqual(client.containers.run.call_count, 1)
+    
+    def test_busy_daemons_fall_back_to_sandbox(self):
+        """すべてのデーモンが使用中なら待たずにサンドボックスへ戻す"""
+        import threading
+        service = FakeCompileService()
+        service.gate.clear()
+        servers, _ = self.make_servers(service, size=1)
+        self.warm_up(servers)
+        results = []
+        worker = threading.Thread(target=lambda: results.append(
+            servers.compile('.java', [self.source], self.dest)))
+        worker.start()
+        try:
+            while worker.is_alive() and (not servers.all() or servers.all()[0].jobs == 0):
+                worker.join(0.01)
+            self.assertIsNone(servers.compile('.java', [self.source], self.dest))
+        finally:
+            service.gate.set()
+            worker.join()
+        self.assertEqual(results[0][0], 0)
+
+
+class TestAutoscaler(unittest.TestCase):
+    """需要に応じた言語ごとのキャパシティ制御のテスト"""
+    
+    def setUp(self):
+        from autoscaler import Autoscaler
+        self.now = 1000.0
+        self.scaler = Autoscaler(['.py', '.js', '.cs'], memory_budget_mb=2048,
+                                 window=60, idle_timeout=120,
+                                 clock=lambda: self.now)
+    
+    def simulate(self, lang, count, duration):
+        """一定間隔でリクエストを到着させる"""
+        for _ in range(count):
+            self.scaler.record_arrival(lang)
+            self.scaler.record_completion(lang, duration)
+            self.now += 0.5
+    
+    def test_idle_language_scales_to_zero(self):
+        """リクエストのない言語のウォーム数は0になる"""
+        self.simulate('.py', 40, 4.0)
+        targets = self.scaler.rebalance()
+        self.assertEqual(targets['.cs'], {'concurrency': self.scaler.floor, 'warm': 0})
+        self.assertGreater(targets['.py']['warm'], 0)
+        self.assertGreater(targets['.py']['concurrency'], targets['.js']['concurrency'])
+    
+    def test_targets_fit_memory_budget(self):
+        """ターゲットの合計がメモリ予算に収まる"""
+        self.simulate('.py', 100, 10.0)
+        self.simulate('.js', 100, 10.0)
+        targets = self.scaler.rebalance()
+        total = sum(t['concurrency'] + t['warm'] for t in targets.values())
+        self.assertLessEqual(total, self.scaler.slots)
+    
+    def test_language_becomes_idle_after_timeout(self):
+        """アイドルタイムアウト後はウォーム数が0に戻る"""
+        self.simulate('.js', 20, 1.0)
+        self.assertGreater(self.scaler.rebalance()['.js']['warm'], 0)
+        self.now += 300
+        self.assertEqual(self.scaler.rebalance()['.js']['warm'], 0)
+    
+    def test_idle_languages_keep_headroom(self):
+        """アイドルな言語も最初のバーストを並列に処理できる"""
+        from autoscaler import MIN_CONCURRENCY
+        self.assertEqual(self.scaler.floor, MIN_CONCURRENCY)
+        self.assertGreater(self.scaler.limiters['.cs'].limit, 1)
+        self.assertEqual(self.scaler.rebalance()['.cs']['concurrency'], MIN_CONCURRENCY)
+    
+    def test_floor_clamped_to_memory_budget(self):
+        """最低並列数はメモリ予算に収まるよう制限される"""
+        from autoscaler import Autoscaler
+        with self.assertLogs('code-runner.autoscaler', level='WARNING'):
+            scaler = Autoscaler(['.py', '.js', '.cs'], memory_budget_mb=512)
+        self.assertEqual(scaler.floor, 1)
+        with self.assertLogs('code-runner.autoscaler', level='WARNING'):
+            scaler = Autoscaler(['.py', '.js', '.cs'], memory_budget_mb=256)
+        self.assertEqual(scaler.floor, 1)
+        self.assertEqual(scaler.slots, 2)
+
+
+class TestCompileProfiles(unittest.TestCase):
+    """C/C++のコンパイルプロファイルのテスト"""
+    
+    def test_profile_and_standard_flags(self):
+        """プロファイルと-std=がフラグに反映される"""
+        from run_code import compiler_flags
+        self.assertIn('-O0', compiler_flags('.c').split())
+        self.assertIn('-std=gnu17', compiler_flags('.c').split())
+        flags = compiler_flags('.cpp', 'fast-run', 'c++20').split()
+        self.assertIn('-O2', flags)
+        self.assertIn('-std=c++20', flags)
+    
+    def test_invalid_profile_or_standard(self):
+        """不明なプロファイルや規格はエラーになる"""
+        from run_code import compiler_flags
+        with self.assertRaises(ValueError):
+            compiler_flags('.cpp', 'turbo')
+        with self.assertRaises(ValueError):
+            compiler_flags('.c', None, 'c++17')
+    
+    def test_read_timings(self):
+        """計測ファイルからコンパイル時間と実行時間を読み取る"""
+        from run_code import read_timings, TIMINGS_FILE
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.assertEqual(read_timings(temp_dir), {})
+            with open(os.path.join(temp_dir, TIMINGS_FILE), 'w') as f:
+                f.write("compile_ms=412\nrun_ms=7\n")
+            self.assertEqual(read_timings(temp_dir), {'compile_ms': 412, 'run_ms': 7})
+
+    def test_interpreted_runs_timed_on_request(self):
+        """インタプリタ言語も要求されたときは実行時間を計測する"""
+        import shlex
+        from run_code import build_command, read_timings
+        self.assertEqual(build_command('.py', 'main.py'), 'python main.py')
+        cmd = build_command('.py', 'main.py', timed=True)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, 'main.py'), 'w') as f:
+                f.write("import sys\nsys.exit(3)\n")
+            result = subprocess.run(shlex.split(cmd.replace('python ', f'{sys.executable} ')),
+                                    cwd=temp_dir)
+            self.assertEqual(result.returncode, 3)
+            self.assertEqual(list(read_timings(temp_dir)), ['run_ms'])
+
+    def test_untrusted_timings_are_ignored(self):
+        """明示されない限りインタプリタ言語は読み取り専用で実行し計測ファイルを読まない"""
+        from run_code import run_code_in_docker
+        runs = []
+
+        def fake_run(image, cmd, volumes, **kwargs):
+            runs.append((cmd, [bind['mode'] for bind in volumes.values()]))
+            # プログラムが計測ファイルを偽造する
+            with open(os.path.join(next(iter(volumes)), '.timings'), 'w') as f:
+                f.write("run_ms=1\n")
+            return b''
+
+        client = Mock()
+        client.containers.run.side_effect = fake_run
+        with tempfile.NamedTemporaryFile('w', suffix='.py') as source:
+            timings = {}
+            run_code_in_docker(source.name, client=client, output=Mock(), timings=timings)
+            self.assertEqual(timings, {})
+            run_code_in_docker(source.name, client=client, output=Mock(), timings=timings,
+                               time_runs=True)
+            self.assertEqual(timings, {'run_ms': 1})
+        self.assertEqual(runs[0], ('python main.py', ['ro']))
+        self.assertTrue(runs[1][0].startswith('sh -c'))
+        self.assertEqual(runs[1][1], ['rw'])
+
+
+def mock_client(images=(), cpus=4):
+    """ベースイメージとCPU数を報告するダミーのDockerクライアントを作成"""
+    client = Mock()
+    client.info.return_value = {'NCPU': cpus, 'MemTotal': 1 << 30, 'ContainersRunning': 0}
+    client.images.list.side_effect = lambda name: [name] if name in images else []
+    return client
+
+
+def mock_node(name='default', local=True, **kwargs):
+    """ダミーのDockerクライアントを持つ実行ノードのモックを作成"""
+    node = Mock(drained=False, local=local)
+    node.name = name
+    node.client = mock_client(**kwargs)
+    return node
+
+
+class TestNodePlacement(unittest.TestCase):
+    """複数のDockerホストへの配置のテスト"""
+    
+    def make_node(self, url, images=(), cpus=4):
+        """ダミーのDockerクライアントを持つノードを作成"""
+        from nodes import ExecutorNode
+        from run_code import LANGUAGE_CONFIGS
+        node = ExecutorNode(url, LANGUAGE_CONFIGS, '128m', client=mock_client(images, cpus))
+        node.check()
+        return node
+    
+    def test_affinity_prefers_node_with_image(self):
+        """ベースイメージを持つノードが優先される"""
+        from nodes import NodePool
+        plain = self.make_node('tcp://a:2375')
+        warm = self.make_node('tcp://b:2375', images={'code-runner-python-base'})
+        self.assertIs(NodePool([plain, warm]).place('.py'), warm)
+        self.assertIs(NodePool([plain, warm], strategy='least-loaded').place('.py'), plain)
+    
+    def test_overloaded_node_loses_affinity(self):
+        """過負荷のノードよりも空いているノードが選ばれる"""
+        from nodes import NodePool
+        plain = self.make_node('tcp://a:2375')
+        warm = self.make_node('tcp://b:2375', images={'code-runner-python-base'}, cpus=1)
+        warm.active = 1
+        self.assertIs(NodePool([plain, warm]).place('.py'), plain)
+    
+    def test_failed_node_is_drained(self):
+        """ヘルスチェックに連続して失敗したノードは除外され、復帰後に戻る"""
+        from nodes import NodePool, MAX_FAILURES
+        good = self.make_node('unix:///var/run/docker.sock')
+        bad = self.make_node('tcp://b:2375')
+        bad.client.ping.side_effect = ConnectionError('down')
+        for _ in range(MAX_FAILURES):
+            bad.check()
+        self.assertTrue(bad.drained)
+        pool = NodePool([bad, good])
+        self.assertIs(pool.place('.py'), good)
+        bad.client.ping.side_effect = None
+        bad.check()
+        self.assertFalse(bad.drained)
+    
+    def test_local_only_placement(self):
+        """依存関係のある実行はローカルノードにのみ配置される"""
+        from nodes import NodePool
+        remote = self.make_node('tcp://a:2375', images={'code-runner-js-base'})
+        local = self.make_node('unix:///var/run/docker.sock')
+        self.assertIs(NodePool([remote, local]).place('.js', local=True), local)
+        self.assertTrue(local.local)
+        self.assertFalse(remote.local)
+
+    def test_node_failing_runs_is_drained(self):
+        """実行中にDockerホストへ接続できなくなったノードは除外される"""
+        import docker
+        import requests
+        from nodes import NodePool, MAX_FAILURES
+        from supervisor import Supervisor
+        node = self.make_node('unix:///var/run/docker.sock')
+        node.client.containers.run.side_effect = requests.exceptions.ConnectionError('down')
+        with patch('supervisor.NodePool.from_env', return_value=NodePool([node])):
+            supervisor = Supervisor()
+        for _ in range(MAX_FAILURES):
+            result = supervisor.run('.py', "print(1)")
+            self.assertEqual(result['exit_code'], 1)
+            self.assertIn('down', result['output'])
+        self.assertTrue(node.drained)
+        # 実行エラーはノードの障害として数えない
+        node.check()
+        node.client.containers.run.side_effect = docker.errors.ContainerError(
+            'c', 1, 'python main.py', 'code-runner-python-base', b'Traceback')
+        supervisor.run('.py', "raise SystemExit(1)")
+        self.assertEqual(node.failures, 0)
+
+
+class TestSupervisorRpc(unittest.TestCase):
+    """APIワーカーとスーパーバイザー間のRPCのテスト"""
+    
+    def setUp(self):
+        import threading
+        from rpc import RpcServer
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.temp_dir.name, 'supervisor.sock')
+        
+        def traced():
+            from tracing import span
+            with span('engine', ext='.py'):
+                return 'ok'
+        
+        handlers = {
+            'echo': lambda **params: params,
+            'fail': lambda: 1 / 0,
+            'traced': traced,
+        }
+        self.server = RpcServer(self.socket_path, handlers)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+    
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+    
+    def test_call_round_trip(self):
+        """パラメータがそのまま往復する"""
+        from rpc import call
+        params = {'ext': '.py', 'code': "print('こんにちは')\n" * 1000, 'deps': ['pandas']}
+        self.assertEqual(call('echo', socket_path=self.socket_path, **params), params)
+    
+    def test_errors_are_reported(self):
+        """ハンドラーの例外と不明なメソッドはRpcErrorになる"""
+        from rpc import call, RpcError
+        with self.assertRaises(RpcError):
+            call('fail', socket_path=self.socket_path)
+        with self.assertRaises(RpcError):
+            call('missing', socket_path=self.socket_path)
+    
+    def test_supervisor_spans_are_merged(self):
+        """スーパーバイザー側のスパンが呼び出し側のトレースに統合される"""
+        from rpc import call
+        from tracing import start_trace
+        with start_trace('request', buffer=None) as trace:
+            self.assertEqual(call('traced', socket_path=self.socket_path), 'ok')
+        names = [(entry['name'], entry['depth']) for entry in trace.to_dict()['spans']]
+        self.assertEqual(names, [('rpc.traced', 0), ('engine', 1)])
+        # トレースしていない呼び出しにはスパンを付けない
+        self.assertEqual(call('traced', socket_path=self.socket_path), 'ok')
+    
+    def test_second_server_is_refused(self):
+        """同じソケットで二つ目のスーパーバイザーは起動できない"""
+        from rpc import RpcServer
+        with self.assertRaises(RuntimeError):
+            RpcServer(self.socket_path, {})
+
+
+class TestSessions(unittest.TestCase):
+    """永続セッションのテスト（Dockerクライアントはモック）"""
+    
+    def make_node(self, name='default'):
+        """計測ファイルを返すダミーコンテナを持つノードを作成"""
+        import io
+        import tarfile
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w') as tar:
+            data = b"compile_ms=100\nrun_ms=5\n"
+            info = tarfile.TarInfo('.timings')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        container = Mock()
+        container.exec_run.return_value = (0, b'ok\n')
+        container.get_archive.side_effect = lambda path: ([buffer.getvalue()], {})
+        node = mock_node(name)
+        node.client.containers.run.return_value = container
+        return node, container
+    
+    def make_manager(self, node, **kwargs):
+        from sessions import SessionManager
+        nodes = Mock()
+        nodes.place.return_value = node
+        return SessionManager(nodes, **kwargs)
+    
+    def test_only_changed_files_are_sent(self):
+        """変更されたファイルだけがコンテナに送られる"""
+        node, container = self.make_node()
+        manager = self.make_manager(node)
+        session_id = manager.create('.py')['id']
+        result = manager.run(session_id, {'main.py': 'print(1)', 'util.py': 'X = 1'})
+        self.assertEqual(result['changed'], ['main.py', 'util.py'])
+        result = manager.run(session_id, {'main.py': 'print(1)', 'util.py': 'X = 2'})
+        self.assertEqual(result['changed'], ['util.py'])
+        self.assertEqual(container.put_archive.call_count, 2)
+        result = manager.run(session_id, {'main.py': 'print(1)'})
+        self.assertEqual(result['changed'], [])
+        self.assertEqual(container.put_archive.call_count, 2)
+    
+    def test_rebuild_only_when_sources_change(self):
+        """ソースが変わらなければ再コンパイルしない"""
+        node, container = self.make_node()
+        manager = self.make_manager(node)
+        session_id = manager.create('.c')['id']
+        self.assertTrue(manager.run(session_id, {'main.c': 'int main(){}'})['rebuilt'])
+        self.assertFalse(manager.run(session_id, {'main.c': 'int main(){}'})['rebuilt'])
+        self.assertTrue(manager.run(session_id, {}, profile='fast-run')['rebuilt'])
+        self.assertTrue(manager.run(session_id, {'main.c': 'int main(){return 0;}'},
+                                    profile='fast-run')['rebuilt'])
+    
+    def test_lru_eviction_per_node(self):
+        """ノードの上限を超えると最も古いセッションが回収される"""
+        from sessions import SessionNotFound
+        node, container = self.make_node()
+        manager = self.make_manager(node, max_per_node=2)
+        first = manager.create('.py')['id']
+        second = manager.create('.py')['id']
+        manager.run(first, {'main.py': 'print(1)'})
+        third = manager.create('.py')['id']
+        self.assertEqual({s['id'] for s in manager.report()}, {first, third})
+        with self.assertRaises(SessionNotFound):
+            manager.run(second, {})
+    
+    def test_idle_sessions_expire(self):
+        """アイドル時間を超えたセッションは回収される"""
+        node, container = self.make_node()
+        manager = self.make_manager(node, idle_timeout=0)
+        manager.create('.js')
+        self.assertEqual(manager.reap(), 1)
+        self.assertEqual(manager.report(), [])
+    
+    def test_dependency_install_is_limited(self):
+        """依存関係のインストールはメモリ制限とタイムアウト付きで実行される"""
+        import requests
+        from pool import labels
+        node, container = self.make_node()
+        install = Mock()
+        install.wait.return_value = {'StatusCode': 0}
+        node.client.containers.run.side_effect = [install, container]
+        manager = self.make_manager(node)
+        manager.create('.py', deps=['requests'])
+        image, command = node.client.containers.run.call_args_list[0][0]
+        kwargs = node.client.containers.run.call_args_list[0][1]
+        self.assertEqual(command[:2], ['pip', 'install'])
+        self.assertEqual(kwargs['mem_limit'], '128m')
+        self.assertEqual(kwargs['labels'], labels('install'))
+        install.remove.assert_called_once_with(force=True)
+        
+        from run_code import install_dependencies
+        install.wait.side_effect = requests.exceptions.ReadTimeout()
+        node.client.containers.run.side_effect = None
+        node.client.containers.run.return_value = install
+        with self.assertRaises(TimeoutError):
+            install_dependencies(node.client, image, command, {}, timeout=1)
+        install.kill.assert_called_once_with()
+    
+    def test_invalid_file_names(self):
+        """ワークスペース外を指すファイル名は拒否される"""
+        from sessions import validate_name
+        for name in ['../etc/passwd', '/etc/passwd', '', '.timings']:
+            with self.assertRaises(ValueError):
+                validate_name(name)
+        self.assertEqual(validate_name('pkg/mod.py'), 'pkg/mod.py')
+
+
+class TestProjects(unittest.TestCase):
+    """複数ファイルのプロジェクトと差分ビルドのテスト"""
+    
+    def hashes(self, files):
+        from projects import file_hash
+        return {name: file_hash(content.encode()) for name, content in files.items()}
+    
+    def test_only_affected_units_recompile(self):
+        """変更されたソースとそれをインクルードするユニットだけ再コンパイルする"""
+        from projects import plan_c_build
+        files = {'main.c': 'a', 'util.c': 'b', 'util.h': 'c', 'io.c': 'd'}
+        hashes = self.hashes(files)
+        compile_units, remove, link = plan_c_build('.c', hashes, {}, '-O0')
+        self.assertEqual(compile_units, ['io.c', 'main.c', 'util.c'])
+        self.assertTrue(link)
+        
+        units = {
+            'main.c': {'main.c': hashes['main.c'], 'util.h': hashes['util.h']},
+            'util.c': {'util.c': hashes['util.c'], 'util.h': hashes['util.h']},
+            'io.c': {'io.c': hashes['io.c']},
+        }
+        manifest = {'files': hashes, 'flags': '-O0', 'units': units, 'linked': True}
+        self.assertEqual(plan_c_build('.c', hashes, manifest, '-O0'), ([], [], False))
+        
+        changed = self.hashes(dict(files, **{'util.h': 'changed'}))
+        self.assertEqual(plan_c_build('.c', changed, manifest, '-O0'),
+                         (['main.c', 'util.c'], [], True))
+        self.assertEqual(plan_c_build('.c', hashes, manifest, '-O2')[0],
+                         ['io.c', 'main.c', 'util.c'])
+        
+        del hashes['io.c']
+        self.assertEqual(plan_c_build('.c', hashes, manifest, '-O0'), ([], ['io.c'], True))
+    
+    def test_java_recompiles_dependents(self):
+        """変更されたクラスを参照するソースも再コンパイルする"""
+        from projects import plan_java_build
+        files = {
+            'Solution.java': 'class Solution { Util u; }',
+            'Util.java': 'class Util {}',
+            'Other.java': 'class Other {}',
+        }
+        hashes = self.hashes(files)
+        self.assertEqual(plan_java_build(hashes, {}, files),
+                         (['Other.java', 'Solution.java', 'Util.java'], True))
+        manifest = {'files': hashes, 'ok': True}
+        self.assertEqual(plan_java_build(hashes, manifest, files), ([], False))
+        
+        files['Util.java'] = 'class Util { int x; }'
+        self.assertEqual(plan_java_build(self.hashes(files), manifest, files),
+                         (['Solution.java', 'Util.java'], False))
+        
+        del files['Other.java']
+        self.assertTrue(plan_java_build(self.hashes(files), manifest, files)[1])
+    
+    def test_depfile_keeps_project_files(self):
+        """依存ファイルからプロジェクト内のヘッダーだけを取り出す"""
+        from projects import parse_depfile
+        text = "/app/obj/lib/a.o: lib/a.c /usr/include/stdio.h \\\n lib/a.h util.h\n"
+        self.assertEqual(parse_depfile(text, {'lib/a.c', 'lib/a.h', 'util.h', 'main.c'}),
+                         ['lib/a.c', 'lib/a.h', 'util.h'])
+    
+    def test_archives(self):
+        """tarとzipのアーカイブからファイルツリーを読み込む"""
+        import io
+        import tarfile
+        import zipfile
+        from projects import load_archive
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('src/main.py', 'print(1)')
+        self.assertEqual(load_archive(buffer.getvalue(), 'p.zip'), {'src/main.py': b'print(1)'})
+        
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+            info = tarfile.TarInfo('main.py')
+            info.size = 8
+            archive.addfile(info, io.BytesIO(b'print(2)'))
+        self.assertEqual(load_archive(buffer.getvalue()), {'main.py': b'print(2)'})
+    
+    def test_archive_limits_checked_before_reading(self):
+        """展開前にファイル数とサイズの上限を確認する"""
+        import io
+        import tarfile
+        import zipfile
+        from projects import load_archive, MAX_PROJECT_BYTES
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('a.txt', b'0' * (MAX_PROJECT_BYTES // 2 + 1))
+            archive.writestr('b.txt', b'0' * (MAX_PROJECT_BYTES // 2 + 1))
+        self.assertLess(len(buffer.getvalue()), 1024 * 1024)
+        original = zipfile.ZipFile.open
+        with patch.object(zipfile.ZipFile, 'open', autospec=True,
+                          side_effect=original) as opened:
+            with self.assertRaises(ValueError):
+                load_archive(buffer.getvalue(), 'bomb.zip')
+        # 2つ目のファイルは展開されない
+        self.assertEqual(opened.call_count, 1)
+        
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+            for i in range(5):
+                info = tarfile.TarInfo(f'f{i}.py')
+                archive.addfile(info, io.BytesIO(b''))
+        with patch('projects.MAX_PROJECT_FILES', 3):
+            with self.assertRaises(ValueError):
+                load_archive(buffer.getvalue())
+    
+    def test_incremental_project_runs(self):
+        """2回目の実行では変更されたユニットだけをビルドする"""
+        import io
+        from projects import Project, run_project
+        
+        commands = []
+        
+        def fake_run(image, command, volumes, **kwargs):
+            mounts = {bind['bind']: (path, bind['mode']) for path, bind in volumes.items()}
+            self.assertEqual(mounts['/app/src'][1], 'ro')
+            commands.append(command)
+            if command != ['sh', '/app/build.sh']:
+                # プログラムはビルド成果物に書き込めない
+                self.assertEqual(mounts['/app/obj'][1], 'ro')
+                return b'ok\n'
+            # ビルドスクリプトの代わりに計測ファイルと依存ファイルを書く
+            self.assertEqual(mounts['/app/build.sh'][1], 'ro')
+            obj_dir = mounts['/app/obj'][0]
+            with open(os.path.join(obj_dir, '.timings'), 'w') as f:
+                f.write("compile_ms=10\nrun_ms=1\n")
+            for unit in ('main.c', 'util.c'):
+                with open(os.path.join(obj_dir, unit[:-2] + '.d'), 'w') as f:
+                    f.write(f"x.o: {unit} util.h\n")
+            return b''
+        
+        client = Mock()
+        client.containers.run.side_effect = fake_run
+        files = {'main.c': 'int main(){}', 'util.c': 'int f(){}', 'util.h': 'int f();'}
+        with tempfile.TemporaryDirectory() as root:
+            project = Project('demo', root)
+            with patch('projects.ensure_base_image_exists', return_value=True):
+                output = io.StringIO()
+                timings = {}
+                exit_code, build = run_project(project, '.c', files, client, output,
+                                               timings=timings)
+                self.assertEqual(exit_code, 0)
+                self.assertEqual(build['compiled'], ['main.c', 'util.c'])
+                self.assertEqual(output.getvalue(), 'ok\n')
+                self.assertEqual(len(commands), 2)
+                # 実行時間はビルドが書いた計測ファイルからは読まない
+                self.assertEqual(timings['compile_ms'], 10)
+                self.assertLess(timings['run_ms'], 1000)
+                
+                # 変更がなければビルドせずに実行だけする
+                exit_code, build = run_project(project, '.c', files, client, output)
+                self.assertEqual(build['compiled'], [])
+                self.assertFalse(build['linked'])
+                self.assertEqual(commands[-1], ['sh', '-c', '/app/obj/main'])
+                self.assertEqual(len(commands), 3)
+                
+                files['util.c'] = 'int f(){return 1;}'
+                exit_code, build = run_project(project, '.c', files, client, output)
+                self.assertEqual(build['compiled'], ['util.c'])
+                self.assertEqual(build['changed'], ['util.c'])
+                with open(os.path.join(project.dir, 'build.sh')) as f:
+                    self.assertIn("-c util.c", f.read())
+    
+    def test_cache_writes_do_not_follow_symlinks(self):
+        """キャッシュ内のシンボリックリンクをたどってホストのファイルを書き換えない"""
+        from projects import Project, read_file
+        with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as outside:
+            target = os.path.join(outside, 'target')
+            with open(target, 'w') as f:
+                f.write('keep')
+            project = Project('demo', root)
+            os.makedirs(project.src)
+            os.makedirs(project.obj)
+            # 以前のサンドボックスが残したリンク
+            os.symlink(target, os.path.join(project.src, 'main.py'))
+            os.symlink(outside, os.path.join(project.src, 'lib'))
+            os.symlink(target, os.path.join(project.dir, 'manifest.json.tmp'))
+            os.symlink(target, os.path.join(project.obj, 'main.d'))
+            project.sync({'main.py': b'print(1)'}, {})
+            with self.assertRaises(OSError):
+                project.sync({'lib/x.py': b'x'}, {})
+            project.save_manifest({'files': {}})
+            with open(target) as f:
+                self.assertEqual(f.read(), 'keep')
+            self.assertEqual(os.listdir(outside), ['target'])
+            self.assertFalse(os.path.islink(os.path.join(project.src, 'main.py')))
+            self.assertIsNone(read_file(project.obj, 'main.d'))
+    
+    def test_invalid_project_id(self):
+        """不正なプロジェクトIDは拒否される"""
+        from projects import Project
+        with self.assertRaises(ValueError):
+            Project('../etc')
+    
+    def test_project_ids_are_issued_by_the_server(self):
+        """クライアントが選んだIDでは既存のキャッシュを使わない"""
+        from projects import ProjectStore
+        with tempfile.TemporaryDirectory() as root:
+            store = ProjectStore(root)
+            os.makedirs(os.path.join(root, 'demo'))
+            self.assertFalse(store.issued('demo'))
+            project_id = store.new_id()
+            self.assertFalse(store.issued(project_id))
+            os.makedirs(os.path.join(root, project_id))
+            self.assertTrue(store.issued(project_id))
+            self.assertFalse(store.issued(None))
+
+
+class TestBenchmark(unittest.TestCase):
+    """ベンチマークモードのテスト"""
+    
+    def test_statistics(self):
+        """実行ごとの計測結果から統計を計算する"""
+        from benchmark import parse_results
+        text = "\n".join([
+            "start 0m0.100000s 0m0.000000s",
+            "run 10000000 0 0m0.110000s 0m0.000000s",
+            "run 30000000 0 0m0.130000s 0m0.010000s",
+            "run 20000000 0 0m0.150000s 0m0.010000s",
+            "peak 2097152",
+        ])
+        results = parse_results(text)
+        self.assertEqual(results['runs'], 3)
+        self.assertEqual(results['wall_ms'], {'min': 10.0, 'median': 20.0, 'stddev': 10.0})
+        self.assertEqual(results['cpu_ms']['min'], 10.0)
+        self.assertEqual(results['cpu_ms']['median'], 20.0)
+        self.assertEqual(results['peak_memory_kb'], 2048)
+        self.assertIsNone(parse_results("peak 1"))
+    
+    def test_loop_runs_in_one_shell(self):
+        """ウォームアップと計測を一つのシェルで実行し、最初の出力だけを残す"""
+        from benchmark import benchmark_command, read_results
+        with tempfile.TemporaryDirectory() as temp_dir:
+            result = subprocess.run(
+                ['sh', '-c', benchmark_command('echo hi; echo x >> count', 3, 2)],
+                cwd=temp_dir, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0)
+            self.assertEqual(result.stdout, 'hi\n')
+            with open(os.path.join(temp_dir, 'count')) as f:
+                self.assertEqual(len(f.readlines()), 5)
+            self.assertEqual(read_results(temp_dir)['runs'], 3)
+            
+            result = subprocess.run(['sh', '-c', benchmark_command('false', 3, 0)],
+                                    cwd=temp_dir, capture_output=True)
+            self.assertEqual(result.returncode, 1)
+            self.assertEqual(read_results(temp_dir)['runs'], 1)
+    
+    def test_limits(self):
+        """実行回数とウォームアップ回数の上限を検証する"""
+        from benchmark import validate
+        for runs, warmup in [(0, 1), (1000, 1), (5, -1), (5, 1000)]:
+            with self.assertRaises(ValueError):
+                validate(runs, warmup)
+    
+    def test_cpus_are_spread(self):
+        """同時実行のベンチマークは別々のCPUに割り当てられる"""
+        from benchmark import CpuPinner
+        pinner = CpuPinner(cpus=[])
+        with pinner.pin('a', [0, 1]) as first, pinner.pin('a', [0, 1]) as second:
+            self.assertEqual({first, second}, {'0', '1'})
+            with pinner.pin('b', [0, 1]) as other:
+                self.assertEqual(other, '0')
+    
+    def test_cpus_follow_node_cpuset(self):
+        """ノードのcpusetに含まれるCPUだけを割り当てる"""
+        from benchmark import CpuPinner, parse_cpuset, local_cpus
+        self.assertEqual(parse_cpuset('0-2,5\n'), [0, 1, 2, 5])
+        self.assertEqual(parse_cpuset(''), [])
+        with tempfile.NamedTemporaryFile('w') as f:
+            f.write('4-5\n')
+            f.flush()
+            with patch('benchmark.CPUSET_FILE', f.name):
+                self.assertEqual(local_cpus(), [4, 5])
+        pinner = CpuPinner(cpus=[])
+        with pinner.pin('a', [4, 5]) as first, pinner.pin('a', [4, 5]) as second:
+            self.assertEqual({first, second}, {'4', '5'})
+        with patch.dict(os.environ, {'CODE_RUNNER_BENCHMARK_CPUS': '2-3'}):
+            self.assertEqual(CpuPinner().cpus, [2, 3])
+    
+    def test_pinned_container(self):
+        """ベンチマークはCPUを固定した一つのコンテナで実行される"""
+        from run_code import run_code_in_docker
+        client = Mock()
+        client.containers.run.return_value = b'ok\n'
+        with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as f:
+            f.write('print("ok")')
+        try:
+            benchmark = {'runs': 5, 'warmup': 1, 'cpus': '1'}
+            with patch('run_code.ensure_base_image_exists', return_value=True):
+                run_code_in_docker(f.name, client=client, output=Mock(), benchmark=benchmark)
+        finally:
+            os.unlink(f.name)
+        client.containers.run.assert_called_once()
+        args, kwargs = client.containers.run.call_args
+        self.assertEqual(kwargs['cpuset_cpus'], '1')
+        self.assertIn('while [ $i -lt 5 ]', args[1])
+        self.assertIn('results', benchmark)
+
+
+class TestTemplateBenchmark(unittest.TestCase):
+    """テンプレートベンチマークスクリプトのテスト"""
+    
+    def setUp(self):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                        '..', 'scripts'))
+    
+    def test_every_language_has_a_template(self):
+        """すべての言語のFibonacciテンプレートが見つかる"""
+        from benchmark_templates import find_templates
+        templates = find_templates()
+        self.assertEqual(set(templates),
+                         {'python', 'javascript', 'ruby', 'php', 'java', 'c', 'cpp', 'csharp'})
+        self.assertEqual(templates['java'][1].name, 'Solution.java')
+    
+    def test_image_info(self):
+        """ビルド済みイメージのサイズと未ビルドのイメージを返す"""
+        import docker
+        from build_base_images import image_info
+        image = Mock()
+        image.attrs = {'Created': '2024-01-02T03:04:05.000Z', 'Size': 50 * 1024 * 1024}
+        
+        def get(tag):
+            if tag != 'code-runner-c-base':
+                raise docker.errors.ImageNotFound(tag)
+            return image
+        
+        client = Mock()
+        client.images.get.side_effect = get
+        info = {entry['language']: entry for entry in image_info(client)}
+        self.assertEqual(info['c']['size_mb'], 50.0)
+        self.assertEqual(info['c']['created'], '2024-01-02 03:04:05')
+        self.assertIsNone(info['python']['size_mb'])
+
+
+class TestProfiler(unittest.TestCase):
+    """プロファイルモードのテスト"""
+    
+    def write(self, directory, name, content):
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write(content)
+    
+    def test_commands(self):
+        """各言語のプロファイラでプログラムを実行する"""
+        from profiler import profile_command
+        self.assertEqual(profile_command('.py', None, 'python main.py')[1],
+                         'python -m cProfile -o .profile.pstats main.py')
+        self.assertIn('--cpu-prof', profile_command('.js', None, 'node main.js')[1])
+        compile_cmd, run_cmd = profile_command('.c', 'gcc -O0 -o main main.c -lm', './main')
+        self.assertIn('-pg', compile_cmd)
+        self.assertIn('gprof', run_cmd)
+        self.assertIn('StartFlightRecording', profile_command('.java', 'javac Solution.java',
+                                                              'java Solution')[1])
+        with self.assertRaises(ValueError):
+            profile_command('.rb', None, 'ruby main.rb')
+    
+    def test_python_profile(self):
+        """cProfileの結果から上位関数と折りたたみスタックを作る"""
+        import cProfile
+        from profiler import read_profile
+        
+        def leaf():
+            return sum(range(10000))
+        
+        def caller():
+            return [leaf() for _ in range(20)]
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            profile = cProfile.Profile()
+            profile.runcall(caller)
+            profile.dump_stats(os.path.join(temp_dir, '.profile.pstats'))
+            result = read_profile('.py', temp_dir)
+        self.assertEqual(result['tool'], 'cProfile')
+        functions = [entry['function'] for entry in result['top']]
+        self.assertTrue(any(name.startswith('leaf ') for name in functions))
+        self.assertRegex(result['folded'], r'^caller \(.*;leaf \(')
+    
+    def test_node_profile(self):
+        """node --cpu-profの結果をスタックごとに集計する"""
+        import json
+        from profiler import read_profile
+        profile = {
+            'nodes': [
+                {'id': 1, 'callFrame': {'functionName': '(root)', 'url': '', 'lineNumber': -1},
+                 'children': [2]},
+                {'id': 2, 'callFrame': {'functionName': 'main', 'url': 'file:///app/main.js',
+                                        'lineNumber': 0}, 'children': [3]},
+                {'id': 3, 'callFrame': {'functionName': 'fib', 'url': 'file:///app/main.js',
+                                        'lineNumber': 4}},
+            ],
+            'samples': [3, 3, 2],
+            'timeDeltas': [1000, 1000, 500],
+        }
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.write(temp_dir, '.profile.cpuprofile', json.dumps(profile))
+            result = read_profile('.js', temp_dir)
+        self.assertEqual(result['top'][0], {'function': 'fib (main.js:5)', 'self_ms': 2.0})
+        self.assertEqual(result['folded'].splitlines(),
+                         ['main (main.js:1);fib (main.js:5) 2000', 'main (main.js:1) 500'])
+    
+    def test_gprof_profile(self):
+        """gprofのフラットプロファイルを読み込む"""
+        from profiler import read_profile
+        text = """Flat profile:
+
+Each sample counts as 0.01 seconds.
+  %   cumulative   self              self     total
+ time   seconds   seconds    calls  ms/call  ms/call  name
+ 60.00      0.06     0.06        1    60.00   100.00  fib(int)
+ 40.00      0.10     0.04                             main
+"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.write(temp_dir, '.profile.gprof', text)
+            result = read_profile('.cpp', temp_dir)
+        self.assertEqual(result['top'], [{'function': 'fib(int)', 'self_ms': 60.0, 'calls': 1},
+                                         {'function': 'main', 'self_ms': 40.0}])
+    
+    def test_jfr_profile(self):
+        """JFRの実行サンプルを関数ごとに数える"""
+        import json
+        from profiler import read_profile
+        
+        def frame(cls, method):
+            return {'method': {'type': {'name': cls}, 'name': method}}
+        
+        sample = {'values': {'stackTrace': {'frames': [frame('Solution', 'fib'),
+                                                       frame('Solution', 'main')]}}}
+        recording = {'recording': {'events': [sample, sample]}}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.write(temp_dir, '.profile.jfr.json', json.dumps(recording))
+            result = read_profile('.java', temp_dir)
+        self.assertEqual(result['top'][0]['function'], 'Solution.fib')
+        self.assertEqual(result['top'][0]['samples'], 2)
+        self.assertEqual(result['folded'], 'Solution.main;Solution.fib 20000')
+    
+    def test_folded_size_cap(self):
+        """折りたたみスタックは上限サイズで打ち切られる"""
+        from collections import Counter
+        from profiler import _folded
+        stacks = Counter({f'f{i}': 1000 - i for i in range(1000)})
+        with patch('profiler.MAX_FOLDED_BYTES', 100):
+            folded, truncated = _folded(stacks)
+        self.assertTrue(truncated)
+        self.assertLessEqual(len(folded), 100)
+        self.assertTrue(folded.startswith('f0 1000'))
+    
+    def test_dense_call_graph_is_bounded(self):
+        """密な呼び出しグラフでもスタックの再構築は有限の手数で終わる"""
+        import time
+        import marshal
+        from profiler import read_profile, MAX_STACK_NODES
+        funcs = [('main.py', i, f'f{i}') for i in range(40)]
+        stats = {}
+        for i, func in enumerate(funcs):
+            callers = {caller: (1, 1, 0.001, 1.0) for caller in funcs[:i]}
+            stats[func] = (i + 1, i + 1, 0.001, 1.0, callers)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, '.profile.pstats'), 'wb') as f:
+                marshal.dump(stats, f)
+            started = time.monotonic()
+            result = read_profile('.py', temp_dir)
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertTrue(result['truncated'])
+        self.assertLessEqual(len(result['folded'].splitlines()), MAX_STACK_NODES)
+    
+    def test_profile_symlink_is_not_followed(self):
+        """プロファイルがシンボリックリンクならホストのファイルを読まない"""
+        from profiler import read_profile
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.write(temp_dir, 'secret', ' 60.00 0.06 0.06 1 60.00 100.00 secret\n')
+            os.symlink(os.path.join(temp_dir, 'secret'), os.path.join(temp_dir, '.profile.gprof'))
+            result = read_profile('.c', temp_dir)
+        self.assertNotIn('top', result)
+        self.assertIn('error', result)
+    
+    def test_missing_profile(self):
+        """プロファイルが書かれなかった場合はNoneを返す"""
+        from profiler import read_profile
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.assertIsNone(read_profile('.py', temp_dir))
+
+
+class TestTracing(unittest.TestCase):
+    """リクエストトレースのテスト"""
+    
+    def test_spans_nest_and_keep_attributes(self):
+        """スパンは入れ子の深さと属性を記録する"""
+        from tracing import span, start_trace, TraceBuffer
+        buffer = TraceBuffer()
+        with start_trace('POST /run', buffer=buffer) as trace:
+            with span('ensure_image', image='code-runner-python-base'):
+                with span('docker_client') as attrs:
+                    attrs['cached'] = True
+        spans = buffer.get(trace.id)['spans']
+        self.assertEqual([(s['name'], s['depth']) for s in spans],
+                         [('ensure_image', 0), ('docker_client', 1)])
+        self.assertEqual(spans[1]['attrs'], {'cached': True})
+        self.assertGreaterEqual(spans[0]['duration_ms'], spans[1]['duration_ms'])
+    
+    def test_spans_outside_a_trace_are_ignored(self):
+        """トレース外のスパンは何も記録しない"""
+        from tracing import span, current
+        with span('container_run') as attrs:
+            attrs['ignored'] = True
+        self.assertIsNone(current())
+    
+    def test_ring_buffer_is_bounded(self):
+        """リングバッファは最新のトレースだけを保持する"""
+        from tracing import start_trace, TraceBuffer
+        buffer = TraceBuffer(size=3)
+        ids = []
+        for i in range(5):
+            with start_trace(f'request {i}', buffer=buffer) as trace:
+                ids.append(trace.id)
+        self.assertEqual([t['id'] for t in buffer.list()], ids[:1:-1])
+        self.assertIsNone(buffer.get(ids[0]))
+        self.assertEqual(len(buffer.list(limit=1)), 1)
+
+    def test_traces_are_shared_through_the_supervisor(self):
+        """各ワーカーのトレースはスーパーバイザーのバッファで共有される"""
+        import threading
+        from rpc import RpcServer, call
+        from tracing import start_trace, TraceBuffer
+        shared = TraceBuffer()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            socket_path = os.path.join(temp_dir, 'supervisor.sock')
+            server = RpcServer(socket_path, {'trace_add': shared.add, 'trace_get': shared.get,
+                                             'traces': shared.list})
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                ids = []
+                for worker in ('worker 1', 'worker 2'):
+                    with start_trace(f'POST /run ({worker})', buffer=None) as trace:
+                        pass
+                    call('trace_add', socket_path=socket_path, trace=trace.to_dict())
+                    ids.append(trace.id)
+                self.assertEqual(call('trace_get', socket_path=socket_path,
+                                      trace_id=ids[0])['name'], 'POST /run (worker 1)')
+                self.assertEqual([t['id'] for t in call('traces', socket_path=socket_path)],
+                                 ids[::-1])
+            finally:
+                server.shutdown()
+                server.server_close()
+    
+    def test_server_timing_header(self):
+        """Server-Timingヘッダーの形式で出力する"""
+        from tracing import Trace, server_timing
+        trace = Trace('POST /run')
+        trace.add('rpc.run', 1.0, 12.5)
+        trace.add('container run', 2.0, 10.25, depth=1)
+        trace.duration_ms = 14.0
+        self.assertEqual(server_timing(trace),
+                         'rpc.run;dur=12.5, container_run;dur=10.25, total;dur=14.0')
+
+
+class TestJudge(unittest.TestCase):
+    """ストリーミング判定のテスト"""
+    
+    def compare(self, mode, expected, chunks, tolerance=None):
+        import io
+        from judge import make_comparator
+        comparator = make_comparator(mode, io.BytesIO(expected), tolerance)
+        for chunk in chunks:
+            if not comparator.feed(chunk):
+                return False, comparator.mismatch
+        return comparator.finish(), comparator.mismatch
+    
+    def bytewise(self, data):
+        return [data[i:i + 1] for i in range(len(data))]
+    
+    def test_token_mode(self):
+        """トークン単位ではチャンクの境界や空白の違いを無視する"""
+        expected = b"1 2\n3\n"
+        self.assertEqual(self.compare('token', expected, self.bytewise(b"1\t2 3")), (True, None))
+        ok, mismatch = self.compare('token', expected, [b"1 2 4\n"])
+        self.assertFalse(ok)
+        self.assertEqual(mismatch, {'unit': 'token', 'position': 2, 'expected': '3',
+                                    'actual': '4'})
+        self.assertEqual(self.compare('token', expected, [b"1 2"])[1]['actual'], None)
+        self.assertEqual(self.compare('token', expected, [b"1 2 3 4"])[1]['expected'], None)
+    
+    def test_float_tolerance(self):
+        """浮動小数点の誤差を許容する"""
+        expected = b"3.14159 100\n"
+        self.assertTrue(self.compare('token', expected, [b"3.14160 100.0"], 1e-4)[0])
+        self.assertFalse(self.compare('token', expected, [b"3.15 100"], 1e-4)[0])
+        self.assertFalse(self.compare('token', expected, [b"3.14160 100.0"])[0])
+        self.assertFalse(self.compare('token', b"nan", [b"nan1"], 1e-4)[0])
+        with self.assertRaises(ValueError):
+            self.compare('exact', expected, [], 1e-4)
+    
+    def test_whitespace_mode(self):
+        """行単位で末尾の空白と末尾の空行を無視する"""
+        expected = b"a  b\nc\n\n\n"
+        self.assertTrue(self.compare('whitespace', expected, self.bytewise(b"a b \nc"))[0])
+        ok, mismatch = self.compare('whitespace', b"a\n\nb\n", [b"a\nb\n"])
+        self.assertFalse(ok)
+        self.assertEqual((mismatch['position'], mismatch['expected'], mismatch['actual']),
+                         (1, '', 'b'))
+        self.assertFalse(self.compare('whitespace', b"a b\n", [b"a\nb\n"])[0])
+    
+    def test_exact_mode(self):
+        """バイト単位の比較で最初の不一致の位置を返す"""
+        self.assertTrue(self.compare('exact', b"hello\n", [b"hel", b"lo\n"])[0])
+        ok, mismatch = self.compare('exact', b"hello\n", [b"help"])
+        self.assertEqual(mismatch['position'], 3)
+        self.assertFalse(self.compare('exact', b"hello\n", [b"hello"])[0])
+    
+    def make_container(self, stream):
+        """execの出力を返すダミーのサンドボックス"""
+        container = Mock()
+        container.client.api.exec_create.return_value = {'Id': 'exec'}
+        container.client.api.exec_start.return_value = stream
+        return container
+    
+    def run_judged(self, container, filename, code, expected, **kwargs):
+        from judge import run_judged
+        client = Mock()
+        client.containers.run.return_value = container
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source = os.path.join(temp_dir, filename)
+            expected_path = os.path.join(temp_dir, 'expected.txt')
+            with open(source, 'w') as f:
+                f.write(code)
+            with open(expected_path, 'wb') as f:
+                f.write(expected)
+            with patch('judge.ensure_base_image_exists', return_value=True):
+                return run_judged(source, expected_path, client, **kwargs)
+    
+    def test_mismatch_kills_sandbox(self):
+        """不一致が見つかった時点で出力の読み込みをやめてサンドボックスを破棄する"""
+        consumed = []
+        
+        def stream():
+            for chunk in [b"1\n", b"2\n", b"9\n", b"4\n"]:
+                consumed.append(chunk)
+                yield chunk, None
+        
+        container = self.make_container(stream())
+        result = self.run_judged(container, 'main.py', 'print(1)', b"1\n2\n3\n4\n")
+        self.assertEqual(result['verdict'], 'wrong_answer')
+        self.assertIsNone(result['exit_code'])
+        self.assertEqual(result['mismatch']['position'], 2)
+        self.assertEqual(len(consumed), 3)
+        container.remove.assert_called_once_with(force=True)
+        container.client.api.exec_inspect.assert_not_called()
+    
+    def test_time_limit_kills_sandbox(self):
+        """時間制限を超えたプログラムは出力がなくても強制終了する"""
+        import threading
+        killed = threading.Event()
+        
+        def stream():
+            yield b"1\n", None
+            # 出力せずに止まったまま、サンドボックスが削除されると接続が切れる
+            killed.wait(5)
+            raise ConnectionError("connection closed")
+        
+        container = self.make_container(stream())
+        container.remove.side_effect = lambda force: killed.set()
+        result = self.run_judged(container, 'main.py', 'print(1)', b"1\n2\n", time_limit=0.1)
+        self.assertEqual(result['verdict'], 'time_limit_exceeded')
+        self.assertIsNone(result['exit_code'])
+        container.remove.assert_called_once_with(force=True)
+    
+    def test_compile_error_is_not_judged(self):
+        """コンパイラの診断は出力として比較せずcompile_errorにする"""
+        container = self.make_container(iter([]))
+        container.exec_run.return_value = (1, (b"main.c:1: error: expected ';'\n", None))
+        result = self.run_judged(container, 'main.c', 'int main() {', b"main.c:1: error\n")
+        self.assertEqual(result['verdict'], 'compile_error')
+        self.assertEqual(result['exit_code'], 1)
+        self.assertIn("expected ';'", result['stderr'])
+        self.assertEqual(result['bytes'], 0)
+        self.assertIn('compile_ms', result['timings'])
+        container.client.api.exec_start.assert_not_called()
+    
+    def test_compiled_program_is_judged_after_compiling(self):
+        """コンパイルに成功したら実行の出力だけを判定する"""
+        container = self.make_container(iter([(b"42\n", None)]))
+        container.exec_run.return_value = (0, (b"", b"warning: unused\n"))
+        container.client.api.exec_inspect.return_value = {'ExitCode': 0}
+        result = self.run_judged(container, 'main.c', 'int main() {}', b"42\n")
+        self.assertEqual(result['verdict'], 'accepted')
+        self.assertEqual(sorted(result['timings']), ['compile_ms', 'run_ms'])
+        self.assertEqual(container.client.api.exec_create.call_args[0][1], './main')
+
+
+class TestWarmup(unittest.TestCase):
+    """起動時のウォームアップのテスト"""
+    
+    def make_warmup(self, run, healthy=True):
+        from warmup import Warmup
+        node = Mock(drained=not healthy, last_check=1.0 if healthy else None)
+        nodes = Mock(nodes=[node])
+        autoscaler = Mock()
+        autoscaler.rebalance.return_value = {'.py': {'concurrency': 1, 'warm': 1}}
+        return Warmup(nodes, autoscaler, run, ['.py', '.c', '.sh']), nodes
+    
+    def test_ready_after_canaries(self):
+        """カナリア実行が終わるとレディになり、失敗した言語は報告される"""
+        def run(ext, code):
+            if ext == '.c':
+                return {'output': 'Error: compile failed\n', 'exit_code': 1}
+            return {'output': 'Hello World!\n', 'exit_code': 0}
+        
+        warmup, nodes = self.make_warmup(run)
+        self.assertFalse(warmup.ready)
+        with patch('warmup.ensure_base_image_exists', return_value=True):
+            self.assertTrue(warmup.warm_up())
+        report = warmup.report()
+        self.assertTrue(report['ready'])
+        self.assertEqual(sorted(report['languages']), ['.c', '.py'])
+        self.assertTrue(report['languages']['.py']['ok'])
+        self.assertFalse(report['languages']['.c']['ok'])
+        self.assertIn('compile failed', report['languages']['.c']['error'])
+        nodes.apply.assert_called_once_with({'.py': {'concurrency': 1, 'warm': 1}})
+        self.assertIn('canaries', [entry['name'] for entry in report['trace']['spans']])
+    
+    def test_not_ready_without_working_language(self):
+        """イメージがない、または全カナリアが失敗した場合はレディにならない"""
+        run = Mock(return_value={'output': 'Hello World!\n', 'exit_code': 0})
+        warmup, nodes = self.make_warmup(run)
+        with patch('warmup.ensure_base_image_exists', return_value=False):
+            self.assertFalse(warmup.warm_up())
+        run.assert_not_called()
+        self.assertEqual(warmup.report()['state'], 'failed')
+        self.assertFalse(warmup.report()['languages']['.py']['image'])
+        
+        warmup, nodes = self.make_warmup(run, healthy=False)
+        self.assertFalse(warmup.warm_up())
+        self.assertEqual(warmup.report()['error'], 'No healthy executor node')
+        nodes.apply.assert_not_called()
+    
+    def test_disabled(self):
+        """無効にした場合はすぐにレディになる"""
+        from warmup import Warmup
+        warmup = Warmup(Mock(), Mock(), Mock(), ['.py'], enabled=False)
+        warmup.start()
+        self.assertTrue(warmup.report()['ready'])
+
+
+class TestReaper(unittest.TestCase):
+    """バックグラウンドの後片付けのテスト"""
+    
+    def make_node(self, containers=(), volumes=(), local=True):
+        node = mock_node(local=local)
+        node.client.containers.list.return_value = list(containers)
+        node.client.volumes.list.return_value = list(volumes)
+        node.client.images.prune.return_value = {'ImagesDeleted': [{'Deleted': 'sha256:1'}],
+                                                 'SpaceReclaimed': 1000}
+        return node
+    
+    def test_reaps_old_objects_not_held(self):
+        """保持されていない古いコンテナ・ボリューム・一時ディレクトリだけを削除する"""
+        import time
+        from reaper import Reaper
+        now = time.time()
+        old, held, young = Mock(id='old'), Mock(id='held'), Mock(id='young')
+        old.attrs = {'Created': now - 7200, 'Labels': {'code-runner.kind': 'run'}}
+        held.attrs = {'Created': now - 7200}
+        young.attrs = {'Created': now - 60}
+        volume = Mock()
+        volume.name = 'code-runner-session-1'
+        volume.attrs = {'CreatedAt': '1970-01-01T00:00:00Z'}
+        node = self.make_node([old, held, young], [volume])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = {name: os.path.join(temp_dir, name) for name in
+                     ('code-runner-leaked', 'code-runner-compiler-live', 'code-runner-new',
+                      'other')}
+            for path in paths.values():
+                os.makedirs(path)
+            for name in ('code-runner-leaked', 'code-runner-compiler-live', 'other'):
+                os.utime(paths[name], (time.time() - 7200,) * 2)
+            live = {'containers': {'held'}, 'volumes': set(),
+                    'paths': {paths['code-runner-compiler-live']}}
+            reaper = Reaper(Mock(nodes=[node]), lambda: live, temp_dir=temp_dir, max_age=3600,
+                            high_water=1.0, clock=lambda: now)
+            reaper.reap()
+            self.assertEqual(sorted(os.listdir(temp_dir)),
+                             ['code-runner-compiler-live', 'code-runner-new', 'other'])
+        old.remove.assert_called_once_with(force=True)
+        held.remove.assert_not_called()
+        young.remove.assert_not_called()
+        volume.remove.assert_called_once_with(force=True)
+        node.client.containers.list.assert_called_once_with(
+            all=True, sparse=True, filters={'label': 'code-runner.kind'})
+        metrics = reaper.report()
+        self.assertEqual((metrics['containers_reaped'], metrics['volumes_reaped'],
+                          metrics['temp_reaped'], metrics['images_pruned'],
+                          metrics['image_bytes_reclaimed'], metrics['passes']),
+                         (1, 1, 1, 1, 1000, 1))
+    
+    def test_evicts_caches_above_high_water(self):
+        """ディスク使用率が高水位を超えたらキャッシュを古い順に追い出す"""
+        from collections import namedtuple
+        from reaper import Reaper
+        Usage = namedtuple('Usage', 'total used free')
+        used = [95]
+        
+        def evict():
+            used[0] -= 5
+            return 5
+        
+        node = self.make_node()
+        node.client.api.prune_builds.side_effect = lambda: used.__setitem__(0, 70) or \
+            {'SpaceReclaimed': 300}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            reaper = Reaper(Mock(nodes=[node]), lambda: {'containers': set(), 'volumes': set(),
+                                                         'paths': set()},
+                            evict=evict, temp_dir=temp_dir, high_water=0.85)
+            with patch('reaper.shutil.disk_usage', lambda path: Usage(100, used[0], 0)):
+                reaper.reap()
+        metrics = reaper.report()
+        self.assertEqual(used[0], 80)
+        self.assertEqual((metrics['caches_evicted'], metrics['cache_bytes_evicted'],
+                          metrics['disk_pressure_passes']), (3, 15, 1))
+        node.client.api.prune_builds.assert_not_called()
+        
+        # 追い出すキャッシュがなくなったらビルドキャッシュを削除する
+        used[0] = 95
+        with tempfile.TemporaryDirectory() as temp_dir:
+            reaper = Reaper(Mock(nodes=[node]), lambda: {'containers': set(), 'volumes': set(),
+                                                         'paths': set()},
+                            evict=lambda: None, temp_dir=temp_dir, high_water=0.85)
+            with patch('reaper.shutil.disk_usage', lambda path: Usage(100, used[0], 0)):
+                reaper.reap()
+        self.assertEqual(reaper.report()['build_cache_bytes_reclaimed'], 300)
+    
+    def test_project_cache_eviction_order(self):
+        """実行されていないプロジェクトを最も古いものから削除する"""
+        import time
+        from projects import ProjectStore, MANIFEST
+        with tempfile.TemporaryDirectory() as root:
+            store = ProjectStore(root)
+            for age, project_id in enumerate(['new', 'middle', 'old']):
+                os.makedirs(os.path.join(root, project_id, 'src'))
+                manifest = os.path.join(root, project_id, MANIFEST)
+                with open(manifest, 'w') as f:
+                    f.write('{}')
+                os.utime(manifest, (time.time() - age * 100,) * 2)
+            self.assertEqual(store.least_recently_used(), ['old', 'middle', 'new'])
+            with store.open('old'):
+                self.assertEqual(store.evict(), 2)
+            self.assertEqual(store.projects, {})
+            self.assertEqual(sorted(os.listdir(root)), ['new', 'old'])
+            store.evict()
+            store.evict()
+            self.assertIsNone(store.evict())
+
+    def test_project_removed_only_after_its_run(self):
+        """実行中のプロジェクトは実行が終わってから削除する"""
+        import threading
+        from projects import ProjectStore
+        with tempfile.TemporaryDirectory() as root:
+            store = ProjectStore(root)
+            with store.open('p') as project:
+                os.makedirs(project.src)
+                with project.lock:
+                    remover = threading.Thread(target=store.remove, args=('p',))
+                    remover.start()
+                    remover.join(0.1)
+                    self.assertTrue(os.path.isdir(project.src))
+                    # 削除待ちの間も同じプロジェクトとロックを共有する
+                    with store.open('p') as again:
+                        self.assertIs(again, project)
+                remover.join()
+                self.assertFalse(os.path.exists(project.dir))
+            self.assertEqual(store.projects, {})
+
+    def test_leased_warm_sandboxes_are_held(self):
+        """実行中のウォームサンドボックスは削除対象にしない"""
+        from pool import WarmPool, run_in_sandbox
+        client = Mock()
+        client.containers.run.side_effect = [Mock(id='first'), Mock(id='second')]
+        pool = WarmPool(client, {'.py': {'base_image': 'python:3'}}, '512m')
+        pool.resize('.py', 2)
+        container = pool.acquire('.py')
+        self.assertEqual(pool.container_ids(), {'first', 'second'})
+        container.exec_run.return_value = (0, b'')
+        with tempfile.TemporaryDirectory() as temp_dir:
+            run_in_sandbox(container, temp_dir, 'true', pool=pool)
+        container.remove.assert_called_once_with(force=True)
+        self.assertEqual(pool.container_ids(), {'first', 'second'} - {container.id})
+
+
 def run_all_tests():
     """すべてのテストを実行"""
     # テストスイートを作成
@@ -289,7 +1729,21 @@ def run_all_tests():
         TestLanguageDetection,
         TestDockerIntegration,
         TestWithMocking,
-        TestErrorHandling
+        TestErrorHandling,
+        TestCompileServer,
+        TestAutoscaler,
+        TestCompileProfiles,
+        TestNodePlacement,
+        TestSupervisorRpc,
+        TestSessions,
+        TestProjects,
+        TestBenchmark,
+        TestTemplateBenchmark,
+        TestProfiler,
+        TestTracing,
+        TestJudge,
+        TestWarmup,
+        TestReaper
     ]
     
     for test_class in test_classes:
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Lightweight per-request tracing.
+
+A trace is the timeline of one request: named spans with their offset from
+the start of the request, duration, nesting depth and a few attributes.
+The current trace lives in a context variable, so ``span()`` is a cheap
+no-op outside of a traced request and follows the request into worker
+threads. Finished traces are kept in a bounded in-memory ring buffer; the
+API workers hand theirs to the supervisor, whose buffer they all share.
+
+Spans recorded by the supervisor are returned over the RPC (see ``rpc.py``)
+and merged into the API worker's trace. This module only uses the standard
+library so the API workers can import it without the engine's dependencies.
+"""
+
+import os
+import re
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+BUFFER_SIZE = int(os.environ.get('CODE_RUNNER_TRACE_BUFFER', '200'))
+
+# Spans listed in a Server-Timing header
+MAX_SERVER_TIMING = 32
+
+_current = contextvars.ContextVar('code_runner_trace', default=None)
+_depth = contextvars.ContextVar('code_runner_span_depth', default=0)
+
+
+class Trace:
+    """The spans recorded for one request."""
+
+    def __init__(self, name, trace_id=None):
+        self.id = trace_id or uuid.uuid4().hex[:16]
+        self.name = name
+        self.start = time.time()
+        self.duration_ms = None
+        self.spans = []
+        self.lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def elapsed_ms(self, since=None):
+        return (time.perf_counter() - (self._started if since is None else since)) * 1000
+
+    def add(self, name, start_ms, duration_ms, depth=0, attrs=None):
+        entry = {'name': name, 'start_ms': round(start_ms, 3),
+                 'duration_ms': round(duration_ms, 3), 'depth': depth}
+        if attrs:
+            entry['attrs'] = attrs
+        with self.lock:
+            self.spans.append(entry)
+
+    def merge(self, remote):
+        """Add the spans of a trace recorded elsewhere on this host.
+
+        They are shifted by the difference of the traces' start times and
+        nested below the span open in the caller.
+        """
+        offset = (remote['start'] - self.start) * 1000
+        depth = _depth.get()
+        for entry in remote['spans']:
+            self.add(entry['name'], entry['start_ms'] + offset, entry['duration_ms'],
+                     depth + entry['depth'], entry.get('attrs'))
+
+    def finish(self):
+        self.duration_ms = round(self.elapsed_ms(), 3)
+
+    def to_dict(self):
+        with self.lock:
+            spans = sorted(self.spans, key=lambda entry: entry['start_ms'])
+        return {
+            'id': self.id,
+            'name': self.name,
+            'start': self.start,
+            'duration_ms': self.duration_ms,
+            'spans': spans,
+        }
+
+
+class TraceBuffer:
+    """Ring buffer of the most recent finished traces, kept as dicts."""
+
+    def __init__(self, size=BUFFER_SIZE):
+        self.lock = threading.Lock()
+        self.traces = deque(maxlen=size)
+
+    def add(self, trace):
+        """Keep a finished ``Trace`` or the dict of one recorded elsewhere."""
+        if isinstance(trace, Trace):
+            trace = trace.to_dict()
+        with self.lock:
+            self.traces.append(trace)
+
+    def list(self, limit=None):
+        """Finished traces, most recent first."""
+        with self.lock:
+            traces = list(reversed(self.traces))
+        return traces[:limit]
+
+    def get(self, trace_id):
+        with self.lock:
+            for trace in self.traces:
+                if trace['id'] == trace_id:
+                    return trace
+        return None
+
+
+TRACES = TraceBuffer()
+
+
+def current():
+    """The trace of the request being handled, or None."""
+    return _current.get()
+
+
+@contextmanager
+def start_trace(name, buffer=TRACES):
+    """Record a trace for the enclosed code and keep it in ``buffer``."""
+    trace = Trace(name)
+    token = _current.set(trace)
+    depth = _depth.set(0)
+    try:
+        yield trace
+    finally:
+        _depth.reset(depth)
+        _current.reset(token)
+        trace.finish()
+        if buffer is not None:
+            buffer.add(trace)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Record the enclosed code as a span of the current trace.
+
+    Yields the span's attribute dict, so the code can add attributes.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield attrs
+        return
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    started = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        _depth.reset(token)
+        duration = trace.elapsed_ms(started)
+        trace.add(name, trace.elapsed_ms() - duration, duration, depth, attrs)
+
+
+def server_timing(trace):
+    """Format a finished trace as a Server-Timing header value."""
+    entries = []
+    for entry in trace.to_dict()['spans'][:MAX_SERVER_TIMING]:
+        token = re.sub(r'[^A-Za-z0-9_.-]', '_', entry['name'])
+        entries.append(f"{token};dur={entry['duration_ms']}")
+    entries.append(f"total;dur={trace.duration_ms}")
+    return ', '.join(entries)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Startup warm-up of the sandbox supervisor.
+
+Runs once in a background thread when the supervisor starts, so the first
+user request after a deploy does not pay for it:
+
+1. connect to every executor node (the first Docker connection);
+2. verify the base image of every language on every healthy node,
+   building it from ``dockerfiles/`` when missing;
+3. run one canary per language, the "Hello World" solution template, through
+   the normal execution path. This starts the Java/C# compile servers and
+   records demand, so the autoscaler keeps a warm sandbox per language;
+4. prime the warm pools from the resulting autoscaler plan.
+
+The supervisor reports ready once this finished (see ``report``). Languages
+whose image or canary failed are listed but do not block readiness, unless
+every canary failed; the warm-up is then retried. Set CODE_RUNNER_WARMUP=0
+to skip it and report ready immediately.
+"""
+
+import os
+import time
+import logging
+import threading
+from pathlib import Path
+
+from run_code import ensure_base_image_exists
+from tracing import span, start_trace
+
+logger = logging.getLogger('code-runner.warmup')
+
+ENABLED = os.environ.get('CODE_RUNNER_WARMUP', '1') != '0'
+
+# Seconds between two warm-up attempts while no node or canary works
+RETRY_INTERVAL = 10.0
+
+CANARY_DIR = Path(__file__).parent.parent / 'templates' / 'solution'
+CANARY_FILES = {
+    '.py': 'solution.py',
+    '.js': 'solution.js',
+    '.rb': 'solution.rb',
+    '.php': 'solution.php',
+    '.java': 'Solution.java',
+    '.c': 'solution.c',
+    '.cpp': 'solution.cpp',
+    '.cs': 'solution.cs',
+}
+
+# Canary output kept in the report when a canary fails
+MAX_ERROR = 500
+
+PENDING = 'pending'
+RUNNING = 'running'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class Warmup:
+    """Warm up the executor nodes and track the supervisor's readiness.
+
+    ``run`` executes a canary: it is called with the language extension and
+    the source code and returns a dict with ``output`` and ``exit_code``.
+    """
+
+    def __init__(self, nodes, autoscaler, run, languages, enabled=ENABLED):
+        self.nodes = nodes
+        self.autoscaler = autoscaler
+        self.run_code = run
+        self.languages = [ext for ext in languages if ext in CANARY_FILES]
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.state = PENDING if enabled else READY
+        self.attempts = 0
+        self.error = None
+        self.results = {}
+        self.trace = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def start(self):
+        """Warm up in a daemon thread, retrying until it succeeds."""
+        if not self.enabled or self._thread is not None:
+            return
+
+        def loop():
+            while not self.warm_up() and not self._stop.wait(RETRY_INTERVAL):
+                pass
+
+        self._thread = threading.Thread(target=loop, name='warmup', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def warm_up(self):
+        """Run all warm-up steps once; return whether the supervisor is ready."""
+        with self.lock:
+            self.state = RUNNING
+            self.attempts += 1
+            self.error = None
+        results = {ext: {} for ext in self.languages}
+        with start_trace('warmup', buffer=None) as trace:
+            try:
+                error = self._warm_up(results)
+            except Exception as e:
+                logger.exception("warm-up failed")
+                error = str(e)
+        with self.lock:
+            self.results = results
+            self.trace = trace.to_dict()
+            self.error = error
+            self.state = FAILED if error else READY
+        if error:
+            logger.warning("warm-up attempt %d failed: %s", self.attempts, error)
+        else:
+            failed = sorted(ext for ext, result in results.items() if not result.get('ok'))
+            logger.info("warm-up finished in %.0f ms%s", trace.duration_ms,
+                        f" ({', '.join(failed)} failed)" if failed else '')
+        return not error
+
+    def _warm_up(self, results):
+        with span('connect'):
+            self.nodes.check_all()
+        healthy = [node for node in self.nodes.nodes if not node.drained and node.last_check]
+        if not healthy:
+            return "No healthy executor node"
+
+        for node in healthy:
+            for ext in self.languages:
+                with span('ensure_image', node=node.name, lang=ext):
+                    try:
+                        ok = ensure_base_image_exists(node.client, ext)
+                    except Exception as e:
+                        logger.warning("base image for %s on %s: %s", ext, node.name, e)
+                        ok = False
+                results[ext]['image'] = results[ext].get('image', True) and ok
+            # Refresh the images the placement prefers
+            node.check()
+
+        threads = [threading.Thread(target=self._canary, args=(ext, results[ext]),
+                                    name=f'canary{ext}')
+                   for ext in self.languages if results[ext]['image']]
+        with span('canaries'):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        if not any(result.get('ok') for result in results.values()):
+            return "Every canary failed"
+
+        with span('prime_pools'):
+            self.nodes.apply(self.autoscaler.rebalance())
+        return None
+
+    def _canary(self, ext, result):
+        code = (CANARY_DIR / CANARY_FILES[ext]).read_text(encoding='utf-8')
+        started = time.perf_counter()
+        try:
+            run = self.run_code(ext, code)
+        except Exception as e:
+            run = {'output': f"Error: {e}\n", 'exit_code': 1}
+        result['canary_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        result['ok'] = run['exit_code'] == 0 and 'Hello World' in run['output']
+        if not result['ok']:
+            result['error'] = run['output'][-MAX_ERROR:]
+            logger.warning("canary for %s failed: %s", ext, result['error'].strip())
+
+    def report(self):
+        """Readiness of the supervisor and the outcome of the last warm-up."""
+        with self.lock:
+            return {
+                'ready': self.ready,
+                'state': self.state,
+                'attempts': self.attempts,
+                'error': self.error,
+                'languages': dict(self.results),
+                'duration_ms': self.trace['duration_ms'] if self.trace else None,
+                'trace': self.trace,
+            }
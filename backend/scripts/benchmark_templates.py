@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Benchmark the runner itself over the shipped Fibonacci templates.
+
+Every template in templates/fibonacci is run through the real engine for
+its language, both cold (a fresh container per run, compiling inside the
+sandbox) and warm (a pre-started sandbox from the warm pool and, for Java
+and C#, the warm compile server). For each language the median end-to-end
+latency of both paths, the compile and run times reported by the engine
+and the base image size are written as a markdown table and as JSON.
+
+Usage:
+    python scripts/benchmark_templates.py [--repeat N] [--languages python,c]
+                                          [--json FILE] [--markdown FILE]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from pathlib import Path
+
+import docker
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'engines'))
+from run_code import LANGUAGE_CONFIGS, SANDBOX_MEM_LIMIT, run_code_in_docker
+from pool import WarmPool
+from compile_server import CompileServers
+from build_base_images import LANGUAGE_CONFIGS as IMAGE_CONFIGS, image_info
+
+TEMPLATES_DIR = Path(__file__).parent.parent / 'templates' / 'fibonacci'
+
+COLUMNS = [
+    ('language', 'Language'),
+    ('cold_ms', 'Cold (ms)'),
+    ('warm_ms', 'Warm (ms)'),
+    ('cold_compile_ms', 'Compile cold (ms)'),
+    ('warm_compile_ms', 'Compile warm (ms)'),
+    ('run_ms', 'Run (ms)'),
+    ('image_size_mb', 'Image (MB)'),
+    ('ok', 'OK'),
+]
+
+
+def find_templates():
+    """Map each language name to its template file and engine extension."""
+    templates = {}
+    for lang, config in IMAGE_CONFIGS.items():
+        ext = next((ext for ext, c in LANGUAGE_CONFIGS.items()
+                    if c['base_image'] == config['image_tag']), None)
+        if ext is None:
+            continue
+        for path in sorted(TEMPLATES_DIR.iterdir()):
+            if path.suffix == ext:
+                templates[lang] = (ext, path)
+                break
+    return templates
+
+
+def timed_run(path, client, pool=None, compilers=None):
+    """Run ``path`` once and return its latency, timings and exit code."""
+    output = io.StringIO()
+    timings = {}
+    started = time.monotonic()
+    # The templates are trusted, so interpreted runs can time themselves
+    exit_code = run_code_in_docker(str(path), client=client, pool=pool, output=output,
+                                   compilers=compilers, timings=timings, time_runs=True)
+    return {
+        'latency_ms': (time.monotonic() - started) * 1000,
+        'exit_code': exit_code,
+        'compile_ms': timings.get('compile_ms'),
+        'run_ms': timings.get('run_ms'),
+    }
+
+
+def median(runs, key):
+    values = [run[key] for run in runs if run[key] is not None]
+    return round(statistics.median(values), 1) if values else None
+
+
+def benchmark_language(ext, path, client, pool, compilers, repeat):
+    cold = [timed_run(path, client) for _ in range(repeat)]
+
+    # Start the compile server and fill the pool outside the measured runs
+    pool.resize(ext, 1)
+    timed_run(path, client, pool, compilers)
+    warm = []
+    for _ in range(repeat):
+        pool.resize(ext, 1)
+        warm.append(timed_run(path, client, pool, compilers))
+    pool.resize(ext, 0)
+
+    return {
+        'cold_ms': median(cold, 'latency_ms'),
+        'warm_ms': median(warm, 'latency_ms'),
+        'cold_compile_ms': median(cold, 'compile_ms'),
+        'warm_compile_ms': median(warm, 'compile_ms'),
+        'run_ms': median(warm, 'run_ms'),
+        'ok': all(run['exit_code'] == 0 for run in cold + warm),
+        'cold': cold,
+        'warm': warm,
+    }
+
+
+def markdown_table(results):
+    def cell(value):
+        if value is None:
+            return '-'
+        if isinstance(value, bool):
+            return '✓' if value else '✗'
+        return str(value)
+
+    lines = [
+        '| ' + ' | '.join(title for _, title in COLUMNS) + ' |',
+        '|' + '|'.join('---' for _ in COLUMNS) + '|',
+    ]
+    for result in results:
+        lines.append('| ' + ' | '.join(cell(result.get(key)) for key, _ in COLUMNS) + ' |')
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the runner over the Fibonacci templates")
+    parser.add_argument('--repeat', type=int, default=3, help='Measured runs per path (default: 3)')
+    parser.add_argument('--languages', help='Comma separated languages (default: all)')
+    parser.add_argument('--json', default='benchmark_templates.json',
+                        help='JSON output file (default: benchmark_templates.json)')
+    parser.add_argument('--markdown', help='Also write the table to this file')
+    args = parser.parse_args()
+
+    templates = find_templates()
+    if args.languages:
+        wanted = [lang.strip() for lang in args.languages.split(',')]
+        unknown = [lang for lang in wanted if lang not in templates]
+        if unknown:
+            print(f"Unknown languages: {', '.join(unknown)}", file=sys.stderr)
+            sys.exit(1)
+        templates = {lang: templates[lang] for lang in wanted}
+
+    client = docker.from_env()
+    pool = WarmPool(client, LANGUAGE_CONFIGS, SANDBOX_MEM_LIMIT)
+    compilers = CompileServers(client, LANGUAGE_CONFIGS)
+    results = []
+    try:
+        for lang, (ext, path) in templates.items():
+            print(f"Benchmarking {lang} ({path.name})...", file=sys.stderr)
+            result = {'language': lang, 'template': path.name}
+            try:
+                result.update(benchmark_language(ext, path, client, pool, compilers, args.repeat))
+            except Exception as e:
+                print(f"  ✗ {lang} failed: {e}", file=sys.stderr)
+                result['error'] = str(e)
+                result['ok'] = False
+            results.append(result)
+    finally:
+        pool.close()
+        compilers.close()
+
+    # Read after the runs, which build missing images
+    sizes = {entry['language']: entry['size_mb'] for entry in image_info(client)}
+    for result in results:
+        result['image_size_mb'] = sizes.get(result['language'])
+
+    table = markdown_table(results)
+    print(table)
+    with open(args.json, 'w') as f:
+        json.dump(results, f, indent=2)
+    if args.markdown:
+        with open(args.markdown, 'w') as f:
+            f.write(table)
+    print(f"Results written to {os.path.abspath(args.json)}", file=sys.stderr)
+    sys.exit(0 if all(result['ok'] for result in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
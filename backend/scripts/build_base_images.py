@@ -40,6 +40,16 @@ LANGUAGE_CONFIGS = {
         'dockerfile': 'Dockerfile.cpp',
         'image_tag': 'code-runner-cpp-base',
         'main_file': 'main.cpp'
+    },
+    'php': {
+        'dockerfile': 'Dockerfile.php',
+        'image_tag': 'code-runner-php-base',
+        'main_file': 'main.php'
+    },
+    'csharp': {
+        'dockerfile': 'Dockerfile.csharp',
+        'image_tag': 'code-runner-csharp-base',
+        'main_file': 'Program.cs'
     }
 }
 
@@ -83,7 +93,9 @@ def build_base_images():
                 tag=config['image_tag'],
                 rm=True,
                 forcerm=True,
-                quiet=False
+                quiet=False,
+                # Same label as engines/pool.py, so the reaper prunes old layers
+                labels={'code-runner.kind': 'image'}
             )
             
             print(f"  ✓ Successfully built {config['image_tag']}")
@@ -96,21 +108,37 @@ def build_base_images():
     return success_count == total_count
 
 
+def image_info(client=None):
+    """Return creation time and size of each code-runner base image.
+
+    ``created`` and ``size_mb`` are None for images that are not built.
+    """
+    client = client or docker.from_env()
+    info = []
+    for lang, config in LANGUAGE_CONFIGS.items():
+        entry = {'language': lang, 'image_tag': config['image_tag'],
+                 'created': None, 'size_mb': None}
+        try:
+            image = client.images.get(config['image_tag'])
+            entry['created'] = image.attrs['Created'][:19].replace('T', ' ')
+            entry['size_mb'] = round(image.attrs['Size'] / (1024 * 1024), 1)
+        except docker.errors.ImageNotFound:
+            pass
+        info.append(entry)
+    return info
+
+
 def list_images():
     """List all code-runner base images."""
-    client = docker.from_env()
-    
     print("Code Runner Base Images:")
     print("-" * 40)
     
-    for lang, config in LANGUAGE_CONFIGS.items():
-        try:
-            image = client.images.get(config['image_tag'])
-            created = image.attrs['Created'][:19].replace('T', ' ')
-            size_mb = round(image.attrs['Size'] / (1024 * 1024), 1)
-            print(f"{lang:<12} {config['image_tag']:<25} {created} {size_mb:>6}MB")
-        except docker.errors.ImageNotFound:
-            print(f"{lang:<12} {config['image_tag']:<25} NOT BUILT")
+    for entry in image_info():
+        if entry['size_mb'] is None:
+            print(f"{entry['language']:<12} {entry['image_tag']:<25} NOT BUILT")
+        else:
+            print(f"{entry['language']:<12} {entry['image_tag']:<25} "
+                  f"{entry['created']} {entry['size_mb']:>6}MB")
 
 
 def clean_images():
@@ -0,0 +1,20 @@
+#!/bin/bash
+# Start the sandbox supervisor and the stateless API workers next to it.
+# When either exits the other is stopped and the script exits with its
+# status, so the container restarts instead of serving without a supervisor.
+set -e
+
+python engines/supervisor.py &
+supervisor=$!
+
+uvicorn app:app --host 0.0.0.0 --port 8000 --workers "${WEB_CONCURRENCY:-4}" &
+api=$!
+
+trap 'kill -TERM $supervisor $api 2>/dev/null' TERM INT
+
+set +e
+wait -n $supervisor $api
+status=$?
+kill -TERM $supervisor $api 2>/dev/null
+wait
+exit $status